@@ -0,0 +1,64 @@
+"""
+Compare the time taken to read one epoch of bodies from the per-body
+pickle cache and from the memory mapped packed cache.
+
+    python -m benchmarks.cache_read_benchmark \\
+        --dataset_file /path/to/dataset.json \\
+        --dataset_dir /path/to/processed
+
+Both caches are built before any timing is done.  For a fair comparison
+you may want to drop the OS page cache between runs.
+"""
+import argparse
+import copy
+import time
+
+from models.brepnet import BRepNet
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.packed_cache import PackedCache, convert_pickle_cache_to_packed
+
+
+def time_epoch(dataset, num_epochs):
+    """
+    Read every body in the dataset num_epochs times and return
+    the mean time for one epoch
+    """
+    start = time.perf_counter()
+    for epoch in range(num_epochs):
+        for i in range(len(dataset)):
+            dataset[i]
+    return (time.perf_counter() - start) / num_epochs
+
+
+def run_benchmark(opts):
+    pickle_opts = copy.copy(opts)
+    pickle_opts.cache_format = "pickle"
+    pickle_dataset = BRepNetDataset(pickle_opts, opts.split)
+
+    # Make sure the per-body cache is complete
+    for i in range(len(pickle_dataset)):
+        pickle_dataset[i]
+
+    if not PackedCache.exists(pickle_dataset.packed_cache_dir):
+        convert_pickle_cache_to_packed(pickle_dataset)
+
+    packed_opts = copy.copy(opts)
+    packed_opts.cache_format = "packed"
+    packed_dataset = BRepNetDataset(packed_opts, opts.split)
+
+    num_bodies = len(pickle_dataset)
+    pickle_time = time_epoch(pickle_dataset, opts.num_epochs)
+    packed_time = time_epoch(packed_dataset, opts.num_epochs)
+    print(f"Bodies in {opts.split}: {num_bodies}")
+    print(f"Pickle cache epoch read time {pickle_time:.3f}s  ({num_bodies/pickle_time:.1f} bodies/s)")
+    print(f"Packed cache epoch read time {packed_time:.3f}s  ({num_bodies/packed_time:.1f} bodies/s)")
+    print(f"Speedup {pickle_time/packed_time:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument("--split", type=str, default="training_set", help="The split of the dataset to read")
+    parser.add_argument("--num_epochs", type=int, default=3, help="Number of epochs to average over")
+    opts = parser.parse_args()
+    run_benchmark(opts)
@@ -0,0 +1,136 @@
+"""
+Compare the peak memory and time of a training step with and without
+activation checkpointing, on a synthetic batch.
+
+    python -m benchmarks.checkpoint_benchmark --batch_size 50
+
+Each mode in CHECKPOINT_MODES sets --checkpoint_layers and
+--checkpoint_encoders.  The model uses the features and, unless
+--with_grids is 0, the face, edge and coedge point grids.  For each mode we report
+
+    - The peak memory of the forward and backward pass, above the
+      memory used by the model and the batch
+    - The time for the forward and backward pass
+
+On a GPU the peak memory comes from the CUDA allocator.  On the CPU
+each mode runs in a new process and we use the peak resident set size
+of the process, so the numbers are less exact.  The processes ask
+glibc to give large blocks back to the system as soon as they are
+freed, so the resident set size follows the memory in use.  The ratio of the
+memory saved to the extra time tells you how much larger a batch
+or solid you can fit with --checkpoint_layers.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.topology_benchmark import time_function
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import BRepNet
+
+# The values of --checkpoint_layers and --checkpoint_encoders for each mode
+CHECKPOINT_MODES = {
+    "none": (0, 0),
+    "layers": (1, 0),
+    "layers+encoders": (1, 1)
+}
+
+
+def peak_rss_bytes():
+    """
+    The peak resident set size of this process.  ru_maxrss
+    is in bytes on macOS and Kb elsewhere
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss*1024
+
+
+def create_model(checkpoint_mode, num_filters, num_layers, kernel_file, with_grids, device):
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    checkpoint_layers, checkpoint_encoders = CHECKPOINT_MODES[checkpoint_mode]
+    opts = parser.parse_args([
+        "--dataset_file", "",
+        "--dataset_dir", ".",
+        "--kernel", kernel_file,
+        "--use_face_grids", str(with_grids),
+        "--use_edge_grids", str(with_grids),
+        "--use_coedge_grids", str(with_grids),
+        "--use_face_features", "1",
+        "--use_edge_features", "1",
+        "--use_coedge_features", "1",
+        "--num_filters", str(num_filters),
+        "--num_layers", str(num_layers),
+        "--checkpoint_layers", str(checkpoint_layers),
+        "--checkpoint_encoders", str(checkpoint_encoders)
+    ])
+    torch.manual_seed(0)
+    return BRepNet(opts).to(device)
+
+
+def measure_training_step(checkpoint_mode, batch_size, num_filters, num_layers, kernel_file, with_grids, num_repeats, device):
+    """
+    Find the peak memory above the model and batch, and the time
+    of a training step
+    """
+    model = create_model(checkpoint_mode, num_filters, num_layers, kernel_file, with_grids, device)
+    model.train()
+    batch = brepnet_collate_fn(make_synthetic_batch(batch_size, kernel_file, with_grids=with_grids)).to(device)
+
+    def training_step():
+        model.zero_grad(set_to_none=True)
+        model.brepnet_step(batch, 0, False)["loss"].backward()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        base_memory = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        training_step()
+        peak_memory = torch.cuda.max_memory_allocated(device) - base_memory
+    else:
+        base_memory = peak_rss_bytes()
+        training_step()
+        peak_memory = peak_rss_bytes() - base_memory
+    return peak_memory, time_function(training_step, num_repeats)
+
+
+def run_benchmark(batch_size, num_filters, num_layers, kernel_file, with_grids, num_repeats, device):
+    batch = brepnet_collate_fn(make_synthetic_batch(batch_size, kernel_file, with_grids=with_grids))
+    print(f"{batch_size} bodies, {batch['face_features'].size(0)} faces, {batch['coedge_features'].size(0)} coedges on {device}")
+    results = {}
+    os.environ.setdefault("MALLOC_MMAP_THRESHOLD_", "65536")
+    context = multiprocessing.get_context("spawn")
+    for checkpoint_mode in CHECKPOINT_MODES:
+        args = (checkpoint_mode, batch_size, num_filters, num_layers, kernel_file, with_grids, num_repeats, device)
+        if device.type == "cuda":
+            results[checkpoint_mode] = measure_training_step(*args)
+        else:
+            # A new process so the peak resident set size
+            # is not affected by the previous modes
+            with context.Pool(1) as pool:
+                results[checkpoint_mode] = pool.apply(measure_training_step, args)
+        peak_memory, train_time = results[checkpoint_mode]
+        print(f"    {checkpoint_mode:<16} peak memory {peak_memory/1024**2:8.1f}Mb  forward+backward {train_time*1000:8.2f}ms")
+
+    base_memory, base_time = results["none"]
+    for checkpoint_mode, (peak_memory, train_time) in list(results.items())[1:]:
+        print(f"    {checkpoint_mode} uses {peak_memory/max(base_memory, 1):.2f}x the memory and {train_time/base_time:.2f}x the time")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=50, help="Number of bodies in the batch")
+    parser.add_argument("--num_filters", type=int, default=84, help="Number of filters in each layer")
+    parser.add_argument("--num_layers", type=int, default=5, help="Number of BRepNet layers")
+    parser.add_argument("--kernel", type=str, default="kernels/winged_edge.json", help="The kernel file")
+    parser.add_argument("--with_grids", type=int, default=1, help="Use the face, edge and coedge point grids as well as the features.  With 0 only the BRepNet layers are checkpointed")
+    parser.add_argument("--num_repeats", type=int, default=3, help="Number of times to repeat each timing")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="The device to run on")
+    opts = parser.parse_args()
+    run_benchmark(opts.batch_size, opts.num_filters, opts.num_layers, opts.kernel, opts.with_grids, opts.num_repeats, torch.device(opts.device))
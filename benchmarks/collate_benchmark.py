@@ -0,0 +1,365 @@
+"""
+Time brepnet_collate_fn on batches of synthetic B-Reps.
+
+    python -m benchmarks.collate_benchmark --batch_sizes 10 50 200
+
+The original two pass collate function is kept here as
+legacy_brepnet_collate_fn().  It is used both as the baseline
+for the timings and by the tests to check the single pass
+implementation gives bit identical batches.  The legacy function
+takes the coedges of the big faces as a list of tensors rather than
+in CSR form, so the bodies are converted with make_legacy_body()
+"""
+import argparse
+import numpy as np
+import torch
+
+from benchmarks.topology_benchmark import make_synthetic_topology, time_function, print_timing
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, csr_from_tensor_list, find_coedge_to_face
+from dataloaders.kernel_compiler import CompiledKernel
+import utils.data_utils as data_utils
+
+
+def legacy_unsqueeze_single_dim_tensors(tensor_list):
+    unsqueezed = []
+    for t in tensor_list:
+        if t.ndim == 1:
+            unsqueezed.append(torch.unsqueeze(t, 0))
+        else:
+            unsqueezed.append(t)
+    return unsqueezed
+
+def legacy_concatenate_tensor_arrays(small, big, unsqueeze):
+    all = []
+    if unsqueeze:
+        small = legacy_unsqueeze_single_dim_tensors(small)
+        big = legacy_unsqueeze_single_dim_tensors(big)
+    all.extend(small)
+    all.extend(big)
+    return torch.cat(all)
+
+def legacy_add_offset_to_face_index(
+        face_indices, 
+        num_small_faces, 
+        small_face_offset, 
+        big_face_offset
+    ):
+    face_index_offset = small_face_offset*(face_indices < num_small_faces)
+
+    # The array was re-ordered so that small faces are always before
+    # big faces.
+    # The first big face has index "num_small_faces" are we need to map this to
+    # big_face_offset
+    face_index_offset += (big_face_offset-num_small_faces)*(face_indices >= num_small_faces)
+    return face_indices + face_index_offset
+
+
+def legacy_add_offset_to_coedge_index_with_padding(
+        padded_coedge_indices,
+        pad_value,
+        coedge_index_offset,
+        new_pad_value
+    ):
+    """
+    In the coedges_of_small_faces array we have the indices
+    of coedges with padding at the end of the array.   The 
+    value of the padding in the input tensor is pad_value.
+    We want to change the values of the valid coedge indices 
+    and the padding separately.  The valid values want to 
+    be increased by  `coedge_index_offset`.   The padding
+    needs to be replaced by `new_pad_value`
+    """
+    coedge_index_offset = coedge_index_offset*(padded_coedge_indices != pad_value)
+    coedge_index_offset += (new_pad_value-pad_value)*(padded_coedge_indices == pad_value)
+    return padded_coedge_indices + coedge_index_offset
+
+
+def legacy_brepnet_collate_fn(data_list):
+    """
+    The original two pass collate function
+    """
+    Xf_small_faces = []
+    Xf_big_faces = []
+    Gf_small_faces = []
+    Gf_big_faces = []
+    labels_small_faces = []
+    labels_big_faces = []
+
+    Xe = []
+    Ge = []
+    Xc = []
+    Gc = []
+    lcs = []
+
+    Ke = [] # Edge indices for each coedge
+    Kc = [] # Coedge indices for each coedge
+
+    Ce = []   # Coedge indices for coedges owned by each edge
+    Csf = []  # Coedge indices for coedges owned by "big faces"
+
+    # Keep track of which file each B-Rep came from
+    file_stems = []
+
+    # Keep track of the data we need to split the batch
+    split_batch = []
+
+    # We need to make two passes through the data.
+    # In the first pass we process things which depend on
+    # coedge index and small faces.  In the second pass
+    # we work on modifying indices which depend on big faces
+    face_offset = 0
+    edge_offset = 0
+    coedge_offset = 0
+
+    for data in data_list:
+        # These are input features.  We just wan to concatentate 
+        # the tensors for each B-Rep
+        num_edges = data["edge_features"].shape[0]
+        Xe.append(data["edge_features"])
+        if "edge_point_grids" in data:
+            Ge.append(data["edge_point_grids"])
+
+        num_coedges = data["coedge_features"].shape[0]
+        Xc.append(data["coedge_features"])
+        if "coedge_point_grids" in data:
+            Gc.append(data["coedge_point_grids"])
+        if "coedge_lcs" in data:
+            lcs.append(data["coedge_lcs"])
+
+        # For edge and coedge indices things are easy.  We just need to 
+        # add the offsets to the arrays
+        Ke.append(data["edge_kernel_tensor"] + edge_offset)
+        Ce.append(data["coedges_of_edges"] + coedge_offset)
+        Kc.append(data["coedge_kernel_tensor"] + coedge_offset)
+        
+        for single_face_coedges in data["coedges_of_big_faces"]:
+            Csf.append(single_face_coedges + coedge_offset)
+        
+        # Face features are a little more complicated.  We want
+        # to keep the faces with a small number of coedges
+        # at the start of the array and the faces with a large
+        # number of coedges in another array which will get
+        # appended to the end.
+
+        num_small_faces = data["coedges_of_small_faces"].shape[0]
+        num_big_faces = len(data["coedges_of_big_faces"])
+        Xf = data["face_features"]
+        assert num_small_faces + num_big_faces == Xf.shape[0]
+        
+        # We need to slice the face feature tensor
+        Xf_small_faces.append(Xf[:num_small_faces])      
+        Xf_big_faces.extend(Xf[num_small_faces:])
+
+        if "face_point_grids" in data:
+            Gf = data["face_point_grids"]
+            assert num_small_faces + num_big_faces == Gf.shape[0]
+            Gf_small_faces.append(Gf[:num_small_faces])
+            Gf_big_faces.append(Gf[num_small_faces:])
+
+        labels = data["labels"]
+        labels_small_faces.append(labels[:num_small_faces])
+        labels_big_faces.append(labels[num_small_faces:])
+
+        file_stems.append(data["file_stem"])
+
+        split_batch_data_for_brep = {
+            "edge_indices": torch.arange(edge_offset, edge_offset+num_edges, dtype=torch.int64),
+            "coedge_indices": torch.arange(coedge_offset, coedge_offset+num_coedges, dtype=torch.int64)
+        }
+        split_batch.append(split_batch_data_for_brep)
+
+        face_offset += num_small_faces
+        edge_offset += num_edges
+        coedge_offset += num_coedges
+    
+    # This is the second pass through the data.  We need to
+    # set the indices of faces in Kf and the new_indices_of_brep_faces
+    # for each face in each B-Rep
+    Kf = []
+
+    # The coedge indices for coedges owned by "small faces" also needs to 
+    # be processed here as we need to apply different values to the 
+    # coedge indices and the padding
+    new_padding_value = coedge_offset
+    coedge_offset = 0
+    Cf = []   
+    small_face_offset = 0
+    for solid_index, data in enumerate(data_list):
+        num_small_faces = data["coedges_of_small_faces"].shape[0]
+        num_big_faces = len(data["coedges_of_big_faces"])
+        old_to_new_face_index = data["old_to_new_face_indices"]
+        num_coedges = data["coedge_features"].shape[0]
+
+        # We need to add on the offsets for the new face indices
+        # Here this is done for the indices which allow us to get
+        # back from the combined batch to the original face indices
+        # in each B-Rep
+        offset_old_to_new_face_index = legacy_add_offset_to_face_index(
+            old_to_new_face_index, 
+            num_small_faces, 
+            small_face_offset, 
+            face_offset
+        )
+
+        offset_coedges_of_small_faces = legacy_add_offset_to_coedge_index_with_padding(
+            data["coedges_of_small_faces"],
+            num_coedges,
+            coedge_offset,
+            new_padding_value
+        )
+        Cf.append(offset_coedges_of_small_faces)
+
+        split_batch[solid_index]["face_indices"] = offset_old_to_new_face_index
+
+        # Here we add on the offsets for the kernel Kf
+        brep_Kf = data["face_kernel_tensor"]
+        offset_Kf = legacy_add_offset_to_face_index(
+            brep_Kf, 
+            num_small_faces, 
+            small_face_offset, 
+            face_offset
+        )
+        Kf.append(offset_Kf)
+
+        small_face_offset += num_small_faces
+        face_offset += num_big_faces
+        coedge_offset += num_coedges
+        
+    batch_data = {
+        "face_features": legacy_concatenate_tensor_arrays(Xf_small_faces, Xf_big_faces, unsqueeze=True),
+        "edge_features": torch.cat(Xe),
+        "coedge_features": torch.cat(Xc),
+        "face_kernel_tensor": torch.cat(Kf),
+        "edge_kernel_tensor": torch.cat(Ke),
+        "coedge_kernel_tensor": torch.cat(Kc),
+        "coedges_of_edges": torch.cat(Ce),
+        "coedges_of_small_faces": torch.cat(Cf),
+        "coedges_of_big_faces": Csf,
+        "labels": legacy_concatenate_tensor_arrays(labels_small_faces, labels_big_faces, unsqueeze=False),
+        "split_batch": split_batch,
+        "file_stems": file_stems
+    }
+    if len(Gf_small_faces) > 0:
+        batch_data["face_point_grids"] = legacy_concatenate_tensor_arrays(Gf_small_faces, Gf_big_faces, unsqueeze=True)
+    if len(Ge) > 0:
+        batch_data["edge_point_grids"] = torch.cat(Ge)
+    if len(Gc) > 0:
+        batch_data["coedge_point_grids"] = torch.cat(Gc)
+    if len(lcs) > 0:
+        batch_data["coedge_lcs"] = torch.cat(lcs)
+    return batch_data
+
+
+GRID_KEYS = ["face_point_grids", "edge_point_grids", "coedge_point_grids", "coedge_lcs"]
+
+
+def make_legacy_body(body):
+    """
+    Make a copy of the body data with the coedges of the big
+    faces as a list of tensors
+    """
+    legacy_body = dict(body)
+    legacy_body.pop("coedge_to_face")
+    offsets = legacy_body.pop("big_face_coedge_offsets")
+    legacy_body["coedges_of_big_faces"] = list(body["coedges_of_big_faces"].split(torch.diff(offsets).tolist()))
+    return legacy_body
+
+
+def legacy_batch_in_csr_form(legacy_batch):
+    """
+    Convert the coedges of the big faces in a batch from the legacy
+    collate function into CSR form.  The legacy function has no face
+    for each coedge, so this is found from the coedges of the faces
+    """
+    batch = dict(legacy_batch)
+    batch["coedges_of_big_faces"], batch["big_face_coedge_offsets"] = csr_from_tensor_list(legacy_batch["coedges_of_big_faces"])
+    batch["coedge_to_face"] = find_coedge_to_face(
+        batch["coedges_of_small_faces"],
+        batch["coedges_of_big_faces"],
+        batch["big_face_coedge_offsets"],
+        batch["coedge_features"].size(0)
+    )
+    return batch
+
+
+def make_synthetic_body(dataset, num_faces, seed, file_stem, big_face_fraction):
+    """
+    Make the data for one body, as returned by BRepNetDataset,
+    from a random synthetic topology
+    """
+    body_data = make_synthetic_topology(num_faces, seed, big_face_fraction)
+    rng = torch.Generator().manual_seed(seed)
+    num_coedges = body_data["coedge_to_face"].size
+    num_edges = body_data["edge_features"].shape[0]
+    Kf, Ke, Kc = dataset.build_kernel_tensors(body_data)
+    Ce = dataset.build_coedges_of_edges_tensor(body_data)
+    Cf, Csf, Csf_offsets, new_to_old_face_indices = dataset.build_coedges_of_faces_tensor(body_data, 30)
+    old_to_new_face_indices = dataset.find_inverse_permutation(new_to_old_face_indices)
+    return {
+        "face_features": torch.rand((num_faces, 7), generator=rng)[new_to_old_face_indices],
+        "edge_features": torch.rand((num_edges, 10), generator=rng),
+        "coedge_features": torch.rand((num_coedges, 1), generator=rng),
+        "face_kernel_tensor": old_to_new_face_indices[Kf],
+        "edge_kernel_tensor": Ke,
+        "coedge_kernel_tensor": Kc,
+        "coedges_of_edges": Ce,
+        "coedges_of_small_faces": Cf,
+        "coedges_of_big_faces": Csf,
+        "big_face_coedge_offsets": Csf_offsets,
+        "coedge_to_face": old_to_new_face_indices[torch.from_numpy(body_data["coedge_to_face"].astype(np.int64))],
+        "labels": torch.randint(0, 8, (num_faces,), generator=rng)[new_to_old_face_indices],
+        "old_to_new_face_indices": old_to_new_face_indices,
+        "file_stem": file_stem,
+        "face_point_grids": torch.rand((num_faces, 7, 10, 10), generator=rng)[new_to_old_face_indices],
+        "edge_point_grids": torch.rand((num_edges, 12, 10), generator=rng),
+        "coedge_point_grids": torch.rand((num_coedges, 12, 10), generator=rng),
+        "coedge_lcs": torch.rand((num_coedges, 4, 4), generator=rng)
+    }
+
+
+def make_synthetic_batch(batch_size, kernel_file, min_faces=10, max_faces=200, seed=0, big_face_fraction=0.02, with_grids=True):
+    """
+    Make the data for a batch of bodies with random numbers of faces
+    """
+    # The methods we use don't depend on the dataset files
+    dataset = BRepNetDataset.__new__(BRepNetDataset)
+    dataset.compiled_kernel = CompiledKernel(data_utils.load_json_data(kernel_file))
+    rng = np.random.default_rng(seed)
+    data_list = []
+    for i in range(batch_size):
+        num_faces = int(rng.integers(min_faces, max_faces))
+        body = make_synthetic_body(dataset, num_faces, seed + i, f"body_{i}", big_face_fraction)
+        if not with_grids:
+            for key in GRID_KEYS:
+                del body[key]
+        data_list.append(body)
+    return data_list
+
+
+def run_benchmark(batch_sizes, num_repeats, kernel_file, big_face_fraction):
+    for batch_size in batch_sizes:
+        for with_grids in [True, False]:
+            data_list = make_synthetic_batch(
+                batch_size,
+                kernel_file,
+                big_face_fraction=big_face_fraction,
+                with_grids=with_grids
+            )
+            num_faces = sum(data["face_features"].shape[0] for data in data_list)
+            num_big_faces = sum(data["big_face_coedge_offsets"].size(0) - 1 for data in data_list)
+            name = "with grids" if with_grids else "features only"
+            print(f"{batch_size} bodies, {num_faces} faces, {num_big_faces} big faces, {name}")
+            legacy_data_list = [ make_legacy_body(data) for data in data_list ]
+            legacy_time = time_function(lambda: legacy_brepnet_collate_fn(legacy_data_list), num_repeats)
+            new_time = time_function(lambda: brepnet_collate_fn(data_list), num_repeats)
+            print_timing("brepnet_collate_fn", legacy_time, new_time)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[10, 50, 200], help="Number of bodies in each batch")
+    parser.add_argument("--num_repeats", type=int, default=10, help="Number of times to repeat each timing")
+    parser.add_argument("--kernel", type=str, default="kernels/winged_edge.json", help="Kernel used to build the kernel tensors")
+    parser.add_argument("--big_face_fraction", type=float, default=0.02, help="Fraction of faces with more than 30 coedges")
+    opts = parser.parse_args()
+    run_benchmark(opts.batch_sizes, opts.num_repeats, opts.kernel, opts.big_face_fraction)
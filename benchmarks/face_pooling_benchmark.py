@@ -0,0 +1,78 @@
+"""
+Compare the padded and segmented pooling of the coedge feature
+vectors onto the edges and faces on synthetic batches.
+
+    python -m benchmarks.face_pooling_benchmark --batch_size 50
+
+The padded face pooling gathers the coedges of the small faces into a
+[ num_small_faces x 30 x num_filters ] tensor, and the big faces with a
+second gather.  The segmented pooling scatters each coedge onto its face
+with segment_max() from models/segment_max.py.  Each is timed for the
+forward pass alone and with the backward pass, for the default fraction
+of big faces and for batches where big faces are common.
+"""
+import argparse
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.topology_benchmark import time_function
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import (
+    find_edge_of_each_coedge,
+    find_initial_face_values,
+    pool_coedges_onto_edges_and_faces
+)
+
+
+def time_pooling(Z, face_pooling, pooling_args, num_repeats):
+    """
+    Time the pooling onto the edges and faces for
+    inference and training
+    """
+    def forward():
+        return pool_coedges_onto_edges_and_faces(Z, Z, *pooling_args, face_pooling, Z.device)
+
+    def forward_and_backward():
+        He, Hf = forward()
+        (He.sum() + Hf.sum()).backward()
+
+    with torch.no_grad():
+        forward_time = time_function(forward, num_repeats)
+    train_time = time_function(forward_and_backward, num_repeats)
+    return forward_time, train_time
+
+
+def run_benchmark(batch_size, num_filters, num_repeats, kernel_file, big_face_fractions):
+    for big_face_fraction in big_face_fractions:
+        batch = brepnet_collate_fn(
+            make_synthetic_batch(batch_size, kernel_file, big_face_fraction=big_face_fraction, with_grids=False)
+        )
+        Ce = batch["coedges_of_edges"]
+        Cf = batch["coedges_of_small_faces"]
+        Csf = batch["coedges_of_big_faces"]
+        Csf_offsets = batch["big_face_coedge_offsets"]
+        Fc = batch["coedge_to_face"]
+        num_faces = batch["face_features"].size(0)
+        num_coedges = Fc.size(0)
+        Ec = find_edge_of_each_coedge(Ce, num_coedges)
+        Hf_init = find_initial_face_values(Fc, num_faces, Cf.size(1))
+        pooling_args = (Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init)
+        print(f"{num_faces} faces, {Csf_offsets.size(0) - 1} big faces, {Ce.size(0)} edges, {num_coedges} coedges")
+
+        generator = torch.Generator().manual_seed(0)
+        Z = torch.randn((num_coedges, num_filters), generator=generator).relu().requires_grad_()
+        padded_times = time_pooling(Z, "padded", pooling_args, num_repeats)
+        segmented_times = time_pooling(Z, "segmented", pooling_args, num_repeats)
+        for name, padded_time, segmented_time in zip(["forward", "forward+backward"], padded_times, segmented_times):
+            print(f"    {name:<18} padded {padded_time*1000:8.2f}ms  segmented {segmented_time*1000:8.2f}ms  speedup {padded_time/segmented_time:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=50, help="Number of bodies in the batch")
+    parser.add_argument("--num_filters", type=int, default=84, help="Number of filters in the layer")
+    parser.add_argument("--num_repeats", type=int, default=10, help="Number of times to repeat each timing")
+    parser.add_argument("--kernel", type=str, default="kernels/winged_edge.json", help="Kernel used to build the kernel tensors")
+    parser.add_argument("--big_face_fractions", type=float, nargs="+", default=[0.02, 0.2], help="Fractions of faces with more than 30 coedges")
+    opts = parser.parse_args()
+    run_benchmark(opts.batch_size, opts.num_filters, opts.num_repeats, opts.kernel, opts.big_face_fractions)
@@ -0,0 +1,103 @@
+"""
+Compare the CPU latency of the eager BRepNetPredictor with the
+exported models on synthetic batches.
+
+    python -m benchmarks.predictor_benchmark --batch_sizes 1 10 50
+
+For each batch size we time
+
+    eager     - BRepNetPredictor.predict()
+    traced    - The TorchScript module from BRepNetPredictor.trace()
+    frozen    - The traced module after torch.jit.freeze()
+    onnx      - The ONNX model in ONNX Runtime, when the onnx and
+                onnxruntime packages are installed
+
+The exported models are traced once on a small batch, so the timings
+also check that they work for other numbers of faces, edges and
+coedges.  The largest difference in the logits from the eager model
+is reported for each.
+"""
+import argparse
+import importlib.util
+from pathlib import Path
+import tempfile
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.topology_benchmark import time_function
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import BRepNet
+from models.brepnet_predictor import BRepNetPredictor
+
+
+def create_model(model_args):
+    """
+    A randomly initialized model with the given options.  The
+    synthetic batches have the features in feature_lists/all.json
+    """
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    opts = parser.parse_args(["--dataset_file", "", "--dataset_dir", "."] + model_args)
+    torch.manual_seed(0)
+    return BRepNet(opts)
+
+
+def create_onnx_runner(predictor, example_batch, onnx_dir):
+    """
+    Export the predictor to ONNX and load it into ONNX Runtime.
+    Returns None if the packages are not installed
+    """
+    if importlib.util.find_spec("onnx") is None or importlib.util.find_spec("onnxruntime") is None:
+        print("Warning! onnx or onnxruntime is not installed.  Skipping the ONNX timings")
+        return None
+    import onnxruntime
+    pathname = Path(onnx_dir) / "brepnet.onnx"
+    predictor.export_onnx(example_batch, pathname)
+    session = onnxruntime.InferenceSession(str(pathname), providers=["CPUExecutionProvider"])
+    # Inputs the model does not read are left out of the ONNX model
+    session_inputs = { input.name for input in session.get_inputs() }
+    def run(*inputs):
+        feeds = { name: t.numpy() for name, t in zip(predictor.input_names, inputs) if name in session_inputs }
+        return [ torch.from_numpy(output) for output in session.run(None, feeds) ]
+    return run
+
+
+def run_benchmark(batch_sizes, num_repeats, kernel_file, model_args):
+    model = create_model(["--kernel", kernel_file] + model_args)
+    predictor = BRepNetPredictor(model)
+    example_batch = brepnet_collate_fn(make_synthetic_batch(2, kernel_file, seed=1000))
+    traced = predictor.trace(example_batch)
+    runners = {
+        "eager": predictor,
+        "traced": traced,
+        "frozen": torch.jit.freeze(traced.eval())
+    }
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        onnx_runner = create_onnx_runner(predictor, example_batch, onnx_dir)
+        if onnx_runner is not None:
+            runners["onnx"] = onnx_runner
+
+        for batch_size in batch_sizes:
+            batch = brepnet_collate_fn(make_synthetic_batch(batch_size, kernel_file))
+            inputs = predictor.input_tensors(batch)
+            print(f"{batch_size} bodies, {batch['face_features'].size(0)} faces, {batch['coedge_features'].size(0)} coedges")
+            with torch.no_grad():
+                eager_logits = predictor(*inputs)[0]
+                eager_time = None
+                for name, runner in runners.items():
+                    logits = runner(*inputs)[0]
+                    difference = (logits - eager_logits).abs().max().item()
+                    runner_time = time_function(lambda: runner(*inputs), num_repeats)
+                    if eager_time is None:
+                        eager_time = runner_time
+                    print(f"    {name:<8} {runner_time*1000:8.2f}ms  speedup {eager_time/runner_time:.2f}x  max logit difference {difference:.2e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 10, 50], help="Number of bodies in each batch")
+    parser.add_argument("--num_repeats", type=int, default=10, help="Number of times to repeat each timing")
+    parser.add_argument("--kernel", type=str, default="kernels/winged_edge.json", help="Kernel used by the model")
+    parser.add_argument("--psi_mode", type=str, default="concat", choices=["concat", "gather_sum", "fused"], help="How the model builds Psi")
+    opts = parser.parse_args()
+    run_benchmark(opts.batch_sizes, opts.num_repeats, opts.kernel, ["--psi_mode", opts.psi_mode])
@@ -0,0 +1,154 @@
+"""
+Compare the ways a BRepNet layer can consume the kernel on a
+synthetic batch, for each of the kernels in the kernels folder.
+
+    python -m benchmarks.psi_benchmark --batch_size 50
+
+For each kernel we first time build_matrix_Psi(), which gathers from
+Xf, Xe and Xc separately and concatenates the results, against
+build_matrix_Psi_fused(), which gathers Psi from one buffer of all
+the entities with a single index_select.  The hidden states are
+views of this buffer, as they are when the previous layer pools its
+output into it, so the fused timing has no copy into the buffer.
+
+Then we time a hidden layer in the "concat" mode, which builds the
+matrix Psi, the "gather_sum" mode, which applies the first linear
+layer of the MLP without building it, and the "fused" mode.  See
+gather_and_sum_linear() and build_matrix_Psi_fused() in
+models/brepnet.py.  We report
+
+    - The size of the matrix Psi
+    - The bytes of tensors kept for the backward pass
+    - The time for the forward pass alone and with the backward pass
+"""
+import argparse
+from pathlib import Path
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.topology_benchmark import time_function
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import (
+    BRepNetLayer,
+    build_matrix_Psi,
+    build_matrix_Psi_fused,
+    find_combined_kernel_tensor
+)
+
+PSI_MODES = ["concat", "gather_sum", "fused"]
+
+
+def saved_tensor_bytes(func):
+    """
+    Find the bytes of the tensors autograd keeps for the backward
+    pass when func is called.  Tensors which share storage are
+    only counted once
+    """
+    storages = {}
+    def pack(t):
+        storage = t.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        func()
+    return sum(storages.values())
+
+
+def make_hidden_states(batch, num_filters, seed=0):
+    """
+    Random hidden states for the faces, edges and coedges
+    in the batch, as seen by a hidden layer
+    """
+    generator = torch.Generator().manual_seed(seed)
+    return [
+        torch.randn((batch[key].size(0), num_filters), generator=generator, requires_grad=True)
+        for key in ["face_features", "edge_features", "coedge_features"]
+    ]
+
+
+def layer_args(batch):
+    return [
+        batch["face_kernel_tensor"],
+        batch["edge_kernel_tensor"],
+        batch["coedge_kernel_tensor"],
+        batch["coedges_of_edges"],
+        batch["coedges_of_small_faces"],
+        batch["coedges_of_big_faces"],
+        batch["big_face_coedge_offsets"]
+    ]
+
+
+def time_build_Psi(X, Xf, Xe, Xc, Kf, Ke, Kc, num_repeats):
+    """
+    Time building Psi with the separate gathers and with the
+    single fused gather, for inference and training
+    """
+    K = find_combined_kernel_tensor(Kf, Ke, Kc, Xf.size(0), Xe.size(0))
+    builders = {
+        "build_matrix_Psi": lambda: build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc),
+        "build_matrix_Psi_fused": lambda: build_matrix_Psi_fused(X, K)
+    }
+    times = {}
+    for name, build in builders.items():
+        with torch.no_grad():
+            forward_time = time_function(build, num_repeats)
+        train_time = time_function(lambda: build().sum().backward(), num_repeats)
+        times[name] = forward_time
+        print(f"    {name:<24} forward {forward_time*1000:8.2f}ms  forward+backward {train_time*1000:8.2f}ms")
+    print(f"    fused Psi forward speedup {times['build_matrix_Psi']/times['build_matrix_Psi_fused']:.2f}x")
+
+
+def run_benchmark(batch_size, num_filters, num_mlp_layers, num_repeats, kernel_files):
+    for kernel_file in kernel_files:
+        batch = brepnet_collate_fn(make_synthetic_batch(batch_size, kernel_file, with_grids=False))
+        kernel_size = sum(batch[key].size(1) for key in ["face_kernel_tensor", "edge_kernel_tensor", "coedge_kernel_tensor"])
+        num_coedges = batch["coedge_features"].size(0)
+        psi_bytes = num_coedges*kernel_size*num_filters*4
+        print(f"{Path(kernel_file).stem}: {kernel_size} entities in kernel, {num_coedges} coedges, Psi {psi_bytes/1024**2:.1f}Mb")
+
+        # The hidden states are views of the entity buffer written
+        # by the previous layer
+        X = torch.cat(make_hidden_states(batch, num_filters)).detach().requires_grad_()
+        num_entities = [ batch[key].size(0) for key in ["face_features", "edge_features", "coedge_features"] ]
+        Xf, Xe, Xc = torch.split(X, num_entities)
+        args = layer_args(batch)
+        time_build_Psi(X, Xf, Xe, Xc, *args[:3], num_repeats)
+
+        # The combined kernel tensor is found once for each batch
+        K = find_combined_kernel_tensor(*args[:3], Xf.size(0), Xe.size(0))
+
+        torch.manual_seed(0)
+        reference_layer = BRepNetLayer(num_mlp_layers, kernel_size*num_filters, num_filters)
+        times = {}
+        for psi_mode in PSI_MODES:
+            layer = BRepNetLayer(num_mlp_layers, kernel_size*num_filters, num_filters, psi_mode=psi_mode)
+            layer.load_state_dict(reference_layer.state_dict())
+
+            def forward():
+                return layer(Xf, Xe, Xc, *args, K=K, X=X)[0]
+
+            def forward_and_backward():
+                forward().sum().backward()
+
+            with torch.no_grad():
+                forward_time = time_function(forward, num_repeats)
+            train_time = time_function(forward_and_backward, num_repeats)
+            saved_bytes = saved_tensor_bytes(forward)
+            times[psi_mode] = train_time
+            print(f"    {psi_mode:<12} saved for backward {saved_bytes/1024**2:8.1f}Mb  forward {forward_time*1000:8.2f}ms  forward+backward {train_time*1000:8.2f}ms")
+        for psi_mode in PSI_MODES[1:]:
+            print(f"    {psi_mode} training speedup {times['concat']/times[psi_mode]:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=50, help="Number of bodies in the batch")
+    parser.add_argument("--num_filters", type=int, default=84, help="Number of filters in the layer")
+    parser.add_argument("--num_mlp_layers", type=int, default=2, help="Number of layers in the mlp")
+    parser.add_argument("--num_repeats", type=int, default=5, help="Number of times to repeat each timing")
+    parser.add_argument("--kernels", type=str, nargs="+", help="Kernel files to test.  By default all the kernels in the kernels folder")
+    opts = parser.parse_args()
+    kernel_files = opts.kernels
+    if kernel_files is None:
+        kernel_files = sorted(str(f) for f in Path("kernels").glob("*.json"))
+    run_benchmark(opts.batch_size, opts.num_filters, opts.num_mlp_layers, opts.num_repeats, kernel_files)
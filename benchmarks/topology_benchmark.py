@@ -0,0 +1,249 @@
+"""
+Time the construction of the topology index tensors on large
+synthetic B-Reps.
+
+    python -m benchmarks.topology_benchmark --num_faces 100 1000 10000
+
+The original loop based implementations are kept here as
+legacy_build_*() functions.  They are used both as the baseline
+for the timings and by the tests to check the array based
+implementations in BRepNetDataset give identical output.
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.kernel_compiler import CompiledKernel
+import utils.data_utils as data_utils
+
+
+def make_synthetic_topology(num_faces, seed=0, big_face_fraction=0.02):
+    """
+    Make the topology arrays for a random B-Rep like body with the
+    given number of faces.  The coedges are in random order and a
+    small fraction of the faces have more than 30 coedges.  A few
+    edges have a single self-mated coedge, like the poles of a sphere
+    """
+    rng = np.random.default_rng(seed)
+    coedges_per_face = rng.integers(3, 12, size=num_faces)
+    is_big_face = rng.random(num_faces) < big_face_fraction
+    coedges_per_face[is_big_face] = rng.integers(31, 200, size=is_big_face.sum())
+    num_coedges = coedges_per_face.sum()
+
+    # Shuffle the coedges so the coedges of each face are not contiguous
+    coedge_order = rng.permutation(num_coedges)
+    coedge_to_face = np.zeros(num_coedges, dtype=np.int64)
+    coedge_to_face[coedge_order] = np.repeat(np.arange(num_faces), coedges_per_face)
+
+    # The next coedge in the loop around each face
+    coedge_to_next = np.zeros(num_coedges, dtype=np.int64)
+    face_starts = np.cumsum(coedges_per_face) - coedges_per_face
+    positions = np.arange(num_coedges) - np.repeat(face_starts, coedges_per_face)
+    next_positions = np.where(
+        positions + 1 == np.repeat(coedges_per_face, coedges_per_face),
+        np.repeat(face_starts, coedges_per_face),
+        np.arange(num_coedges) + 1
+    )
+    coedge_to_next[coedge_order] = coedge_order[next_positions]
+
+    # Pair up the coedges into edges.  An even number of coedges
+    # remain after removing the self-mated ones
+    num_single = max(2, num_coedges // 200)
+    if (num_coedges - num_single) % 2 == 1:
+        num_single += 1
+    edge_order = rng.permutation(num_coedges)
+    single_coedges = edge_order[:num_single]
+    paired_coedges = edge_order[num_single:].reshape(-1, 2)
+    num_edges = num_single + paired_coedges.shape[0]
+    coedge_to_edge = np.zeros(num_coedges, dtype=np.int64)
+    coedge_to_edge[single_coedges] = np.arange(num_single)
+    coedge_to_edge[paired_coedges[:, 0]] = np.arange(num_single, num_edges)
+    coedge_to_edge[paired_coedges[:, 1]] = np.arange(num_single, num_edges)
+    coedge_to_mate = np.arange(num_coedges, dtype=np.int64)
+    coedge_to_mate[paired_coedges[:, 0]] = paired_coedges[:, 1]
+    coedge_to_mate[paired_coedges[:, 1]] = paired_coedges[:, 0]
+
+    coedge_reverse_flags = rng.integers(0, 2, size=num_coedges)
+    grid_size = 10
+    return {
+        "face_features": np.zeros((num_faces, 7)),
+        "edge_features": np.zeros((num_edges, 10)),
+        "coedge_features": np.zeros((num_coedges, 1)),
+        "coedge_to_next": coedge_to_next,
+        "coedge_to_mate": coedge_to_mate,
+        "coedge_to_face": coedge_to_face,
+        "coedge_to_edge": coedge_to_edge,
+        "coedge_reverse_flags": coedge_reverse_flags,
+        "coedge_point_grids": rng.random((num_coedges, 12, grid_size)).astype(np.float32)
+    }
+
+
+def legacy_build_coedges_of_faces_tensor(body_data, max_coedges_per_face):
+    """
+    The original implementation of
+    BRepNetDataset.build_coedges_of_faces_tensor()
+    """
+    coedge_to_face = body_data["coedge_to_face"]
+    num_faces = body_data["face_features"].shape[0]
+    num_coedges = coedge_to_face.size
+
+    face_to_coedges = {}
+    for coedge_index, face_index in enumerate(coedge_to_face):
+        if not face_index in face_to_coedges:
+            face_to_coedges[face_index] = []
+        face_to_coedges[face_index].append(coedge_index)
+
+    small_face_indices = []
+    big_face_indices = []
+    Cf = []
+    Csf = []
+    for face_index in range(num_faces):
+        assert face_index in face_to_coedges
+        assert len(face_to_coedges[face_index]) > 0
+        if len(face_to_coedges[face_index]) > max_coedges_per_face:
+            Csf.append(torch.tensor(face_to_coedges[face_index], dtype=torch.int64))
+            big_face_indices.append(face_index)
+        else:
+            coedges_of_face = face_to_coedges[face_index]
+            padding_size = max_coedges_per_face - len(coedges_of_face)
+            coedges_of_face.extend([num_coedges] * padding_size)
+            Cf.append(torch.tensor(coedges_of_face, dtype=torch.int64))
+            small_face_indices.append(face_index)
+
+    Cf = torch.stack(Cf)
+    small_face_indices = torch.tensor(small_face_indices, dtype=torch.int64)
+    big_face_indices = torch.tensor(big_face_indices, dtype=torch.int64)
+    face_permutation = torch.cat([small_face_indices, big_face_indices])
+    return Cf, Csf, face_permutation
+
+
+def legacy_build_coedges_of_edges_tensor(body_data):
+    """
+    The original implementation of
+    BRepNetDataset.build_coedges_of_edges_tensor()
+    """
+    coedge_to_edge = body_data["coedge_to_edge"]
+    num_edges = body_data["edge_features"].shape[0]
+    coedges_of_edges = [ [] for i in range(num_edges)]
+    for coedge_index, edge_index in enumerate(coedge_to_edge):
+        coedges_of_edges[edge_index].append(coedge_index)
+
+    for coedges in coedges_of_edges:
+        assert len(coedges) == 1 or len(coedges) == 2
+        if len(coedges) == 1:
+            coedges.append(coedges[0])
+
+    return torch.tensor(coedges_of_edges, dtype=torch.int64)
+
+
+def legacy_build_edge_grids_from_left_coedges(Gc, Ce, body_data):
+    """
+    The original implementation of
+    BRepNetDataset.build_edge_grids_from_left_coedges()
+    """
+    num_edges = Ce.size(0)
+    left_coedge_indices = torch.zeros(num_edges, dtype=torch.int64)
+    reverse_flags = body_data["coedge_reverse_flags"]
+    for edge_index in range(num_edges):
+        coedges = Ce[edge_index, :]
+        first_coedge_index = coedges[0]
+        second_coedge_index = coedges[1]
+        if reverse_flags[second_coedge_index]==1:
+            left_coedge_indices[edge_index] = first_coedge_index
+        else:
+            left_coedge_indices[edge_index] = second_coedge_index
+    return Gc[left_coedge_indices]
+
+
+def time_function(func, num_repeats):
+    start = time.perf_counter()
+    for i in range(num_repeats):
+        func()
+    return (time.perf_counter() - start) / num_repeats
+
+
+def print_timing(name, legacy_time, new_time):
+    print(f"    {name:<36} legacy {legacy_time*1000:8.2f}ms  new {new_time*1000:8.2f}ms  speedup {legacy_time/new_time:.1f}x")
+
+
+def legacy_build_kernel_tensors(dataset, n, p, m, e, f, kernel):
+    """
+    Build Kf, Ke and Kc by replaying each walk from scratch
+    """
+    Kf = dataset.build_kernel_tensor_from_topology(n, p, m, e, f, kernel["faces"])
+    Ke = dataset.build_kernel_tensor_from_topology(n, p, m, e, f, kernel["edges"])
+    Kc = dataset.build_kernel_tensor_from_topology(n, p, m, e, f, kernel["coedges"])
+    return Kf, Ke, Kc
+
+
+def run_benchmark(num_faces_list, num_repeats, kernel_file):
+    # The methods we time don't depend on any of the dataset state,
+    # so we don't need the dataset files here
+    dataset = BRepNetDataset.__new__(BRepNetDataset)
+    max_coedges_per_face = 30
+    kernel = data_utils.load_json_data(kernel_file)
+    compiled_kernel = CompiledKernel(kernel)
+    num_instructions = sum(len(walk) for walks in kernel.values() for walk in walks)
+    print(f"Kernel {kernel_file}: {num_instructions} instructions compiled to {compiled_kernel.num_gathers()} gathers")
+    for num_faces in num_faces_list:
+        body_data = make_synthetic_topology(num_faces)
+        num_coedges = body_data["coedge_to_face"].size
+        print(f"{num_faces} faces, {num_coedges} coedges")
+
+        legacy_time = time_function(
+            lambda: legacy_build_coedges_of_faces_tensor(body_data, max_coedges_per_face),
+            num_repeats
+        )
+        new_time = time_function(
+            lambda: dataset.build_coedges_of_faces_tensor(body_data, max_coedges_per_face),
+            num_repeats
+        )
+        print_timing("build_coedges_of_faces_tensor", legacy_time, new_time)
+
+        legacy_time = time_function(
+            lambda: legacy_build_coedges_of_edges_tensor(body_data),
+            num_repeats
+        )
+        new_time = time_function(
+            lambda: dataset.build_coedges_of_edges_tensor(body_data),
+            num_repeats
+        )
+        print_timing("build_coedges_of_edges_tensor", legacy_time, new_time)
+
+        Gc = torch.from_numpy(body_data["coedge_point_grids"])
+        Ce = dataset.build_coedges_of_edges_tensor(body_data)
+        legacy_time = time_function(
+            lambda: legacy_build_edge_grids_from_left_coedges(Gc, Ce, body_data),
+            num_repeats
+        )
+        new_time = time_function(
+            lambda: dataset.build_edge_grids_from_left_coedges(Gc, Ce, body_data),
+            num_repeats
+        )
+        print_timing("build_edge_grids_from_left_coedges", legacy_time, new_time)
+
+        n = body_data["coedge_to_next"]
+        p = dataset.find_inverse_permutation(n)
+        m = body_data["coedge_to_mate"]
+        e = body_data["coedge_to_edge"]
+        f = body_data["coedge_to_face"]
+        legacy_time = time_function(
+            lambda: legacy_build_kernel_tensors(dataset, n, p, m, e, f, kernel),
+            num_repeats
+        )
+        new_time = time_function(
+            lambda: compiled_kernel.build_kernel_tensors(n, p, m, e, f),
+            num_repeats
+        )
+        print_timing("build_kernel_tensors", legacy_time, new_time)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_faces", type=int, nargs="+", default=[100, 1000, 10000], help="Number of faces in each synthetic body")
+    parser.add_argument("--num_repeats", type=int, default=5, help="Number of times to repeat each timing")
+    parser.add_argument("--kernel", type=str, default="kernels/winged_edge_plus_plus.json", help="Kernel used to time building the kernel tensors")
+    opts = parser.parse_args()
+    run_benchmark(opts.num_faces, opts.num_repeats, opts.kernel)
@@ -0,0 +1,152 @@
+"""
+An in-memory tier for the BRepNetDataset cache.
+
+Even with the disk cache, every epoch re-reads and deserializes every
+body.  The BodyMemoryCache keeps the data for recently used bodies in
+RAM, up to a fixed budget in bytes, evicting the least recently used
+bodies when the budget is exceeded.
+
+The tensors held in the cache are moved to shared memory.  When the
+DataLoader uses worker processes, the cache is filled in the main process
+by BRepNetDataset.prefill_memory_cache() before the workers are started.
+The workers then read the shared tensors without each holding a private
+copy.   New bodies are never added to the cache from inside a worker
+process, as they would only be visible to that one worker.
+
+The hit, miss and eviction counters are also kept in shared memory so
+the counts from all the workers can be read in the main process.  The
+counters are not locked, so they may slightly undercount when many
+workers update them at the same moment.
+
+Within one process the cache may be used from several threads by the
+BodyPrefetcher, so the entries are guarded by a lock.
+"""
+from collections import OrderedDict
+import threading
+import torch
+from torch.utils.data import get_worker_info
+
+
+def num_bytes_in_body(body_data):
+    """
+    Find the number of bytes used by the tensors in the body data
+    """
+    num_bytes = 0
+    for value in body_data.values():
+        if isinstance(value, torch.Tensor):
+            num_bytes += value.numel()*value.element_size()
+        elif isinstance(value, list):
+            for t in value:
+                num_bytes += t.numel()*t.element_size()
+    return num_bytes
+
+
+def share_body_memory(body_data):
+    """
+    Move all the tensors in the body data into shared memory
+    """
+    for value in body_data.values():
+        if isinstance(value, torch.Tensor):
+            value.share_memory_()
+        elif isinstance(value, list):
+            for t in value:
+                t.share_memory_()
+
+
+class BodyMemoryCache:
+    """
+    A least recently used cache of body data with a budget in bytes
+    """
+
+    HITS = 0
+    MISSES = 1
+    EVICTIONS = 2
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.entries = OrderedDict()
+        self.counters = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self.lock = threading.Lock()
+
+
+    def __getstate__(self):
+        # The lock can't be pickled when the workers are spawned
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+    def in_worker_process(self):
+        return get_worker_info() is not None
+
+
+    def get(self, key):
+        """
+        Get the body data for the key, or None if it is not in the cache
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters[self.MISSES] += 1
+                return None
+            self.counters[self.HITS] += 1
+            if not self.in_worker_process():
+                self.entries.move_to_end(key)
+            return entry[0]
+
+
+    def put(self, key, body_data):
+        """
+        Add the body data to the cache, evicting the least recently
+        used bodies if the cache is over budget.  Returns True if the
+        body was added
+        """
+        if self.in_worker_process():
+            return False
+        num_bytes = num_bytes_in_body(body_data)
+        if num_bytes > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                return False
+            share_body_memory(body_data)
+            self.entries[key] = (body_data, num_bytes)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes:
+                evicted_key, (evicted_data, evicted_bytes) = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+                self.counters[self.EVICTIONS] += 1
+            return True
+
+
+    def has_space_for(self, body_data):
+        return self.num_bytes + num_bytes_in_body(body_data) <= self.max_bytes
+
+
+    def stats(self):
+        """
+        Get the counters for the cache.  These include the
+        accesses from all worker processes
+        """
+        hits = self.counters[self.HITS].item()
+        misses = self.counters[self.MISSES].item()
+        num_accesses = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": self.counters[self.EVICTIONS].item(),
+            "hit_rate": hits/num_accesses if num_accesses > 0 else 0.0,
+            "num_bodies": len(self.entries),
+            "num_bytes": self.num_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+    def reset_counters(self):
+        self.counters.zero_()
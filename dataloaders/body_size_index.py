@@ -0,0 +1,174 @@
+"""
+A single file holding the size of every body in a dataset.
+
+Batch samplers like the MaxNumFacesSampler need the number of faces
+in each body before the first batch is created.  Loading every body
+to find this means building or reading the whole cache before the
+first training step.  The size index records the sizes of all the
+bodies in the dataset file in one npz file written next to the
+dataset file
+
+    dataset.json  ->  dataset_sizes.npz
+
+The npz file contains one array of size [ num_bodies ] for each
+of the values in BODY_SIZE_KEYS
+
+    num_faces             - The number of faces in the body
+    num_edges             - The number of edges
+    num_coedges           - The number of coedges
+    max_coedges_per_face  - The largest number of coedges around one face
+    grid_bytes            - The bytes needed for the face and coedge
+                            point grids when stored as float32
+
+and also
+
+    file_stems  - The file stem of each body
+    npz_dir     - The folder the npz files were read from
+
+The sizes are read from the array headers in the npz files, so the
+point grids are never loaded.  Only the small coedge_to_face array
+is read to find the number of coedges around each face.
+
+The index is built by pipeline/build_dataset_file.py.  For an existing
+dataset file use
+
+    python -m dataloaders.body_size_index \\
+        --dataset_file /path/to/dataset.json \\
+        --npz_folder /path/to/npz/files
+"""
+import argparse
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+import zipfile
+
+import utils.data_utils as data_utils
+from dataloaders.label_store import DATASET_SPLITS
+
+BODY_SIZE_KEYS = [
+    "num_faces",
+    "num_edges",
+    "num_coedges",
+    "max_coedges_per_face",
+    "grid_bytes"
+]
+
+# The point grids which are counted in grid_bytes
+GRID_NPZ_KEYS = ["face_point_grids", "coedge_point_grids"]
+
+
+def body_size_index_pathname(dataset_file):
+    dataset_file = Path(dataset_file)
+    return dataset_file.with_name(dataset_file.stem + "_sizes.npz")
+
+
+def read_npz_array_shapes(npz_pathname, keys):
+    """
+    Read the shapes of the arrays in an npz file from the
+    array headers, without loading the arrays
+    """
+    shapes = {}
+    with zipfile.ZipFile(npz_pathname) as zf:
+        for key in keys:
+            with zf.open(data_utils.NPZ_KEYS[key] + ".npy") as fp:
+                version = np.lib.format.read_magic(fp)
+                if version == (1, 0):
+                    shape, _, _ = np.lib.format.read_array_header_1_0(fp)
+                else:
+                    shape, _, _ = np.lib.format.read_array_header_2_0(fp)
+            shapes[key] = shape
+    return shapes
+
+
+def find_body_size(npz_pathname):
+    """
+    Find the sizes of the body in the npz file
+    """
+    shapes = read_npz_array_shapes(
+        npz_pathname,
+        ["face_features", "edge_features", "coedge_to_face"] + GRID_NPZ_KEYS
+    )
+    num_faces = shapes["face_features"][0]
+    coedge_to_face = data_utils.load_npz_data(npz_pathname, ["coedge_to_face"])["coedge_to_face"]
+    max_coedges_per_face = 0
+    if coedge_to_face.size > 0:
+        max_coedges_per_face = np.bincount(coedge_to_face, minlength=num_faces).max()
+    float32_bytes = np.dtype(np.float32).itemsize
+    grid_bytes = sum(int(np.prod(shapes[key]))*float32_bytes for key in GRID_NPZ_KEYS)
+    return {
+        "num_faces": num_faces,
+        "num_edges": shapes["edge_features"][0],
+        "num_coedges": shapes["coedge_to_face"][0],
+        "max_coedges_per_face": int(max_coedges_per_face),
+        "grid_bytes": grid_bytes
+    }
+
+
+def build_body_size_index(npz_dir, file_stems, output_pathname):
+    """
+    Find the sizes of each body and write them into
+    a single size index file
+    """
+    npz_dir = Path(npz_dir)
+    sizes = { key: np.zeros(len(file_stems), dtype=np.int64) for key in BODY_SIZE_KEYS }
+    for i, file_stem in enumerate(tqdm(file_stems)):
+        body_size = find_body_size(npz_dir / (file_stem + ".npz"))
+        for key in BODY_SIZE_KEYS:
+            sizes[key][i] = body_size[key]
+
+    # Write to a temporary file and rename, so a partially
+    # written index is never read
+    with data_utils.atomic_write(output_pathname) as fp:
+        np.savez(
+            fp,
+            file_stems=np.array(file_stems, dtype=str),
+            npz_dir=np.array(str(npz_dir.resolve())),
+            **sizes
+        )
+
+
+def build_body_size_index_for_dataset(dataset_file, npz_dir):
+    """
+    Build the size index for all the bodies in the dataset file
+    """
+    dataset_info = data_utils.load_json_data(dataset_file)
+    file_stems = []
+    for split in DATASET_SPLITS:
+        file_stems.extend(dataset_info.get(split, []))
+    output_pathname = body_size_index_pathname(dataset_file)
+    build_body_size_index(npz_dir, file_stems, output_pathname)
+    return output_pathname
+
+
+class BodySizeIndex:
+    """
+    Reads the size of each body from a size index file
+    """
+
+    def __init__(self, pathname):
+        with np.load(pathname) as data:
+            self.sizes = { key: data[key] for key in BODY_SIZE_KEYS }
+            self.npz_dir = Path(str(data["npz_dir"]))
+            file_stems = data["file_stems"]
+        self.stem_to_index = { str(stem): i for i, stem in enumerate(file_stems) }
+
+
+    def __contains__(self, file_stem):
+        return file_stem in self.stem_to_index
+
+
+    def get(self, file_stem):
+        """
+        Get a dict with the sizes of one body
+        """
+        idx = self.stem_to_index[file_stem]
+        return { key: int(self.sizes[key][idx]) for key in BODY_SIZE_KEYS }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_file", type=str, required=True, help="Path to the dataset file")
+    parser.add_argument("--npz_folder", type=str, required=True, help="Path to the folder containing the npz files")
+    args = parser.parse_args()
+    output_pathname = build_body_size_index_for_dataset(args.dataset_file, args.npz_folder)
+    print(f"Size index written to {output_pathname}")
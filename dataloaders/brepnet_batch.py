@@ -0,0 +1,147 @@
+"""
+The batch of B-Rep data created by brepnet_collate_fn().
+
+A plain dict of the batch holds a list with a dict of index tensors
+for each solid.  Pinning or moving this to the GPU means one copy for
+every one of these small tensors.  The BRepNetBatch keeps the face
+indices for all the solids in one flat tensor with the number of faces,
+edges and coedges in each solid held as python lists, so the whole batch
+is a handful of tensors.  The split_batch list is built from views into
+the flat tensor when it is asked for.
+
+The batch can be used like the dict returned by the collate function
+
+    Xf = batch["face_features"]
+    Gf = batch.get("face_point_grids")
+    Csf = batch["coedges_of_big_faces"]
+    Csf_offsets = batch["big_face_coedge_offsets"]
+    for split_solid, file_stem in zip(batch["split_batch"], batch["file_stems"]):
+        ...
+
+The DataLoader calls pin_memory() when it is created with pin_memory=True
+and BRepNet.transfer_batch_to_device() calls to() with non_blocking=True,
+so the copy to the GPU can overlap with the computation on the previous
+batch.
+"""
+import torch
+
+
+class BRepNetBatch:
+    """
+    A batch of B-Rep data which can be pinned and moved to a
+    device as a whole
+    """
+
+    def __init__(
+            self,
+            tensors,
+            face_indices,
+            num_faces,
+            num_edges,
+            num_coedges,
+            file_stems
+        ):
+        """
+        Args:
+            tensors               Dict of the tensors in the batch
+
+            face_indices          For each solid, the indices of its faces
+                                  in the batch, concatenated into one tensor
+
+            num_faces, num_edges, The number of faces, edges and coedges in
+            num_coedges           each solid
+
+            file_stems            The file stem of each solid
+        """
+        self.tensors = tensors
+        self.face_indices = face_indices
+        self.num_faces = num_faces
+        self.num_edges = num_edges
+        self.num_coedges = num_coedges
+        self.file_stems = file_stems
+
+
+    @property
+    def device(self):
+        return self.face_indices.device
+
+
+    def keys(self):
+        return list(self.tensors.keys()) + ["split_batch", "file_stems"]
+
+
+    def __contains__(self, key):
+        return key in self.tensors or key in ["split_batch", "file_stems"]
+
+
+    def __getitem__(self, key):
+        if key in self.tensors:
+            return self.tensors[key]
+        if key == "split_batch":
+            return self.split_batch()
+        if key == "file_stems":
+            return self.file_stems
+        raise KeyError(key)
+
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+    def to_dict(self):
+        """
+        Get the batch in the form of the dict returned by the
+        original collate function
+        """
+        return { key: self[key] for key in self.keys() }
+
+
+    def split_batch(self):
+        """
+        Get the indices of the faces, edges and coedges of
+        each solid in the batch
+        """
+        edge_indices = torch.arange(sum(self.num_edges), dtype=torch.int64, device=self.device)
+        coedge_indices = torch.arange(sum(self.num_coedges), dtype=torch.int64, device=self.device)
+        split_batch = []
+        for face_indices_for_brep, edge_indices_for_brep, coedge_indices_for_brep in zip(
+                self.face_indices.split(self.num_faces),
+                edge_indices.split(self.num_edges),
+                coedge_indices.split(self.num_coedges)
+            ):
+            split_batch.append(
+                {
+                    "edge_indices": edge_indices_for_brep,
+                    "coedge_indices": coedge_indices_for_brep,
+                    "face_indices": face_indices_for_brep
+                }
+            )
+        return split_batch
+
+
+    def apply(self, func):
+        """
+        Create a new batch with func applied to each tensor
+        """
+        return BRepNetBatch(
+            { key: func(t) for key, t in self.tensors.items() },
+            func(self.face_indices),
+            self.num_faces,
+            self.num_edges,
+            self.num_coedges,
+            self.file_stems
+        )
+
+
+    def pin_memory(self):
+        return self.apply(lambda t: t.pin_memory())
+
+
+    def to(self, device, non_blocking=True):
+        """
+        Move the batch to the device.  The copies from pinned memory
+        are asynchronous unless non_blocking is False
+        """
+        return self.apply(lambda t: t.to(device, non_blocking=non_blocking))
@@ -99,13 +99,21 @@ For each BRep model the following tensors are created.
     Csf - The coedges of "large" faces
          
          For faces which have more than max_coedges_per_face around them
-         the indices are stored in an array
-          
-            Csf = [
-                Csf.size() = [ num_coedges_in_face_1 ],
-                Csf.size() = [ num_coedges_in_face_2 ],
-                ...
-            ]
+         the indices are stored in compressed sparse row (CSR) form.  The
+         coedges of all the big faces are concatenated into one index tensor
+
+            Csf.size() = [ num_coedges_in_big_faces ]
+
+         and the coedges of big face i are 
+
+            Csf[Csf_offsets[i]:Csf_offsets[i+1]]
+
+         where 
+
+            Csf_offsets.size() = [ num_big_faces + 1 ]
+
+         These are in the data as coedges_of_big_faces and 
+         big_face_coedge_offsets
 
         In models/brepnet.py find_max_feature_vectors_for_each_face()
         the Cf and Csf index tensors get used for the max pooling operation.
@@ -113,6 +121,18 @@ For each BRep model the following tensors are created.
         Notice that the re-ordering of the faces in Xf and Kf allows the new
         hidden states to be efficiently computed by concatenating tensors.
 
+    Fc - The face of each coedge
+
+         This is an index tensor of size [ num_coedges ] with the index
+         of the parent face of each coedge, in the order of the faces
+         in Xf.  It is in the data as coedge_to_face.  The segmented
+         face pooling in models/segment_max.py uses this in place of
+         Cf and Csf.
+
+         When the reorder_faces option is 0 the faces are left in their
+         original order.  Cf and Csf are then empty, and the model must 
+         use the segmented face pooling.
+
     labels - These are the segment indices for each face
 
        Notice that these are also re-ordered as described above. 
@@ -124,6 +144,17 @@ For each BRep model the following tensors are created.
                 batch
 
 
+Optional fields
+
+The feature and grid tensors are only loaded when the model options 
+say they will be used.  See find_required_fields().  The point grids 
+which are not used are not read from the npz files, are not cached and
+are left out of the batches.  Feature tensors which are not used are 
+replaced by tensors with zero columns, as we still need to know the 
+number of faces, edges and coedges.  The coedge_lcs is not used by
+BRepNet and is only loaded if it is asked for with the fields argument.
+
+
 Splitting batches
 
 BRepNet processes multiple solids in batches.  brepnet_collate_fn()
@@ -157,11 +188,77 @@ from torch.utils.data import Dataset
 from pathlib import Path
 import math
 import numpy as np
-import hashlib
 import copy
 import pickle
 
 import utils.data_utils as data_utils
+from dataloaders.feature_standardizer import (
+    FeatureStandardizer,
+    build_mean_and_sd_tensors,
+    standardize_feature_tensor
+)
+from dataloaders.packed_cache import PackedCache
+from dataloaders.kernel_compiler import CompiledKernel
+from dataloaders.cache_manifest import CacheManifest, CACHE_FORMAT_VERSION
+from dataloaders.label_store import LabelStore, label_store_pathname
+from dataloaders.body_size_index import (
+    BodySizeIndex,
+    BODY_SIZE_KEYS,
+    body_size_index_pathname,
+    find_body_size
+)
+from dataloaders.body_memory_cache import BodyMemoryCache
+from dataloaders.brepnet_batch import BRepNetBatch
+
+# The tensors which are only loaded when the model options say
+# they will be used.  All the other tensors are always loaded
+OPTIONAL_FIELDS = [
+    "face_features",
+    "face_point_grids",
+    "edge_features",
+    "edge_point_grids",
+    "coedge_features",
+    "coedge_point_grids",
+    "coedge_lcs"
+]
+
+# The arrays in the npz files which are always needed to
+# build the topology tensors
+TOPOLOGY_NPZ_KEYS = [
+    "coedge_to_next",
+    "coedge_to_mate",
+    "coedge_to_face",
+    "coedge_to_edge"
+]
+
+
+# The dtypes which can be used to store the point grids
+# and features in the cache
+STORAGE_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16
+}
+
+# The faces with more coedges than this are the big faces
+# at the end of each body
+MAX_COEDGES_PER_FACE = 30
+
+
+def find_required_fields(opts):
+    """
+    Find which of the optional fields are used with the given
+    model options.   Options which are not given are assumed
+    to be on.  The coedge_lcs is not used by BRepNet
+    """
+    fields = set()
+    for entity in ["face", "edge", "coedge"]:
+        if getattr(opts, f"use_{entity}_features", 1):
+            fields.add(f"{entity}_features")
+        if getattr(opts, f"use_{entity}_grids", 1):
+            fields.add(f"{entity}_point_grids")
+    return fields
+
 
 class BRepNetDataset(Dataset):
     """
@@ -169,13 +266,34 @@ class BRepNetDataset(Dataset):
     pipeline/extract_brepnet_data_from_step.py
     """
 
-    def __init__(self, opts, train_val_or_test):
+    def __init__(self, opts, train_val_or_test, fields=None):
         super(BRepNetDataset, self).__init__()
         self.opts = opts
 
+        # The optional fields we need to load.  By default these
+        # are the ones used by the model options
+        if fields is None:
+            fields = find_required_fields(opts)
+        for field in fields:
+            assert field in OPTIONAL_FIELDS, f"Unknown field {field}"
+        self.fields = set(fields)
+
+        # The point grids and features can be stored in half precision
+        # to save disk space and memory.  The model upcasts them
+        self.grid_dtype = STORAGE_DTYPES[opts.grid_dtype]
+        self.feature_dtype = STORAGE_DTYPES[opts.feature_dtype]
+
+        # The faces with more than 30 coedges are moved after the
+        # other faces unless this is turned off
+        self.reorder_faces = bool(getattr(opts, "reorder_faces", 1))
+
         # Load the topological walks in to be used in the kernel
         self.kernel = data_utils.load_json_data(self.opts.kernel)
 
+        # Compile the walks into a single gather program which
+        # shares the common prefixes between walks
+        self.compiled_kernel = CompiledKernel(self.kernel)
+
         # Load the list of input features to be used
         self.feature_lists = data_utils.load_json_data(self.opts.input_features)
         
@@ -185,10 +303,28 @@ class BRepNetDataset(Dataset):
 
         self.bodies = dataset_info[train_val_or_test]
         self.feature_standardization = dataset_info["feature_standardization"]
+        self.feature_standardizer = FeatureStandardizer(
+            self.feature_standardization,
+            validate=self.opts.validate_standardization
+        )
         self.dataset_dir = Path(self.opts.dataset_dir)
         self.label_dir = self.find_label_dir(opts, train_val_or_test)
+        self.label_store = self.open_label_store(opts)
+        self.body_size_index = self.open_body_size_index(opts)
         self.cache_dir = self.create_cache_dir(self.dataset_dir)
 
+        # The manifest keeps the cache for this configuration in its
+        # own folder, and indexes the bodies which are already cached
+        self.cache_manifest = CacheManifest(self.cache_dir, self.cache_config())
+
+        # The packed cache holds all the bodies for this split in 
+        # a few large memory mapped files
+        self.packed_cache_dir = self.cache_manifest.packed_cache_dir(train_val_or_test)
+        self.packed_cache = self.open_packed_cache(opts)
+
+        # The optional in-memory cache in front of the per-body cache files
+        self.memory_cache = self.create_memory_cache(opts)
+
 
     def __len__(self):
         """
@@ -203,59 +339,82 @@ class BRepNetDataset(Dataset):
         Cache the binary data if not.
         """ 
         assert idx < len(self.bodies)
-        cache_pathname = self.get_cache_pathname(idx)
-        if cache_pathname.exists():
-            body_data = self.load_body_from_cache(cache_pathname)
-        else:
-            body_data = self.load_and_cache_body(idx, cache_pathname)
+        if self.packed_cache is not None:
+            body_data = self.load_body_from_packed_cache(idx)
+            if body_data is not None:
+                return body_data
+        if self.memory_cache is not None:
+            body_data = self.memory_cache.get(idx)
+            if body_data is not None:
+                return body_data
+        body_data = self.load_body_from_cache_or_build(idx)
+        if self.memory_cache is not None:
+            self.memory_cache.put(idx, body_data)
         return body_data
 
 
-    def hash_strings_in_list(self, string_list):
+    def load_body_from_cache_or_build(self, idx):
         """
-        Create a hash of the strings in the list
+        Load the body from its cache file, building the 
+        cache file first if it doesn't exist
         """
-        single_str = str().join(string_list)
-        single_str = single_str.encode('ascii', 'replace')
-
-        return hashlib.sha224(single_str).hexdigest()
+        cache_pathname = self.get_cache_pathname(idx)
+        if self.is_cached(idx):
+            return self.load_body_from_cache(cache_pathname)
+        assert not self.opts.require_cache, \
+            f"Body {self.bodies[idx]} is not in the cache.  Build the cache with python -m dataloaders.build_cache"
+        return self.load_and_cache_body(idx, cache_pathname)
 
 
-    def hash_data_for_body(self, body_filestem):
+    def cache_config(self):
         """
         We want to be sure that the cache is correctly built given
-        all the hyper-parameters of the network.
-        Here we make a hash of these hyper-parameters and 
-        use this as the pathname for the cache
-        """
-        string_list = [ body_filestem ]
-        for ent in self.kernel:
-            for walk in self.kernel[ent]:
-                string_list.append(walk)
-        for ent in self.feature_lists.values():
-            feature_list = list(ent)
-            sorted_feature_list = sorted(feature_list)
-            for feature in sorted_feature_list:
-                string_list.append(feature)
-        if self.label_dir is not None:
-            string_list.append("with_labels")
-        return self.hash_strings_in_list(string_list)
+        all the hyper-parameters of the network.  This dictionary 
+        holds everything which affects the cached data.  A hash of 
+        it names the folder holding the cache
+        """
+        feature_lists = {}
+        for ent, feature_list in self.feature_lists.items():
+            feature_lists[ent] = sorted(feature_list)
+        return {
+            "format_version": CACHE_FORMAT_VERSION,
+            "kernel": self.kernel,
+            "input_features": feature_lists,
+            "feature_standardization": self.feature_standardization,
+            "with_labels": self.label_dir is not None,
+            "fields": sorted(self.fields),
+            "grid_dtype": self.opts.grid_dtype,
+            "feature_dtype": self.opts.feature_dtype,
+            "reorder_faces": self.reorder_faces
+        }
+
+
+    def hash_data_for_config(self):
+        """
+        The hash of the hyper-parameters which affect the cached data
+        """
+        return self.cache_manifest.config_hash
 
 
     def get_cache_pathname(self, idx):
         """
         Create a pathname for the cache file for the batch with idx
         """
-        body_filestem = self.bodies[idx]
-        hstring = self.hash_data_for_body(body_filestem)
-        return (self.cache_dir/hstring).with_suffix(".p")
+        return self.cache_manifest.entry_pathname(self.bodies[idx])
+
+
+    def is_cached(self, idx):
+        return self.cache_manifest.contains(self.bodies[idx])
 
     
     def cache_body(self, cache_pathname, data):
         """
-        Save the cache data for the body
+        Save the cache data for the body.  The data is written to a 
+        temporary file which is then renamed, so other processes 
+        reading the cache never see a partially written file
         """
-        torch.save(data, cache_pathname)
+        with data_utils.atomic_write(cache_pathname) as fp:
+            torch.save(data, fp)
 
 
     def load_body_from_cache(self, cache_pathname):
@@ -265,6 +424,66 @@ class BRepNetDataset(Dataset):
         return torch.load(cache_pathname)
 
 
+    def open_packed_cache(self, opts):
+        """
+        Open the packed cache for this split if it was requested
+        and has been built
+        """
+        if opts.cache_format != "packed":
+            return None
+        if not PackedCache.exists(self.packed_cache_dir):
+            print(f"Warning! - No packed cache found at {self.packed_cache_dir}")
+            print("Use python -m dataloaders.packed_cache to build it.  Using the per-body cache")
+            return None
+        return PackedCache(self.packed_cache_dir)
+
+
+    def create_memory_cache(self, opts):
+        """
+        Create the in-memory cache if a budget was given
+        """
+        if opts.memory_cache_gb <= 0.0:
+            return None
+        max_bytes = int(opts.memory_cache_gb*(1024**3))
+        return BodyMemoryCache(max_bytes)
+
+
+    def prefill_memory_cache(self):
+        """
+        Load bodies into the in-memory cache until the budget is
+        used up.  This must be called in the main process before the 
+        DataLoader starts its worker processes, as the workers can 
+        read from the cache but not add to it
+        """
+        if self.memory_cache is None:
+            return
+        if self.packed_cache is not None:
+            # The packed cache files are memory mapped, so the 
+            # operating system already shares them between workers
+            return
+        for idx in range(len(self.bodies)):
+            if idx in self.memory_cache.entries:
+                continue
+            body_data = self.load_body_from_cache_or_build(idx)
+            if not self.memory_cache.has_space_for(body_data):
+                break
+            self.memory_cache.put(idx, body_data)
+        self.memory_cache.reset_counters()
+        print(f"Memory cache holds {len(self.memory_cache.entries)} of {len(self.bodies)} bodies")
+
+
+    def load_body_from_packed_cache(self, idx):
+        """
+        Get the body with idx from the packed cache.  The tensors are 
+        views into the memory mapped cache files.  If the body is 
+        not in the packed cache then None is returned
+        """
+        file_stem = self.bodies[idx]
+        if not file_stem in self.packed_cache.stem_to_index:
+            return None
+        return self.packed_cache.find_body(file_stem)
+
+
     def load_and_cache_body(self, idx, cache_pathname):
         """
         Load the body with idx from the
@@ -273,13 +492,13 @@ class BRepNetDataset(Dataset):
         """
         body_data = self.load_body(idx)
         self.cache_body(cache_pathname, body_data)
+        self.cache_manifest.add(self.bodies[idx])
         return body_data
 
 
     def create_cache_dir(self, dataset_dir):
         cache_dir = dataset_dir / "cache"
-        if not cache_dir.exists():
-            cache_dir.mkdir()
+        cache_dir.mkdir(exist_ok=True)
         assert cache_dir.exists(), "Check we were able to create the cache dir"
         return cache_dir
 
@@ -344,7 +563,7 @@ class BRepNetDataset(Dataset):
         assert idx < len(self.bodies)
         file_stem = self.bodies[idx]
         npz_pathname = self.dataset_dir / (file_stem + ".npz")
-        body_data = data_utils.load_npz_data(npz_pathname)
+        body_data = data_utils.load_npz_data(npz_pathname, self.find_npz_keys())
         Xf, Xe, Xc = self.build_input_feature_tensors(body_data)
         Kf, Ke, Kc = self.build_kernel_tensors(body_data)
 
@@ -357,28 +576,34 @@ class BRepNetDataset(Dataset):
         # direction of the coedge
         #
         # lcs is the local coordinate systems for each coedge
+        #
+        # Any of these which are not in self.fields are None
         Gf, Gc, lcs = self.build_point_grids(body_data)
 
         # We need to rearrange the order of the faces so that
         # faces with more than max_coedges_per_face are at the 
         # end of the array
-        max_coedges_per_face = 30
+        max_coedges_per_face = MAX_COEDGES_PER_FACE
         Ce = self.build_coedges_of_edges_tensor(body_data)
 
-        # Try building point grids from the left coedges 
-        # of each edge
-        Ge = self.build_edge_grids_from_left_coedges(Gc, Ce, body_data)
-
-        Cf, Csf, new_to_old_face_indices = self.build_coedges_of_faces_tensor(
-            body_data, 
-            max_coedges_per_face         
-        )
+        if self.reorder_faces:
+            Cf, Csf, Csf_offsets, new_to_old_face_indices = self.build_coedges_of_faces_tensor(
+                body_data, 
+                max_coedges_per_face         
+            )
+        else:
+            # The faces stay in their original order.  The tensors
+            # for the padded face pooling are left empty
+            Cf = torch.zeros((0, max_coedges_per_face), dtype=torch.int64)
+            Csf = torch.zeros(0, dtype=torch.int64)
+            Csf_offsets = torch.zeros(1, dtype=torch.int64)
+            new_to_old_face_indices = torch.arange(Xf.size(0))
 
         old_to_new_face_indices = self.find_inverse_permutation(new_to_old_face_indices)
 
         Kf_perm = old_to_new_face_indices[Kf]
         Xf_perm = Xf[new_to_old_face_indices]
-        Gf_perm = Gf[new_to_old_face_indices]
+        Fc = old_to_new_face_indices[torch.from_numpy(body_data["coedge_to_face"].astype(np.int64))]
 
         # If we are evaluating a pre-trained model on a dataset
         # with no labels then the label_dir will be none.  In this
@@ -391,24 +616,52 @@ class BRepNetDataset(Dataset):
 
         data = {
             "face_features": Xf_perm,
-            "face_point_grids": Gf_perm,
             "edge_features": Xe,
-            "edge_point_grids": Ge,
             "coedge_features": Xc,
-            "coedge_point_grids": Gc,
-            "coedge_lcs": lcs,
             "face_kernel_tensor": Kf_perm,
             "edge_kernel_tensor": Ke,
             "coedge_kernel_tensor": Kc,
             "coedges_of_edges": Ce,
             "coedges_of_small_faces": Cf,
             "coedges_of_big_faces": Csf,
+            "big_face_coedge_offsets": Csf_offsets,
+            "coedge_to_face": Fc,
             "labels": labels_perm,
             "old_to_new_face_indices": old_to_new_face_indices,
             "file_stem": file_stem
         }
+        if "face_point_grids" in self.fields:
+            data["face_point_grids"] = Gf[new_to_old_face_indices]
+        if "edge_point_grids" in self.fields:
+            # Try building point grids from the left coedges 
+            # of each edge
+            data["edge_point_grids"] = self.build_edge_grids_from_left_coedges(Gc, Ce, body_data)
+        if "coedge_point_grids" in self.fields:
+            data["coedge_point_grids"] = Gc
+        if "coedge_lcs" in self.fields:
+            data["coedge_lcs"] = lcs
         return data
 
+
+    def find_npz_keys(self):
+        """
+        Find the arrays we need to read from the npz files.  The
+        feature arrays are always read, as they are small and give the
+        number of faces, edges and coedges.  The other arrays are only
+        read when needed
+        """
+        keys = list(TOPOLOGY_NPZ_KEYS)
+        keys.extend(FeatureStandardizer.entity_types)
+        if "face_point_grids" in self.fields:
+            keys.append("face_point_grids")
+        if "coedge_point_grids" in self.fields or "edge_point_grids" in self.fields:
+            keys.append("coedge_point_grids")
+        if "edge_point_grids" in self.fields:
+            keys.append("coedge_reverse_flags")
+        if "coedge_lcs" in self.fields:
+            keys.append("coedge_lcs")
+        return keys
+
     def build_kernel_tensors(self, body_data):
         n = body_data["coedge_to_next"]
         m = body_data["coedge_to_mate"]
@@ -435,77 +688,62 @@ class BRepNetDataset(Dataset):
         # inverse (also the transpose) of a permutation matrix.
         p = self.find_inverse_permutation(n)
 
-        # Now we can build the kernel tensors for the faces, edges and coedges
-        Kf = self.build_kernel_tensor_from_topology(n, p, m, e, f, self.kernel["faces"])
-        Ke = self.build_kernel_tensor_from_topology(n, p, m, e, f, self.kernel["edges"])
-        Kc = self.build_kernel_tensor_from_topology(n, p, m, e, f, self.kernel["coedges"])
-
-        return Kf, Ke, Kc
+        # Now we can build the kernel tensors for the faces, edges and coedges.
+        # See build_kernel_tensor_from_topology() for a description of how 
+        # the walks are evaluated.  The compiled kernel does the same thing,
+        # but evaluates the walks for all three tensors together
+        return self.compiled_kernel.build_kernel_tensors(n, p, m, e, f)
 
 
     def build_input_feature_tensors(self, body_data):
         """
         Convert the feature tensors for faces, edges and coedges
-        from numpy to pytorch
+        from numpy to pytorch and standardize them
         """
-        Xf = torch.from_numpy(body_data["face_features"])
-        Xe = torch.from_numpy(body_data["edge_features"])
-        Xc = torch.from_numpy(body_data["coedge_features"])
-
-        Xf = self.standardize_features(
-            Xf, 
-            self.feature_standardization["face_features"]
-        )
-        Xe = self.standardize_features(
-            Xe, 
-            self.feature_standardization["edge_features"]
-        )
-        Xc = self.standardize_features(
-            Xc, 
-            self.feature_standardization["coedge_features"]
-        )
-
-        return Xf, Xe, Xc
+        feature_tensors = []
+        for entity_type in FeatureStandardizer.entity_types:
+            X = torch.from_numpy(body_data[entity_type])
+            if entity_type in self.fields:
+                X = self.feature_standardizer.standardize(X, entity_type)
+                X = X.to(self.feature_dtype)
+            else:
+                # Features which are not used are replaced by a 
+                # tensor with no columns.  This keeps track of the
+                # number of entities without storing any data
+                X = torch.zeros((X.size(0), 0))
+            feature_tensors.append(X)
+        return tuple(feature_tensors)
 
 
     def standardize_features(self, feature_tensor, stats):
-        num_features = len(stats)
-        assert feature_tensor.size(1) == num_features
-        means = torch.zeros(num_features, dtype=feature_tensor.dtype)
-        sds = torch.zeros(num_features, dtype=feature_tensor.dtype)
-        eps = 1e-7
-        for index, s in enumerate(stats):
-            assert s["standard_deviation"] > eps, "Feature has zero standard deviation"
-            means[index] = s["mean"]
-            sds[index] = s["standard_deviation"]
-
-        # We need to broadcast means and sds over the number of entities
-        means.unsqueeze(0)
-        sds.unsqueeze(0)
-        feature_tensor_zero_mean = feature_tensor - means
-        feature_tensor_standadized = feature_tensor_zero_mean / sds
-
-        # Test code to check this works
-        num_ents = feature_tensor.size(0) 
-        test_tensor = torch.zeros((num_ents, num_features), dtype=feature_tensor.dtype)
-        for i in range(num_ents):
-            for j in range(num_features):
-                value = (feature_tensor[i,j] - means[j])/sds[j]
-                test_tensor[i,j] = value
-        assert torch.allclose(feature_tensor_standadized, test_tensor, eps)
-
-        # Convert the tensors to floats after standardization 
-        return feature_tensor_standadized.float()
+        """
+        Standardize a single feature tensor using the given list of 
+        per-feature stats.  When loading bodies the precomputed
+        self.feature_standardizer is used instead
+        """
+        means, sds = build_mean_and_sd_tensors(stats)
+        return standardize_feature_tensor(
+            feature_tensor, 
+            means, 
+            sds, 
+            self.opts.validate_standardization
+        )
 
     def build_point_grids(self, body_data):
         """
         Read the point grid and LCS data and convert it to
-        pytorch
+        pytorch.  Data which was not read from the npz file 
+        is returned as None.  The grids are converted to the
+        storage dtype straight from the dtype in the npz file
         """
-        face_point_grids = torch.from_numpy(body_data["face_point_grids"])
-        coedge_point_grids = torch.from_numpy(body_data["coedge_point_grids"])
-        coedge_lcs = torch.from_numpy(body_data["coedge_lcs"])
-        return face_point_grids.float(), coedge_point_grids.float(), coedge_lcs.float()
+        tensors = []
+        for key in ["face_point_grids", "coedge_point_grids", "coedge_lcs"]:
+            if key in body_data:
+                dtype = torch.float32 if key == "coedge_lcs" else self.grid_dtype
+                tensors.append(torch.from_numpy(body_data[key]).to(dtype))
+            else:
+                tensors.append(None)
+        return tuple(tensors)
 
 
     def build_edge_grids_from_left_coedges(self, Gc, Ce, body_data):
@@ -513,19 +751,11 @@ class BRepNetDataset(Dataset):
         Try building point grids from the left coedges 
         of each edge
         """
-        # Lets do this the slow way to start with
-        num_edges = Ce.size(0)
-        left_coedge_indices = torch.zeros(num_edges, dtype=torch.int64)
-        reverse_flags = body_data["coedge_reverse_flags"]
-        
-        for edge_index in range(num_edges):
-            coedges = Ce[edge_index, :]
-            first_coedge_index = coedges[0]
-            second_coedge_index = coedges[1]
-            if reverse_flags[second_coedge_index]==1:
-                left_coedge_indices[edge_index] = first_coedge_index
-            else: 
-                left_coedge_indices[edge_index] = second_coedge_index
+        # The left coedge is the second coedge of the edge, unless 
+        # the second coedge is reversed.  Then it is the first coedge
+        reverse_flags = torch.from_numpy(body_data["coedge_reverse_flags"] == 1)
+        second_coedge_reversed = reverse_flags[Ce[:, 1]]
+        left_coedge_indices = torch.where(second_coedge_reversed, Ce[:, 0], Ce[:, 1])
         return Gc[left_coedge_indices]
 
 
@@ -636,23 +866,28 @@ class BRepNetDataset(Dataset):
         The ith row of Ce contains the indices of the two
         coedges belonging to the ith parent edge
         """
-        coedge_to_edge = body_data["coedge_to_edge"]
+        coedge_to_edge = body_data["coedge_to_edge"].astype(np.int64)
         num_edges = body_data["edge_features"].shape[0]
-        coedges_of_edges = [ [] for i in range(num_edges)]
-        for coedge_index, edge_index in enumerate(coedge_to_edge):
-            coedges_of_edges[edge_index].append(coedge_index)
-        
-        for coedges in coedges_of_edges:
-            assert len(coedges) == 1 or len(coedges) == 2
-            if len(coedges) == 1:
-                # OK.  This is the special case of a sphere.  Here
-                # we have two coedges at te poles.  They link to themselves.
-                # As they are only used one each they don't have a second
-                # coedge in the coedges_of_edges array.  We add the same
-                # coedge twice here
-                coedges.append(coedges[0])
-
-        coedges_of_edges = torch.tensor(coedges_of_edges, dtype=torch.int64)
+        coedges_per_edge = np.bincount(coedge_to_edge, minlength=num_edges)
+        assert coedges_per_edge.size == num_edges
+        assert np.all((coedges_per_edge == 1) | (coedges_per_edge == 2))
+
+        # A stable sort groups the coedges by edge in order of
+        # increasing coedge index.  The first and last coedge in
+        # each group are the two coedges of the edge.
+        #
+        # For the special case of a sphere we have two coedges at 
+        # the poles.  They link to themselves.  As they are only used
+        # once each the first and last coedge of the edge are the same,
+        # so the same coedge appears twice in the row.
+        sorted_coedges = np.argsort(coedge_to_edge, kind="stable")
+        edge_starts = np.cumsum(coedges_per_edge) - coedges_per_edge
+        edge_ends = edge_starts + coedges_per_edge - 1
+        coedges_of_edges = np.stack(
+            [sorted_coedges[edge_starts], sorted_coedges[edge_ends]], 
+            axis=1
+        )
+        coedges_of_edges = torch.from_numpy(coedges_of_edges)
         return coedges_of_edges
 
 
@@ -672,78 +907,135 @@ class BRepNetDataset(Dataset):
         this padding to work.
 
         For faces with more than max_coedges coedges we have
-        an array of tensors of different sizes
+        the coedges of all the big faces in one index tensor
     
-        Csf = [
-            Csf.size() = [ num_coedges_in_face_1 ],
-            ...
-        ]
+        Csf.size() = [ num_coedges_in_big_faces ]
+
+        with the coedges of big face i in 
+
+        Csf[Csf_offsets[i]:Csf_offsets[i+1]]
         """
-        coedge_to_face = body_data["coedge_to_face"]
+        coedge_to_face = body_data["coedge_to_face"].astype(np.int64)
         num_faces = body_data["face_features"].shape[0]
         num_coedges = coedge_to_face.size
 
-        face_to_coedges = {}
-        for coedge_index, face_index in enumerate(coedge_to_face):
-            if not face_index in face_to_coedges:
-                face_to_coedges[face_index] = []
-            face_to_coedges[face_index].append(coedge_index)
-        
-        small_face_indices = []
-        big_face_indices = []
-        Cf = []
-        Csf = []
-        for face_index in range(num_faces):
-            assert face_index in face_to_coedges
-            assert len(face_to_coedges[face_index]) > 0
-            if len(face_to_coedges[face_index]) > max_coedges_per_face:
-                # This is the case where we have faces with lots of
-                # coedges around them.  We place these long lists of
-                # indices into an index tensor for each face
-                Csf.append(torch.tensor(face_to_coedges[face_index], dtype=torch.int64))
-                big_face_indices.append(face_index)
-            else:
-                # This is the case where we have only a small number
-                # of coedges around a face.  We want to build an 
-                # index tensor
-                #
-                # Cf.size() = [ num_small_faces x max_coedges ]
-                # 
-                # with the rows padded with the value 'num_coedges'
-                coedges_of_face = face_to_coedges[face_index]
-
-                # We need to pad the array with the value 'num_coedges'
-                padding_size = max_coedges_per_face - len(coedges_of_face)
-                coedges_of_face.extend([num_coedges] * padding_size)
-
-                # Append the row to the list.  We will stack this once it
-                # has been accumulated
-                Cf.append(torch.tensor(coedges_of_face, dtype=torch.int64))
-                small_face_indices.append(face_index)
-
-        # Stack the rows for the "small faces"
-        Cf = torch.stack(Cf)
+        # Every face must have at least one coedge around it
+        coedges_per_face = np.bincount(coedge_to_face, minlength=num_faces)
+        assert coedges_per_face.size == num_faces
+        assert np.all(coedges_per_face > 0)
+
+        # A stable sort groups the coedges by face while keeping the 
+        # coedges of each face in order of increasing coedge index.
+        # The coedges of face i are then 
+        #
+        #   sorted_coedges[face_starts[i]:face_starts[i]+coedges_per_face[i]]
+        sorted_coedges = np.argsort(coedge_to_face, kind="stable")
+        sorted_faces = coedge_to_face[sorted_coedges]
+        face_starts = np.cumsum(coedges_per_face) - coedges_per_face
+        position_in_face = np.arange(num_coedges) - face_starts[sorted_faces]
+
+        is_small_face = coedges_per_face <= max_coedges_per_face
+        small_face_indices = np.nonzero(is_small_face)[0]
+        big_face_indices = np.nonzero(~is_small_face)[0]
+
+        # For the small faces we scatter the coedge indices into a 
+        # tensor 
+        #
+        # Cf.size() = [ num_small_faces x max_coedges ]
+        # 
+        # which is pre-filled with the padding value 'num_coedges'
+        row_of_face = np.zeros(num_faces, dtype=np.int64)
+        row_of_face[small_face_indices] = np.arange(small_face_indices.size)
+        Cf = np.full((small_face_indices.size, max_coedges_per_face), num_coedges, dtype=np.int64)
+        in_small_face = is_small_face[sorted_faces]
+        Cf[
+            row_of_face[sorted_faces[in_small_face]], 
+            position_in_face[in_small_face]
+        ] = sorted_coedges[in_small_face]
+        Cf = torch.from_numpy(Cf)
+
+        # For faces with lots of coedges around them we place the long
+        # lists of indices one after another in a single index tensor.
+        # The sorted coedges are grouped by face in order of increasing
+        # face index, which is the order of big_face_indices
+        Csf = torch.from_numpy(sorted_coedges[~in_small_face])
+        Csf_offsets = np.zeros(big_face_indices.size + 1, dtype=np.int64)
+        np.cumsum(coedges_per_face[big_face_indices], out=Csf_offsets[1:])
+        Csf_offsets = torch.from_numpy(Csf_offsets)
 
         # Finally we need to define a "permutation" index tensor.  We want
         # re-arrange the face features Xf and and face indices in Kf so that the 
         # big faces come at the end of the tensors 
-        small_face_indices = torch.tensor(small_face_indices, dtype=torch.int64)
-        big_face_indices = torch.tensor(big_face_indices, dtype=torch.int64)
-        face_permutation = torch.cat([small_face_indices, big_face_indices])
+        face_permutation = torch.from_numpy(np.concatenate([small_face_indices, big_face_indices]))
+
+        return Cf, Csf, Csf_offsets, face_permutation
+
+
+    def open_label_store(self, opts):
+        """
+        Open the label store written next to the dataset file if it
+        exists and was built from the label dir we are using
+        """
+        if self.label_dir is None:
+            return None
+        pathname = label_store_pathname(opts.dataset_file)
+        if not pathname.exists():
+            return None
+        label_store = LabelStore(pathname)
+        if label_store.label_dir != self.label_dir.resolve():
+            print(f"Warning! - The label store {pathname} was built from {label_store.label_dir}")
+            print(f"Reading the seg files from {self.label_dir} instead")
+            return None
+        return label_store
 
-        return Cf, Csf, face_permutation
+
+    def open_body_size_index(self, opts):
+        """
+        Open the size index written next to the dataset file if it
+        exists and was built from the npz files we are using
+        """
+        pathname = body_size_index_pathname(opts.dataset_file)
+        if not pathname.exists():
+            return None
+        body_size_index = BodySizeIndex(pathname)
+        if body_size_index.npz_dir != self.dataset_dir.resolve():
+            print(f"Warning! - The size index {pathname} was built from {body_size_index.npz_dir}")
+            print(f"Reading the sizes from the npz files in {self.dataset_dir} instead")
+            return None
+        return body_size_index
+
+
+    def find_body_sizes(self):
+        """
+        Find the number of faces, edges and coedges, the largest number
+        of coedges around a face and the bytes of point grid data for each
+        body.  These come from the size index when it is available, so
+        the bodies don't need to be loaded.  Returns a dict of arrays 
+        with one entry per body for each key in BODY_SIZE_KEYS
+        """
+        sizes = { key: np.zeros(len(self.bodies), dtype=np.int64) for key in BODY_SIZE_KEYS }
+        num_missing = 0
+        for idx, file_stem in enumerate(self.bodies):
+            if self.body_size_index is not None and file_stem in self.body_size_index:
+                body_size = self.body_size_index.get(file_stem)
+            else:
+                body_size = find_body_size(self.dataset_dir / (file_stem + ".npz"))
+                num_missing += 1
+            for key in BODY_SIZE_KEYS:
+                sizes[key][idx] = body_size[key]
+        if num_missing > 0:
+            print(f"Warning! - {num_missing} bodies are not in the size index.  Their sizes were read from the npz files")
+            print("Use python -m dataloaders.body_size_index to build the index")
+        return sizes
 
 
     def load_labels(self, file_stem):
         """
-        Load the segmentation from the seg file
+        Load the segmentation from the label store, or from the 
+        seg file if the body isn't in the store
         """
         label_pathname = self.label_dir / (file_stem + ".seg")
-        face_labels = np.loadtxt(label_pathname, dtype=np.int64)
-        face_labels_tensor = torch.from_numpy(face_labels)
-        if face_labels_tensor.ndim == 0:
-            face_labels_tensor = torch.unsqueeze(face_labels_tensor, 0)
-        return face_labels_tensor
+        return torch.from_numpy(data_utils.load_labels(label_pathname, self.label_store))
 
 
     def find_inverse_permutation(self, perm):
@@ -764,227 +1056,216 @@ class BRepNetDataset(Dataset):
         inv_perm[perm] = identity
         return inv_perm
         
-def unsqueeze_single_dim_tensors(tensor_list):
-    unsqueezed = []
-    for t in tensor_list:
-        if t.ndim == 1:
-            unsqueezed.append(torch.unsqueeze(t, 0))
-        else:
-            unsqueezed.append(t)
-    return unsqueezed
-
-def concatenate_tensor_arrays(small, big, unsqueeze):
-    all = []
-    if unsqueeze:
-        small = unsqueeze_single_dim_tensors(small)
-        big = unsqueeze_single_dim_tensors(big)
-    all.extend(small)
-    all.extend(big)
-    return torch.cat(all)
-
-def add_offset_to_face_index(
-        face_indices, 
-        num_small_faces, 
-        small_face_offset, 
-        big_face_offset
-    ):
-    face_index_offset = small_face_offset*(face_indices < num_small_faces)
-
-    # The array was re-ordered so that small faces are always before
-    # big faces.
-    # The first big face has index "num_small_faces" are we need to map this to
-    # big_face_offset
-    face_index_offset += (big_face_offset-num_small_faces)*(face_indices >= num_small_faces)
-    return face_indices + face_index_offset
-
-
-def add_offset_to_coedge_index_with_padding(
-        padded_coedge_indices,
-        pad_value,
-        coedge_index_offset,
-        new_pad_value
-    ):
+def exclusive_cumsum(counts):
     """
-    In the coedges_of_small_faces array we have the indices
-    of coedges with padding at the end of the array.   The 
-    value of the padding in the input tensor is pad_value.
-    We want to change the values of the valid coedge indices 
-    and the padding separately.  The valid values want to 
-    be increased by  `coedge_index_offset`.   The padding
-    needs to be replaced by `new_pad_value`
+    The offset of the first item of each group when groups with
+    the given counts are laid out one after another
     """
-    coedge_index_offset = coedge_index_offset*(padded_coedge_indices != pad_value)
-    coedge_index_offset += (new_pad_value-pad_value)*(padded_coedge_indices == pad_value)
-    return padded_coedge_indices + coedge_index_offset
+    offsets = []
+    total = 0
+    for count in counts:
+        offsets.append(total)
+        total += count
+    return offsets, total
 
 
-def brepnet_collate_fn(data_list):
+def csr_from_tensor_list(tensors):
     """
-    Collate the data from multiple bodies into a single
-    set of tensors.
-    Here I call the faces with a small number of coedges
-    "small faces" and the coedges with a large number of
-    coedges "big faces".
+    Convert a list of 1D index tensors into a flat index tensor
+    and an offsets tensor with size [ len(tensors) + 1 ]
     """
-    Xf_small_faces = []
-    Xf_big_faces = []
-    Gf_small_faces = []
-    Gf_big_faces = []
-    labels_small_faces = []
-    labels_big_faces = []
-
-    Xe = []
-    Ge = []
-    Xc = []
-    Gc = []
-    lcs = []
-
-    Ke = [] # Edge indices for each coedge
-    Kc = [] # Coedge indices for each coedge
-
-    Ce = []   # Coedge indices for coedges owned by each edge
-    Csf = []  # Coedge indices for coedges owned by "big faces"
-
-    # Keep track of which file each B-Rep came from
-    file_stems = []
-
-    # Keep track of the data we need to split the batch
-    split_batch = []
-
-    # We need to make two passes through the data.
-    # In the first pass we process things which depend on
-    # coedge index and small faces.  In the second pass
-    # we work on modifying indices which depend on big faces
-    face_offset = 0
-    edge_offset = 0
-    coedge_offset = 0
-
-    for data in data_list:
-        # These are input features.  We just wan to concatentate 
-        # the tensors for each B-Rep
-        num_edges = data["edge_features"].shape[0]
-        Xe.append(data["edge_features"])
-        Ge.append(data["edge_point_grids"])
-
-        num_coedges = data["coedge_features"].shape[0]
-        Xc.append(data["coedge_features"])
-        Gc.append(data["coedge_point_grids"])
-        lcs.append(data["coedge_lcs"])
-
-        # For edge and coedge indices things are easy.  We just need to 
-        # add the offsets to the arrays
-        Ke.append(data["edge_kernel_tensor"] + edge_offset)
-        Ce.append(data["coedges_of_edges"] + coedge_offset)
-        Kc.append(data["coedge_kernel_tensor"] + coedge_offset)
-        
-        for single_face_coedges in data["coedges_of_big_faces"]:
-            Csf.append(single_face_coedges + coedge_offset)
-        
-        # Face features are a little more complicated.  We want
-        # to keep the faces with a small number of coedges
-        # at the start of the array and the faces with a large
-        # number of coedges in another array which will get
-        # appended to the end.
-
-        num_small_faces = data["coedges_of_small_faces"].shape[0]
-        num_big_faces = len(data["coedges_of_big_faces"])
-        Xf = data["face_features"]
-        Gf = data["face_point_grids"]
-        assert num_small_faces + num_big_faces == Xf.shape[0]
-        assert num_small_faces + num_big_faces == Gf.shape[0]
-        
-        # We need to slice the face feature tensor
-        Xf_small_faces.append(Xf[:num_small_faces])      
-        Xf_big_faces.extend(Xf[num_small_faces:])
+    offsets = torch.zeros(len(tensors) + 1, dtype=torch.int64)
+    if len(tensors) == 0:
+        return torch.zeros(0, dtype=torch.int64), offsets
+    torch.cumsum(torch.tensor([ t.shape[0] for t in tensors ], dtype=torch.int64), dim=0, out=offsets[1:])
+    return torch.cat(tensors).to(torch.int64), offsets
 
-        Gf_small_faces.append(Gf[:num_small_faces])
-        Gf_big_faces.append(Gf[num_small_faces:])
 
-        labels = data["labels"]
-        labels_small_faces.append(labels[:num_small_faces])
-        labels_big_faces.append(labels[num_small_faces:])
+def find_coedge_to_face(Cf, Csf, Csf_offsets, num_coedges):
+    """
+    Find the face of each coedge from the coedges of the small
+    faces, padded with num_coedges, and the coedges of the big
+    faces in CSR form
+    """
+    coedge_to_face = torch.zeros(num_coedges, dtype=torch.int64, device=Cf.device)
+    small_faces = torch.arange(Cf.size(0), device=Cf.device).unsqueeze(1).expand_as(Cf)
+    is_coedge = Cf < num_coedges
+    coedge_to_face[Cf[is_coedge]] = small_faces[is_coedge]
+    big_faces = torch.arange(Csf_offsets.size(0) - 1, device=Cf.device) + Cf.size(0)
+    coedge_to_face[Csf] = torch.repeat_interleave(big_faces, torch.diff(Csf_offsets))
+    return coedge_to_face
 
-        file_stems.append(data["file_stem"])
 
-        split_batch_data_for_brep = {
-            "edge_indices": torch.arange(edge_offset, edge_offset+num_edges, dtype=torch.int64),
-            "coedge_indices": torch.arange(coedge_offset, coedge_offset+num_coedges, dtype=torch.int64)
-        }
-        split_batch.append(split_batch_data_for_brep)
+def repeat_for_each_row(values, tensors):
+    """
+    Repeat the value for each body once for each row of its tensor,
+    so the concatenated tensors can be offset in a single operation
+    """
+    return torch.repeat_interleave(
+        torch.tensor(values, dtype=torch.int64),
+        torch.tensor([ t.shape[0] for t in tensors ], dtype=torch.int64)
+    )
 
-        face_offset += num_small_faces
-        edge_offset += num_edges
-        coedge_offset += num_coedges
-    
-    # This is the second pass through the data.  We need to
-    # set the indices of faces in Kf and the new_indices_of_brep_faces
-    # for each face in each B-Rep
-    Kf = []
-
-    # The coedge indices for coedges owned by "small faces" also needs to 
-    # be processed here as we need to apply different values to the 
-    # coedge indices and the padding
-    new_padding_value = coedge_offset
-    coedge_offset = 0
-    Cf = []   
-    small_face_offset = 0
-    for solid_index, data in enumerate(data_list):
-        num_small_faces = data["coedges_of_small_faces"].shape[0]
-        num_big_faces = len(data["coedges_of_big_faces"])
-        old_to_new_face_index = data["old_to_new_face_indices"]
-        num_coedges = data["coedge_features"].shape[0]
-
-        # We need to add on the offsets for the new face indices
-        # Here this is done for the indices which allow us to get
-        # back from the combined batch to the original face indices
-        # in each B-Rep
-        offset_old_to_new_face_index = add_offset_to_face_index(
-            old_to_new_face_index, 
-            num_small_faces, 
-            small_face_offset, 
-            face_offset
-        )
 
-        offset_coedges_of_small_faces = add_offset_to_coedge_index_with_padding(
-            data["coedges_of_small_faces"],
-            num_coedges,
-            coedge_offset,
-            new_padding_value
-        )
-        Cf.append(offset_coedges_of_small_faces)
+def concatenate_with_offsets(tensors, offsets):
+    """
+    Concatenate the index tensors for each body and add the
+    offset for the body to all its indices
+    """
+    batch_tensor = torch.cat(tensors)
+    row_offsets = repeat_for_each_row(offsets, tensors)
+    if batch_tensor.ndim > 1:
+        row_offsets = row_offsets.unsqueeze(1)
+    batch_tensor += row_offsets
+    return batch_tensor
 
-        split_batch[solid_index]["face_indices"] = offset_old_to_new_face_index
 
-        # Here we add on the offsets for the kernel Kf
-        brep_Kf = data["face_kernel_tensor"]
-        offset_Kf = add_offset_to_face_index(
-            brep_Kf, 
-            num_small_faces, 
-            small_face_offset, 
-            face_offset
-        )
-        Kf.append(offset_Kf)
+def concatenate_face_indices(tensors, num_small_faces, small_face_offsets, big_face_offsets):
+    """
+    Concatenate the face index tensors for each body and map them
+    to the face indices in the batch.  In each body the small faces
+    come before the big faces.  The first big face has index
+    num_small_faces and we need to map this to big_face_offset
+    """
+    batch_tensor = torch.cat(tensors)
+    row_num_small_faces = repeat_for_each_row(num_small_faces, tensors)
+    small_offsets = repeat_for_each_row(small_face_offsets, tensors)
+    big_offsets = repeat_for_each_row(
+        [ offset - n for offset, n in zip(big_face_offsets, num_small_faces) ],
+        tensors
+    )
+    if batch_tensor.ndim > 1:
+        row_num_small_faces = row_num_small_faces.unsqueeze(1)
+        small_offsets = small_offsets.unsqueeze(1)
+        big_offsets = big_offsets.unsqueeze(1)
+    batch_tensor += torch.where(batch_tensor < row_num_small_faces, small_offsets, big_offsets)
+    return batch_tensor
+
+
+def allocate_for_bodies(data_list, key, num_rows):
+    first = data_list[0][key]
+    return torch.empty((num_rows,) + tuple(first.shape[1:]), dtype=first.dtype)
 
-        small_face_offset += num_small_faces
-        face_offset += num_big_faces
-        coedge_offset += num_coedges
-        
-    batch_data = {
-        "face_features": concatenate_tensor_arrays(Xf_small_faces, Xf_big_faces, unsqueeze=True),
-        "face_point_grids": concatenate_tensor_arrays(Gf_small_faces, Gf_big_faces, unsqueeze=True),
-        "edge_features": torch.cat(Xe),
-        "edge_point_grids": torch.cat(Ge),
-        "coedge_features": torch.cat(Xc),
-        "coedge_point_grids": torch.cat(Gc),
-        "coedge_lcs": torch.cat(lcs),
-        "face_kernel_tensor": torch.cat(Kf),
-        "edge_kernel_tensor": torch.cat(Ke),
-        "coedge_kernel_tensor": torch.cat(Kc),
-        "coedges_of_edges": torch.cat(Ce),
-        "coedges_of_small_faces": torch.cat(Cf),
-        "coedges_of_big_faces": Csf,
-        "labels": concatenate_tensor_arrays(labels_small_faces, labels_big_faces, unsqueeze=False),
-        "split_batch": split_batch,
-        "file_stems": file_stems
-    }
-    return batch_data
\ No newline at end of file
+
+def brepnet_collate_fn(data_list):
+    """
+    Collate the data from multiple bodies into a single
+    set of tensors.
+    Here I call the faces with a small number of coedges
+    "small faces" and the coedges with a large number of
+    coedges "big faces".
+
+    In the batch the small faces of all the bodies come first,
+    followed by the big faces of all the bodies.  When the faces
+    were not reordered there are no big faces and the faces of the
+    bodies are just concatenated.  All the offsets
+    are found up front from the number of faces, edges and coedges
+    in each body.  The face tensors are allocated once at their
+    final size and filled with slice copies, and the offsets are
+    added to each concatenated index tensor in a single operation.
+
+    Only the optional fields which are present in the data for
+    the bodies get added to the batch.  The batch is returned as a
+    BRepNetBatch, which can be pinned and moved to the GPU as a whole
+    """
+    assert len(data_list) > 0, "Can't collate an empty batch"
+
+    # The number of entities in each body and the offsets
+    # of the first entity of each body in the batch
+    num_big_faces = [ data["big_face_coedge_offsets"].shape[0] - 1 for data in data_list ]
+    num_small_faces = [ data["face_features"].shape[0] - n for data, n in zip(data_list, num_big_faces) ]
+    num_edges = [ data["edge_features"].shape[0] for data in data_list ]
+    num_coedges = [ data["coedge_features"].shape[0] for data in data_list ]
+
+    small_face_offsets, num_small_faces_in_batch = exclusive_cumsum(num_small_faces)
+    big_face_offsets, num_big_faces_in_batch = exclusive_cumsum(num_big_faces)
+    big_face_offsets = [ num_small_faces_in_batch + offset for offset in big_face_offsets ]
+    num_faces_in_batch = num_small_faces_in_batch + num_big_faces_in_batch
+    edge_offsets, num_edges_in_batch = exclusive_cumsum(num_edges)
+    coedge_offsets, num_coedges_in_batch = exclusive_cumsum(num_coedges)
+
+    # The face tensors need the small faces of each body at the
+    # start and the big faces at the end
+    face_keys = [ key for key in ["face_features", "face_point_grids", "labels"] if key in data_list[0] ]
+    batch_data = {}
+    for key in face_keys:
+        batch_data[key] = allocate_for_bodies(data_list, key, num_faces_in_batch)
+
+    for i, data in enumerate(data_list):
+        small_faces = slice(small_face_offsets[i], small_face_offsets[i] + num_small_faces[i])
+        big_faces = slice(big_face_offsets[i], big_face_offsets[i] + num_big_faces[i])
+        for key in face_keys:
+            batch_data[key][small_faces] = data[key][:num_small_faces[i]]
+            batch_data[key][big_faces] = data[key][num_small_faces[i]:]
+
+    # The edge and coedge data just needs to be concatenated
+    for key in ["edge_features", "edge_point_grids", "coedge_features", "coedge_point_grids", "coedge_lcs"]:
+        if key in data_list[0]:
+            batch_data[key] = torch.cat([ data[key] for data in data_list ])
+
+    # For edge and coedge indices things are easy.  We just need to
+    # add the offsets
+    batch_data["edge_kernel_tensor"] = concatenate_with_offsets(
+        [ data["edge_kernel_tensor"] for data in data_list ],
+        edge_offsets
+    )
+    batch_data["coedge_kernel_tensor"] = concatenate_with_offsets(
+        [ data["coedge_kernel_tensor"] for data in data_list ],
+        coedge_offsets
+    )
+    batch_data["coedges_of_edges"] = concatenate_with_offsets(
+        [ data["coedges_of_edges"] for data in data_list ],
+        coedge_offsets
+    )
+
+    # The coedges of small faces are padded with the number of coedges
+    # in the body.  In the batch the padding is the number of coedges
+    # in the batch
+    Cf_list = [ data["coedges_of_small_faces"] for data in data_list ]
+    Cf = concatenate_with_offsets(Cf_list, coedge_offsets)
+    padding = repeat_for_each_row([ o + n for o, n in zip(coedge_offsets, num_coedges) ], Cf_list)
+    Cf.masked_fill_(Cf == padding.unsqueeze(1), num_coedges_in_batch)
+    batch_data["coedges_of_small_faces"] = Cf
+
+    # The coedges of the big faces are in CSR form.  The coedge indices
+    # get the coedge offset of each body.  The offsets into Csf for each
+    # body are shifted by the number of big face coedges in the bodies
+    # before it, dropping the leading zero for all but the first body
+    batch_data["coedges_of_big_faces"] = concatenate_with_offsets(
+        [ data["coedges_of_big_faces"] for data in data_list ],
+        coedge_offsets
+    )
+    big_face_coedge_offsets, _ = exclusive_cumsum([ data["coedges_of_big_faces"].shape[0] for data in data_list ])
+    batch_data["big_face_coedge_offsets"] = concatenate_with_offsets(
+        [ data_list[0]["big_face_coedge_offsets"][:1] ] + [ data["big_face_coedge_offsets"][1:] for data in data_list ],
+        [ 0 ] + big_face_coedge_offsets
+    )
+
+    # The face indices need different offsets for the
+    # small and big faces
+    batch_data["face_kernel_tensor"] = concatenate_face_indices(
+        [ data["face_kernel_tensor"] for data in data_list ],
+        num_small_faces,
+        small_face_offsets,
+        big_face_offsets
+    )
+    batch_data["coedge_to_face"] = concatenate_face_indices(
+        [ data["coedge_to_face"] for data in data_list ],
+        num_small_faces,
+        small_face_offsets,
+        big_face_offsets
+    )
+    face_indices = concatenate_face_indices(
+        [ data["old_to_new_face_indices"] for data in data_list ],
+        num_small_faces,
+        small_face_offsets,
+        big_face_offsets
+    )
+    return BRepNetBatch(
+        batch_data,
+        face_indices,
+        [ n + m for n, m in zip(num_small_faces, num_big_faces) ],
+        num_edges,
+        num_coedges,
+        [ data["file_stem"] for data in data_list ]
+    )
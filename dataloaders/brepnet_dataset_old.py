@@ -7,6 +7,7 @@ import copy
 import pickle
 
 import utils.data_utils as data_utils
+from dataloaders.brepnet_dataset import csr_from_tensor_list, find_coedge_to_face
 
 class BRepNetDatasetOld(Dataset):
     """Dataset of BRepNet data"""
@@ -420,6 +421,15 @@ class BRepNetDatasetOld(Dataset):
             batch
         )
 
+        # The model takes the coedges of the big faces in CSR form
+        coedges_of_big_faces, big_face_coedge_offsets = csr_from_tensor_list(coedges_of_single_faces)
+        coedge_to_face = find_coedge_to_face(
+            coedges_of_faces_tensor, 
+            coedges_of_big_faces, 
+            big_face_coedge_offsets, 
+            len(topology["coedges"])
+        )
+
         return {
             "face_features": face_features,
             "edge_features": edge_features,
@@ -429,7 +439,9 @@ class BRepNetDatasetOld(Dataset):
             "coedge_kernel_tensor": coedge_kernel_tensor, 
             "coedges_of_edges": coedges_of_edges, 
             "coedges_of_small_faces": coedges_of_faces_tensor,
-            "coedges_of_big_faces": coedges_of_single_faces,
+            "coedges_of_big_faces": coedges_of_big_faces,
+            "big_face_coedge_offsets": big_face_coedge_offsets,
+            "coedge_to_face": coedge_to_face,
             "labels": perm_all_batch_face_labels,
             "split_batch": split_batch,
             "file_stems": batch_basenames
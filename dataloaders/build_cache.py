@@ -0,0 +1,156 @@
+"""
+Build the cache for the training, validation and test sets before
+training starts.
+
+Without this step the cache is filled lazily by BRepNetDataset.__getitem__()
+during the first epoch, which makes the first epoch several times
+slower than the ones which follow.
+
+    python -m dataloaders.build_cache \\
+        --dataset_file /path/to/dataset.json \\
+        --dataset_dir /path/to/processed \\
+        --num_workers 8
+
+Use the same --kernel, --input_features and --label_dir options which
+will be used for training, as these change the cached data.  Adding
+--cache_format packed also writes the packed cache for each split.
+
+Caches built with other kernels, input features or feature 
+standardization are kept unless --remove_stale_caches is given.
+
+You can then train with --require_cache to be sure no cache entries
+get built lazily by the DataLoader workers.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import time
+from tqdm import tqdm
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.packed_cache import convert_pickle_cache_to_packed
+from dataloaders.cache_manifest import find_stale_caches, remove_stale_caches
+import utils.data_utils as data_utils
+
+# The dataset used by each worker process
+worker_dataset = None
+
+def init_worker(opts, split):
+    global worker_dataset
+    worker_dataset = BRepNetDataset(opts, split)
+
+
+def build_cache_entry(idx):
+    """
+    Build the cache file for the body with index idx.  Any error is
+    returned rather than raised so one bad body doesn't stop the build
+    """
+    try:
+        cache_pathname = worker_dataset.get_cache_pathname(idx)
+        worker_dataset.load_and_cache_body(idx, cache_pathname)
+        return idx, None
+    except Exception as ex:
+        return idx, str(ex)
+
+
+def find_missing_entries(dataset):
+    missing = []
+    for idx in range(len(dataset)):
+        if not dataset.is_cached(idx):
+            missing.append(idx)
+    return missing
+
+
+def build_cache_for_split(opts, split, num_workers):
+    """
+    Build the missing cache entries for one split of the dataset.
+    Returns a dictionary of statistics about the build
+    """
+    dataset = BRepNetDataset(opts, split)
+    missing = find_missing_entries(dataset)
+    print(f"{split}: {len(dataset)} bodies, {len(missing)} to cache")
+
+    start_time = time.perf_counter()
+    failures = []
+    if num_workers > 1:
+        with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=init_worker,
+                initargs=(opts, split)
+            ) as executor:
+            results = list(tqdm(executor.map(build_cache_entry, missing, chunksize=16), total=len(missing)))
+    else:
+        init_worker(opts, split)
+        results = [ build_cache_entry(idx) for idx in tqdm(missing) ]
+
+    for idx, error in results:
+        if error is not None:
+            failures.append({ "file_stem": dataset.bodies[idx], "error": error })
+    elapsed = time.perf_counter() - start_time
+
+    num_built = len(missing) - len(failures)
+    bodies_per_second = num_built/elapsed if elapsed > 0.0 else 0.0
+    print(f"{split}: built {num_built} cache entries in {elapsed:.1f}s ({bodies_per_second:.1f} bodies/s)")
+    if len(failures) > 0:
+        print(f"{split}: {len(failures)} bodies failed")
+        for failure in failures:
+            print(f"    {failure['file_stem']}: {failure['error']}")
+
+    if opts.cache_format == "packed" and len(failures) == 0:
+        print(f"{split}: writing packed cache")
+        convert_pickle_cache_to_packed(dataset)
+
+    return {
+        "num_bodies": len(dataset),
+        "num_built": num_built,
+        "failures": failures,
+        "time": elapsed
+    }
+
+
+def clean_stale_caches(dataset, remove_stale):
+    """
+    Report or remove the caches built with other kernels, 
+    features or standardization
+    """
+    if remove_stale:
+        removed = remove_stale_caches(dataset.cache_dir, dataset.hash_data_for_config())
+        print(f"Removed {len(removed)} stale caches from {dataset.cache_dir}")
+        return
+    stale = find_stale_caches(dataset.cache_dir, dataset.hash_data_for_config())
+    if len(stale) > 0:
+        print(f"{len(stale)} caches for other configurations found in {dataset.cache_dir}")
+        print("Use --remove_stale_caches to remove them")
+
+
+def build_cache(opts, splits, num_workers, remove_stale=False):
+    dataset_info = data_utils.load_json_data(opts.dataset_file)
+    stats = {}
+    for split in splits:
+        if len(dataset_info.get(split, [])) == 0:
+            print(f"{split}: no bodies in the dataset file")
+            continue
+        stats[split] = build_cache_for_split(opts, split, num_workers)
+    if len(stats) > 0:
+        clean_stale_caches(BRepNetDataset(opts, next(iter(stats))), remove_stale)
+    return stats
+
+
+if __name__ == '__main__':
+    from models.brepnet import BRepNet
+
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["training_set", "validation_set", "test_set"],
+        help="The splits of the dataset to cache"
+    )
+    parser.add_argument(
+        "--remove_stale_caches",
+        action="store_true",
+        help="Remove the caches built with other kernels, input features or feature standardization"
+    )
+    opts = parser.parse_args()
+    build_cache(opts, opts.splits, opts.num_workers, opts.remove_stale_caches)
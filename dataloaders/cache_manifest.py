@@ -0,0 +1,170 @@
+"""
+The manifest for the BRepNetDataset cache.
+
+Everything which changes the cached tensors is recorded in a config
+dictionary.  This includes the kernel walks, the input feature lists,
+the feature standardization from the dataset file, whether labels are
+loaded, whether the faces are reordered and the cache format version.
+A hash of the config names the folder holding the cache, so a change
+to any of these values gives a new, empty cache rather than silently
+serving stale tensors.
+
+    cache/
+        <config_hash>/
+            manifest.json   - The config used to build the cache
+            <file_stem>.p   - One cache file for each body
+            packed/<split>  - The packed cache for each split
+
+The folders for other configurations are left alone, as the same
+dataset folder may be used by several experiments at once.  They can
+be removed with remove_stale_caches() or the --remove_stale_caches
+option of python -m dataloaders.build_cache.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+
+import utils.data_utils as data_utils
+
+# Version 3 stores the coedges of the big faces as a flat index
+# tensor with an offsets tensor rather than a list of tensors.
+# Version 4 adds the face of each coedge
+CACHE_FORMAT_VERSION = 4
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def hash_config(config):
+    """
+    Make a hash of the config dictionary
+    """
+    config_str = json.dumps(config, sort_keys=True)
+    return hashlib.sha224(config_str.encode("utf8")).hexdigest()
+
+
+def find_stale_caches(cache_root, config_hash):
+    """
+    Find the folders and files in the cache root which don't belong
+    to the cache with the given config hash.  This includes the per-body
+    files written directly into the cache root by older versions of the
+    code
+    """
+    stale = []
+    if not cache_root.exists():
+        return stale
+    for pathname in cache_root.iterdir():
+        if pathname.name == config_hash:
+            continue
+        if pathname.is_dir() or pathname.suffix in [".p", ".tmp"]:
+            stale.append(pathname)
+    return stale
+
+
+def remove_stale_caches(cache_root, config_hash):
+    """
+    Remove every cache in the cache root apart from the one
+    with the given config hash.  Returns the removed pathnames
+    """
+    stale = find_stale_caches(cache_root, config_hash)
+    for pathname in stale:
+        if pathname.is_dir():
+            shutil.rmtree(pathname, ignore_errors=True)
+        else:
+            pathname.unlink()
+    return stale
+
+
+class CacheManifest:
+    """
+    The folder of cached bodies for one configuration, along with
+    an index of the file stems of the bodies which are in the cache
+    """
+
+    def __init__(self, cache_root, config):
+        self.cache_root = Path(cache_root)
+        self.config = config
+        self.config_hash = hash_config(config)
+        self.config_dir = self.cache_root / self.config_hash
+        self.open()
+        self.cached_stems = self.find_cached_stems()
+
+
+    def open(self):
+        """
+        Create the cache folder and manifest if they don't exist.  If the
+        manifest exists but doesn't match the config then the whole
+        cache folder is invalid and is removed
+        """
+        manifest_pathname = self.config_dir / MANIFEST_FILENAME
+        if manifest_pathname.exists():
+            if self.read_manifest(manifest_pathname) == self.config:
+                return
+            print(f"Warning! - The cache in {self.config_dir} doesn't match its manifest.  Removing it")
+            self.invalidate()
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        self.write_manifest(manifest_pathname)
+
+
+    def read_manifest(self, manifest_pathname):
+        try:
+            with open(manifest_pathname, "r", encoding="utf8") as fp:
+                return json.load(fp)
+        except ValueError:
+            return None
+
+
+    def write_manifest(self, manifest_pathname):
+        """
+        Write the manifest to a temporary file and rename it, as
+        several processes may open the cache at the same time
+        """
+        with data_utils.atomic_write(manifest_pathname, "w", encoding="utf8") as fp:
+            json.dump(self.config, fp, indent=4, sort_keys=True)
+
+
+    def invalidate(self):
+        """
+        Remove every entry in the cache in one operation
+        """
+        shutil.rmtree(self.config_dir, ignore_errors=True)
+        self.cached_stems = set()
+
+
+    def find_cached_stems(self):
+        """
+        List the cache folder once to find the bodies which are cached
+        """
+        cached_stems = set()
+        with os.scandir(self.config_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".p"):
+                    cached_stems.add(entry.name[:-2])
+        return cached_stems
+
+
+    def entry_pathname(self, file_stem):
+        return self.config_dir / (file_stem + ".p")
+
+
+    def packed_cache_dir(self, train_val_or_test):
+        return self.config_dir / "packed" / train_val_or_test
+
+
+    def contains(self, file_stem):
+        """
+        Check if the body is in the cache.  Only bodies missing from the
+        index are checked on disk, as they may have been added by another
+        process since the index was built
+        """
+        if file_stem in self.cached_stems:
+            return True
+        if self.entry_pathname(file_stem).exists():
+            self.cached_stems.add(file_stem)
+            return True
+        return False
+
+
+    def add(self, file_stem):
+        self.cached_stems.add(file_stem)
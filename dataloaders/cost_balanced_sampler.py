@@ -0,0 +1,253 @@
+"""
+A batch sampler which packs the solids into batches with a similar
+amount of work, and spreads the batches evenly across the processes
+in distributed training.
+
+The time for a training step depends mostly on the number of coedges
+in the batch, as every layer gathers the hidden states of the faces,
+edges and coedges in the kernel of each coedge.  The cost of a solid
+is estimated as
+
+    cost = num_coedges*coedge_cost + num_faces*face_cost
+
+where coedge_cost is usually the number of entities in the kernel
+and face_cost covers the pooling onto the faces and the classification
+layer.  The solids are packed into batches with a total cost of at most
+max_cost_per_batch.  A solid which costs more than max_cost_per_batch on
+its own is put in a batch by itself, or left out if include_oversized
+is False.
+
+The batches are created again for each epoch from the seed and the
+epoch number.  Call set_epoch() at the start of each epoch, which
+PyTorch Lightning does for us.  Every process creates the same batches,
+so no communication is needed.
+
+PyTorch Lightning reads the number of batches once, when the dataloader
+is created, and stops the epoch after that many batches.  So the number
+of batches is fixed when the sampler is created, as the largest number
+given by packing the solids in a few random orders or in order of cost.
+Each epoch uses the first of a few random orders which packs into no
+more batches than this.  If none does, the solids are packed in order of
+cost, which always fits.  If the packing needs fewer batches, batches
+from the start of the epoch are repeated, so no solid is left out.
+
+In distributed training the batches are sorted by cost and split into
+groups of num_replicas batches with similar costs.  Each process takes
+one batch from each group, so all the processes run the same number of
+steps and the processes wait for each other as little as possible at
+the gradient synchronization.  The last group is padded with batches
+from the start of the epoch, as the DistributedSampler does.
+"""
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+# The number of random orders tried when fixing the number of
+# batches, and then when packing the solids for each epoch
+NUM_PACKING_ATTEMPTS = 10
+
+
+def find_kernel_size(kernel):
+    """
+    The number of faces, edges and coedges in the kernel
+    """
+    return len(kernel["faces"]) + len(kernel["edges"]) + len(kernel["coedges"])
+
+
+def print_solids_per_path(num_solids_per_path, limit_name):
+    """
+    Report how many solids were packed into batches, put in batches
+    by themselves or left out
+    """
+    print(f"{num_solids_per_path['packed']} B-Reps packed into batches")
+    if num_solids_per_path["singleton"] > 0:
+        print(f"Warning! - {num_solids_per_path['singleton']} B-Reps are over the {limit_name} limit and will be in batches by themselves")
+    if num_solids_per_path["skipped"] > 0:
+        print(f"Warning! - {num_solids_per_path['skipped']} B-Reps are over the {limit_name} limit and will not be included")
+
+
+def find_cost(num_coedges, num_faces, coedge_cost, face_cost):
+    """
+    The estimated cost of a training step on the solids
+    """
+    return num_coedges*coedge_cost + num_faces*face_cost
+
+
+class CostBalancedBatchSampler(Sampler):
+    """
+    Creates batches of solids with a limit on the total cost
+    for each epoch, split between the distributed processes
+    """
+
+    def __init__(
+            self,
+            body_sizes,
+            max_cost_per_batch,
+            coedge_cost,
+            face_cost=1,
+            seed=0,
+            num_replicas=None,
+            rank=None,
+            include_oversized=True
+        ):
+        """
+        Args:
+            body_sizes           The dict of arrays from
+                                 BRepNetDataset.find_body_sizes()
+
+            max_cost_per_batch   The budget for the total cost of the
+                                 solids in each batch
+
+            coedge_cost,         The cost of each coedge and face
+            face_cost
+
+            seed                 The batches for each epoch are created
+                                 from the seed and the epoch
+
+            num_replicas, rank   The number of processes in distributed
+                                 training and the rank of this process.
+                                 By default these come from the
+                                 default process group
+
+            include_oversized    Put the solids which cost more than
+                                 max_cost_per_batch in batches by
+                                 themselves.  If False they are not used
+        """
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        assert rank >= 0 and rank < num_replicas, f"Invalid rank {rank} for {num_replicas} replicas"
+        self.max_cost_per_batch = max_cost_per_batch
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+        num_coedges = torch.as_tensor(body_sizes["num_coedges"], dtype=torch.int64)
+        num_faces = torch.as_tensor(body_sizes["num_faces"], dtype=torch.int64)
+        self.costs = find_cost(num_coedges, num_faces, coedge_cost, face_cost)
+
+        # Solids which are more expensive than the budget on their
+        # own can't be packed with other solids
+        is_oversized = self.costs > max_cost_per_batch
+        self.indices = torch.nonzero(~is_oversized).squeeze(1)
+        self.oversized_indices = torch.nonzero(is_oversized).squeeze(1)
+        num_oversized = self.oversized_indices.size(0)
+        self.num_solids_per_path = { "packed": self.indices.size(0), "singleton": 0, "skipped": 0 }
+        if include_oversized:
+            self.num_solids_per_path["singleton"] = num_oversized
+        else:
+            self.num_solids_per_path["skipped"] = num_oversized
+            self.oversized_indices = self.oversized_indices[:0]
+        print_solids_per_path(self.num_solids_per_path, "max_cost_per_batch")
+
+        # The solids in order of cost always pack into the same number
+        # of batches, so the number of batches can't be less than this
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        self.num_batches = len(self.pack_solids(self.order_by_cost())[0])
+        for i in range(NUM_PACKING_ATTEMPTS):
+            self.num_batches = max(self.num_batches, len(self.pack_solids(self.random_order(generator))[0]))
+
+        self.set_epoch(0)
+
+
+    def __len__(self):
+        """
+        Get the number of batches for this process in the current epoch
+        """
+        return len(self.batches)
+
+
+    def __iter__(self):
+        return iter(self.batches)
+
+
+    def set_epoch(self, epoch):
+        """
+        Create the batches for the given epoch
+        """
+        self.epoch = epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        batches, batch_costs = self.create_batches(generator)
+        self.batches = self.split_batches_between_replicas(batches, batch_costs, generator)
+
+
+    def random_order(self, generator):
+        return self.indices[torch.randperm(self.indices.size(0), generator=generator)]
+
+
+    def order_by_cost(self):
+        return self.indices[torch.argsort(self.costs[self.indices], descending=True, stable=True)]
+
+
+    def create_batches(self, generator):
+        """
+        Pack the solids in a random order into exactly num_batches
+        batches.  Returns a list of batches and a tensor with the cost
+        of each batch
+        """
+        for i in range(NUM_PACKING_ATTEMPTS):
+            batches, batch_costs = self.pack_solids(self.random_order(generator))
+            if len(batches) <= self.num_batches:
+                break
+        if len(batches) > self.num_batches:
+            batches, batch_costs = self.pack_solids(self.order_by_cost())
+        assert len(batches) <= self.num_batches
+
+        # Repeat batches from the start of the epoch to
+        # give the same number of batches in every epoch
+        if len(batches) > 0:
+            padding = torch.arange(self.num_batches - len(batches)) % len(batches)
+            batches = batches + [ batches[i] for i in padding.tolist() ]
+            batch_costs = torch.cat([batch_costs, batch_costs[padding]])
+        return batches, batch_costs
+
+
+    def pack_solids(self, order):
+        """
+        Pack the solids in the given order into batches which cost
+        no more than max_cost_per_batch.  The oversized solids each
+        get a batch of their own.  Returns a list of batches and a
+        tensor with the cost of each batch
+        """
+        batches = []
+        batch_costs = []
+        current_batch = []
+        current_cost = 0
+        for index, cost in zip(order.tolist(), self.costs[order].tolist()):
+            if current_cost + cost > self.max_cost_per_batch and len(current_batch) > 0:
+                batches.append(current_batch)
+                batch_costs.append(current_cost)
+                current_batch = []
+                current_cost = 0
+            current_batch.append(index)
+            current_cost += cost
+        if len(current_batch) > 0:
+            batches.append(current_batch)
+            batch_costs.append(current_cost)
+        for index in self.oversized_indices.tolist():
+            batches.append([ index ])
+            batch_costs.append(self.costs[index].item())
+        return batches, torch.tensor(batch_costs, dtype=self.costs.dtype)
+
+
+    def split_batches_between_replicas(self, batches, batch_costs, generator):
+        """
+        Find the batches for this process.  The batches are grouped by
+        cost and the groups are used in a random order
+        """
+        if len(batches) == 0:
+            return []
+
+        # Pad with batches from the start of the epoch, so every
+        # process gets the same number of batches
+        num_groups = (len(batches) + self.num_replicas - 1) // self.num_replicas
+        padding = torch.arange(num_groups*self.num_replicas - len(batches)) % len(batches)
+        batches = batches + [ batches[i] for i in padding.tolist() ]
+        batch_costs = torch.cat([batch_costs, batch_costs[padding]])
+
+        by_cost = torch.argsort(batch_costs, descending=True, stable=True).tolist()
+        group_order = torch.randperm(num_groups, generator=generator).tolist()
+        return [ batches[by_cost[group*self.num_replicas + self.rank]] for group in group_order ]
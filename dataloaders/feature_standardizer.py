@@ -0,0 +1,109 @@
+"""
+Standardization of the input features for faces, edges and coedges.
+
+The dataset file contains the mean and standard deviation of each
+feature, computed over the training set by
+pipeline/build_dataset_file.py.   These are used to standardize
+the feature tensors of every body as they are loaded.
+"""
+
+import torch
+
+
+def build_mean_and_sd_tensors(stats):
+    """
+    Convert the list of per-feature stats from the dataset file
+    into tensors of size [ 1 x num_features ] which can be broadcast
+    over the entities in a body
+    """
+    eps = 1e-7
+    for s in stats:
+        assert s["standard_deviation"] > eps, "Feature has zero standard deviation"
+    means = torch.tensor([ s["mean"] for s in stats ], dtype=torch.float64)
+    sds = torch.tensor([ s["standard_deviation"] for s in stats ], dtype=torch.float64)
+    return means.unsqueeze(0), sds.unsqueeze(0)
+
+
+def check_standardization(feature_tensor, means, sds, feature_tensor_standardized):
+    """
+    Check the standardized features the slow and easy to understand
+    way, one element at a time.   This is only used in the debug
+    validation mode as it is very slow for large bodies
+    """
+    num_ents = feature_tensor.size(0)
+    num_features = feature_tensor.size(1)
+    test_tensor = torch.zeros((num_ents, num_features), dtype=feature_tensor.dtype)
+    for i in range(num_ents):
+        for j in range(num_features):
+            value = (feature_tensor[i,j] - means[0,j])/sds[0,j]
+            test_tensor[i,j] = value
+    eps = 1e-7
+    assert torch.allclose(feature_tensor_standardized, test_tensor, eps)
+
+
+def standardize_feature_tensor(feature_tensor, means, sds, validate=False):
+    """
+    Standardize the features in a tensor of size [ num_entities x num_features ]
+    using the mean and standard deviation tensors of size [ 1 x num_features ].
+    The result is converted to floats after standardization
+    """
+    assert feature_tensor.size(1) == means.size(1)
+    means = means.to(feature_tensor.dtype)
+    sds = sds.to(feature_tensor.dtype)
+
+    # The subtraction allocates the output tensor.  The division can then
+    # be done in place
+    feature_tensor_standardized = feature_tensor - means
+    feature_tensor_standardized.div_(sds)
+
+    if validate:
+        check_standardization(feature_tensor, means, sds, feature_tensor_standardized)
+
+    return feature_tensor_standardized.float()
+
+
+class FeatureStandardizer:
+    """
+    Applies the feature standardization from the dataset file to
+    the face, edge and coedge feature tensors of a body.
+
+    The mean and standard deviation tensors are built once when the
+    standardizer is created rather than every time a body is loaded.
+
+    If validate is True then every standardized tensor is cross
+    checked element by element.  This is useful for debugging, but
+    is much slower than the standardization itself.
+    """
+
+    entity_types = [ "face_features", "edge_features", "coedge_features" ]
+
+    def __init__(self, feature_standardization, validate=False):
+        self.validate = validate
+        self.means = {}
+        self.sds = {}
+        for entity_type in self.entity_types:
+            means, sds = build_mean_and_sd_tensors(feature_standardization[entity_type])
+            self.means[entity_type] = means
+            self.sds[entity_type] = sds
+
+
+    def standardize(self, feature_tensor, entity_type):
+        """
+        Standardize the feature tensor for one entity type
+        """
+        return standardize_feature_tensor(
+            feature_tensor,
+            self.means[entity_type],
+            self.sds[entity_type],
+            self.validate
+        )
+
+
+    def standardize_body(self, Xf, Xe, Xc):
+        """
+        Standardize the face, edge and coedge feature tensors of a body
+        """
+        Xf = self.standardize(Xf, "face_features")
+        Xe = self.standardize(Xe, "edge_features")
+        Xc = self.standardize(Xc, "coedge_features")
+        return Xf, Xe, Xc
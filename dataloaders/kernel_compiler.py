@@ -0,0 +1,130 @@
+"""
+Compile the topological walks in a kernel file into a single
+gather program.
+
+A kernel file lists the walks which find the faces, edges and coedges
+in the kernel relative to each starting coedge.  Many of the walks
+share prefixes.  For example winged_edge_plus_plus.json has the coedge
+walks "mpm" and "mpmp".  Replaying every walk from scratch repeats the
+same gathers many times for every body.
+
+The CompiledKernel builds a prefix trie of all the walks for all three
+entity types.  Each node in the trie is one gather of its parent's
+permutation with the next, previous, mate, edge or face permutation.
+The nodes are stored in an order where parents always come before
+their children, so evaluating the program is a single loop over the
+nodes.  Each intermediate permutation is computed once per body and
+shared between Kf, Ke and Kc.
+
+The walks are checked when the kernel is compiled, so a bad kernel
+file fails when the dataset is created rather than part way through
+an epoch.
+"""
+import numpy as np
+import torch
+
+# The instructions which move from a coedge to another coedge
+COEDGE_INSTRUCTIONS = "npm"
+
+# The final instruction of a walk for each entity type.  Coedge walks
+# only use the coedge instructions
+ENTITY_INSTRUCTIONS = {
+    "faces": "f",
+    "edges": "e",
+    "coedges": None
+}
+
+
+def check_walk(walk, entity_type):
+    """
+    Check a walk contains only valid instructions and arrives at
+    an entity of the right type
+    """
+    final_instruction = ENTITY_INSTRUCTIONS[entity_type]
+    coedge_walk = walk
+    if final_instruction is not None:
+        assert walk.endswith(final_instruction), \
+            f"The {entity_type} walk '{walk}' must end with '{final_instruction}'"
+        coedge_walk = walk[:-1]
+    for instruction in coedge_walk:
+        assert instruction in COEDGE_INSTRUCTIONS, \
+            f"Invalid instruction '{instruction}' in the {entity_type} walk '{walk}'"
+
+
+class CompiledKernel:
+    """
+    The walks from a kernel file compiled into a list of gathers
+    """
+
+    def __init__(self, kernel):
+        for entity_type in ENTITY_INSTRUCTIONS:
+            assert entity_type in kernel, f"The kernel has no walks for {entity_type}"
+        for entity_type in kernel:
+            assert entity_type in ENTITY_INSTRUCTIONS, f"Unknown entity type {entity_type} in the kernel"
+            for walk in kernel[entity_type]:
+                check_walk(walk, entity_type)
+
+        # Node 0 is the empty walk, which is the identity permutation.
+        # Every other node is (parent_node, instruction)
+        self.nodes = [ None ]
+        self.node_of_prefix = { "": 0 }
+        self.columns = {}
+        for entity_type in ENTITY_INSTRUCTIONS:
+            self.columns[entity_type] = [ self.add_walk(walk) for walk in kernel[entity_type] ]
+
+
+    def add_walk(self, walk):
+        """
+        Add the nodes for all the prefixes of the walk which are
+        not already in the trie.  Returns the node for the full walk
+        """
+        node = 0
+        for i, instruction in enumerate(walk):
+            prefix = walk[:i+1]
+            if not prefix in self.node_of_prefix:
+                self.node_of_prefix[prefix] = len(self.nodes)
+                self.nodes.append((node, instruction))
+            node = self.node_of_prefix[prefix]
+        return node
+
+
+    def num_gathers(self):
+        return len(self.nodes) - 1
+
+
+    def evaluate(self, n, p, m, e, f):
+        """
+        Evaluate every node in the trie.  The arrays n, p, m, e and f
+        give the next, previous, mate, edge and face of each coedge
+        """
+        num_coedges = n.size
+        assert num_coedges == p.size
+        assert num_coedges == m.size
+        assert num_coedges == e.size
+        assert num_coedges == f.size
+        permutations = { "n": n, "p": p, "m": m, "e": e, "f": f }
+        values = [ np.arange(num_coedges, dtype=np.int64) ]
+        for parent, instruction in self.nodes[1:]:
+            values.append(permutations[instruction][values[parent]])
+        return values
+
+
+    def build_kernel_tensors(self, n, p, m, e, f):
+        """
+        Build the kernel tensors Kf, Ke and Kc with
+
+            Kf.size() = [ num_coedges x num_faces_in_kernel ]
+            Ke.size() = [ num_coedges x num_edges_in_kernel ]
+            Kc.size() = [ num_coedges x num_coedges_in_kernel ]
+        """
+        values = self.evaluate(n, p, m, e, f)
+        num_coedges = n.size
+        kernel_tensors = []
+        for entity_type in ["faces", "edges", "coedges"]:
+            columns = [ values[node] for node in self.columns[entity_type] ]
+            if len(columns) == 0:
+                kernel_tensor = np.zeros((num_coedges, 0), dtype=np.int64)
+            else:
+                kernel_tensor = np.stack(columns, axis=1).astype(np.int64, copy=False)
+            kernel_tensors.append(torch.from_numpy(kernel_tensor))
+        return tuple(kernel_tensors)
@@ -0,0 +1,132 @@
+"""
+A single binary file holding the segmentation labels for every
+body in a dataset.
+
+Reading one small .seg text file per body is slow, especially on
+network filesystems where the time to open each file dominates.
+The label store packs the labels for all the bodies in the dataset
+file into one npz file written next to the dataset file
+
+    dataset.json  ->  dataset_labels.npz
+
+The npz file contains
+
+    labels      - The labels for all bodies concatenated into one array
+    offsets     - An array of size [ num_bodies + 1 ].  The labels for
+                  body i are labels[offsets[i]:offsets[i+1]]
+    file_stems  - The file stem of each body
+    label_dir   - The folder the .seg files were read from
+
+The store is built by pipeline/build_dataset_file.py when a label folder
+is given.  For an existing dataset file use
+
+    python -m dataloaders.label_store \\
+        --dataset_file /path/to/dataset.json \\
+        --label_dir /path/to/seg/files
+"""
+import argparse
+import numpy as np
+from pathlib import Path
+import torch
+from tqdm import tqdm
+
+import utils.data_utils as data_utils
+
+DATASET_SPLITS = ["training_set", "validation_set", "test_set"]
+
+
+def label_store_pathname(dataset_file):
+    dataset_file = Path(dataset_file)
+    return dataset_file.with_name(dataset_file.stem + "_labels.npz")
+
+
+def build_label_store(label_dir, file_stems, output_pathname):
+    """
+    Read the .seg file for each body and write the labels
+    into a single label store file.  Bodies with no .seg file
+    are left out of the store.  Returns the list of these bodies
+    """
+    label_dir = Path(label_dir)
+    labels = []
+    offsets = [ 0 ]
+    stored_file_stems = []
+    missing_file_stems = []
+    for file_stem in tqdm(file_stems):
+        label_pathname = label_dir / (file_stem + ".seg")
+        if not label_pathname.exists():
+            missing_file_stems.append(file_stem)
+            continue
+        body_labels = data_utils.load_labels(label_pathname)
+        labels.append(body_labels.astype(np.int64))
+        offsets.append(offsets[-1] + body_labels.size)
+        stored_file_stems.append(file_stem)
+    if len(missing_file_stems) > 0:
+        print(f"Warning! {len(missing_file_stems)} bodies have no seg file in {label_dir} and are not in the label store")
+    if len(labels) > 0:
+        labels = np.concatenate(labels)
+    else:
+        labels = np.zeros(0, dtype=np.int64)
+
+    # Write to a temporary file and rename, so a partially
+    # written store is never read
+    with data_utils.atomic_write(output_pathname) as fp:
+        np.savez(
+            fp,
+            labels=labels,
+            offsets=np.array(offsets, dtype=np.int64),
+            file_stems=np.array(stored_file_stems, dtype=str),
+            label_dir=np.array(str(label_dir.resolve()))
+        )
+    return missing_file_stems
+
+
+def build_label_store_for_dataset(dataset_file, label_dir):
+    """
+    Build the label store for all the bodies in the dataset file
+    """
+    dataset_info = data_utils.load_json_data(dataset_file)
+    file_stems = []
+    for split in DATASET_SPLITS:
+        file_stems.extend(dataset_info.get(split, []))
+    output_pathname = label_store_pathname(dataset_file)
+    build_label_store(label_dir, file_stems, output_pathname)
+    return output_pathname
+
+
+class LabelStore:
+    """
+    Reads the labels for each body from a label store file
+    """
+
+    def __init__(self, pathname):
+        with np.load(pathname) as data:
+            self.labels = data["labels"]
+            self.offsets = data["offsets"]
+            self.label_dir = Path(str(data["label_dir"]))
+            file_stems = data["file_stems"]
+        self.stem_to_index = { str(stem): i for i, stem in enumerate(file_stems) }
+
+
+    def __contains__(self, file_stem):
+        return file_stem in self.stem_to_index
+
+
+    def get(self, file_stem):
+        """
+        Get the labels for one body as a tensor
+        """
+        idx = self.stem_to_index[file_stem]
+        body_labels = self.labels[self.offsets[idx]:self.offsets[idx+1]]
+
+        # Copy the slice so the cached tensor doesn't keep a
+        # reference to the labels for the whole dataset
+        return torch.from_numpy(body_labels.copy())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_file", type=str, required=True, help="Path to the dataset file")
+    parser.add_argument("--label_dir", type=str, required=True, help="Path to the folder containing the seg files")
+    args = parser.parse_args()
+    output_pathname = build_label_store_for_dataset(args.dataset_file, args.label_dir)
+    print(f"Label store written to {output_pathname}")
@@ -2,9 +2,18 @@ import torch
 from torch.utils.data import Sampler
 from random import randint
 
+from dataloaders.cost_balanced_sampler import print_solids_per_path
+
 class MaxNumFacesSampler(Sampler):
-    def __init__(self, data_source, max_num_faces_per_batch):
-        super(MaxNumFacesSampler, self).__init__(data_source)
+    def __init__(self, data_source, max_num_faces_per_batch, include_oversized=False):
+        """
+        B-Reps with more than max_num_faces_per_batch faces are put
+        in batches by themselves if include_oversized is True.
+        Otherwise they are left out
+        """
+        # Sampler.__init__() does nothing, and newer versions of
+        # torch no longer accept the data_source argument
+        self.include_oversized = include_oversized
         self.num_faces_per_brep = self.find_num_faces_per_brep(data_source)
         self.batches = self.create_batches(self.num_faces_per_brep, max_num_faces_per_batch)
 
@@ -23,8 +32,11 @@ class MaxNumFacesSampler(Sampler):
 
     def find_num_faces_per_brep(self, data_source):
         """
-        Find the number of faces in each brep
+        Find the number of faces in each brep.  The BRepNetDataset
+        reads these from the size index without loading the bodies
         """
+        if hasattr(data_source, "find_body_sizes"):
+            return data_source.find_body_sizes()["num_faces"].tolist()
         num_faces_per_brep = []
         num_breps = len(data_source)
         for i in range(num_breps):
@@ -41,6 +53,7 @@ class MaxNumFacesSampler(Sampler):
         used to generate batches in the paper
         """
         batches = []
+        self.num_solids_per_path = { "packed": 0, "singleton": 0, "skipped": 0 }
 
         num_faces_in_current_batch = 0
         current_batch = []
@@ -68,17 +81,23 @@ class MaxNumFacesSampler(Sampler):
             num_faces = random_element["num_faces"]
             random_element_index = random_element["index"]
 
+            # Here we have the case where one single B-Rep has
+            # more than the maximum number of faces
+            if num_faces > max_num_faces_per_batch:
+                if self.include_oversized:
+                    batches.append([ random_element_index ])
+                    self.num_solids_per_path["singleton"] += 1
+                else:
+                    self.num_solids_per_path["skipped"] += 1
+                continue
+
+            self.num_solids_per_path["packed"] += 1
+
             # Can we add this solid to the batch
             if num_faces_in_current_batch + num_faces > max_num_faces_per_batch:
-                if len(current_batch)>0:
-                    batches.append(current_batch)
-                    current_batch = [ random_element_index ]
-                    num_faces_in_current_batch = num_faces
-                else:
-                    assert num_faces_in_current_batch == 0
-                    # Here we have the case where one single B-Rep has
-                    # more than the maximum number of faces
-                    print(f"Warning!!! - B-Rep {random_element_index} has {num_faces} and will not be included")
+                batches.append(current_batch)
+                current_batch = [ random_element_index ]
+                num_faces_in_current_batch = num_faces
             else:
                 current_batch.append(random_element_index)
                 num_faces_in_current_batch += num_faces
@@ -86,6 +105,7 @@ class MaxNumFacesSampler(Sampler):
         if len(current_batch)>0:
             batches.append(current_batch)
 
-        print(f"Mean num breps per batch {len(num_faces_per_brep)/len(batches)}")
+        print_solids_per_path(self.num_solids_per_path, "max_num_faces_per_batch")
+        print(f"Mean num breps per batch {len(num_faces_per_brep)/max(len(batches), 1)}")
 
         return batches
@@ -0,0 +1,303 @@
+"""
+A packed cache format for BRepNetDataset.
+
+The original cache writes one torch.save() pickle per body.  For large
+datasets this means millions of small files and a full deserialization
+of every body in every epoch.
+
+The packed cache writes all the bodies in one split of the dataset into
+a single folder containing
+
+    index.json  - The format version, the file stems of the bodies in
+                  the cache and the dtype and trailing shape of each field
+
+    index.npz   - For each field, an array of size [ num_bodies + 1 ]
+                  with the offset of the first row of each body in the
+                  field file.   Fields which hold a list of tensors for
+                  each body (like coedges_of_big_faces) instead keep the
+                  offset of every tensor in the list, along with a second
+                  array giving the index of the first tensor of each body
+
+    <field>.bin - One contiguous binary file for each tensor field.  The
+                  rows for all bodies are written one after the other
+
+When reading, the field files are memory mapped and the tensors returned
+for each body are views into the mapped memory.  No data is copied until
+the tensors are concatenated into a batch by brepnet_collate_fn().
+
+To convert an existing per-body cache into the packed format use
+
+    python -m dataloaders.packed_cache \\
+        --dataset_file /path/to/dataset.json \\
+        --dataset_dir /path/to/processed
+
+along with the same --kernel and --input_features options which will
+be used for training.
+"""
+import argparse
+import json
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+import torch
+from tqdm import tqdm
+
+PACKED_CACHE_VERSION = 1
+
+TORCH_DTYPES = {
+    str(dtype): dtype for dtype in [
+        torch.float16,
+        torch.bfloat16,
+        torch.float32,
+        torch.float64,
+        torch.int32,
+        torch.int64
+    ]
+}
+
+
+def tensor_to_bytes(t):
+    """
+    Get the raw bytes of a tensor in row major order
+    """
+    t = t.contiguous().view(-1)
+    if t.numel() == 0:
+        return b""
+    return t.view(torch.uint8).numpy().tobytes()
+
+
+class PackedCacheWriter:
+    """
+    Writes the data for the bodies in one split of the dataset into
+    a packed cache folder.
+
+    The data is written into a temporary folder which is renamed
+    when close() is called.  A partially written cache will never
+    be found by PackedCache.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.temp_dir = self.cache_dir.with_name(self.cache_dir.name + ".tmp")
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.temp_dir.mkdir(parents=True)
+        self.fields = None
+        self.files = {}
+        self.offsets = {}
+        self.list_offsets = {}
+        self.file_stems = []
+
+
+    def find_fields(self, body_data):
+        """
+        Find the type, dtype and trailing shape of each field
+        from the first body added to the cache
+        """
+        fields = {}
+        for name, value in body_data.items():
+            if isinstance(value, str):
+                # Strings like the file stem are written to the index
+                continue
+            if isinstance(value, torch.Tensor):
+                fields[name] = {
+                    "kind": "tensor",
+                    "dtype": str(value.dtype),
+                    "trailing_shape": list(value.shape[1:])
+                }
+            else:
+                assert isinstance(value, list), "Cache fields must be tensors, lists of tensors or strings"
+                dtype = torch.int64
+                if len(value) > 0:
+                    dtype = value[0].dtype
+                fields[name] = {
+                    "kind": "tensor_list",
+                    "dtype": str(dtype),
+                    "trailing_shape": []
+                }
+        return fields
+
+
+    def add_body(self, body_data):
+        """
+        Append the data for one body to the cache
+        """
+        if self.fields is None:
+            self.fields = self.find_fields(body_data)
+            for name in self.fields:
+                self.files[name] = open(self.temp_dir / (name + ".bin"), "wb")
+                self.offsets[name] = [ 0 ]
+                if self.fields[name]["kind"] == "tensor_list":
+                    self.list_offsets[name] = [ 0 ]
+
+        self.file_stems.append(body_data["file_stem"])
+        for name, field in self.fields.items():
+            value = body_data[name]
+            if field["kind"] == "tensor":
+                assert list(value.shape[1:]) == field["trailing_shape"]
+                tensors = [ value ]
+            else:
+                # For lists of tensors we keep the offset of every tensor
+                # in the field file and the offset of each body in the list
+                tensors = value
+                self.list_offsets[name].append(self.list_offsets[name][-1] + len(tensors))
+            for t in tensors:
+                assert str(t.dtype) == field["dtype"], f"Field {name} changed dtype"
+                self.files[name].write(tensor_to_bytes(t))
+                self.offsets[name].append(self.offsets[name][-1] + t.size(0))
+
+
+    def close(self):
+        """
+        Write the index and move the completed cache into place
+        """
+        for f in self.files.values():
+            f.close()
+
+        index_arrays = {}
+        for name, offsets in self.offsets.items():
+            index_arrays[name + ".offsets"] = np.array(offsets, dtype=np.int64)
+        for name, list_offsets in self.list_offsets.items():
+            index_arrays[name + ".list_offsets"] = np.array(list_offsets, dtype=np.int64)
+        np.savez(self.temp_dir / "index.npz", **index_arrays)
+
+        index = {
+            "version": PACKED_CACHE_VERSION,
+            "file_stems": self.file_stems,
+            "fields": self.fields if self.fields is not None else {}
+        }
+        with open(self.temp_dir / "index.json", "w", encoding="utf8") as fp:
+            json.dump(index, fp)
+
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.replace(self.temp_dir, self.cache_dir)
+
+
+class PackedCache:
+    """
+    Read only access to a packed cache folder written by PackedCacheWriter.
+
+    The field files are memory mapped the first time they are used.
+    This happens separately in each DataLoader worker process.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / "index.json", "r", encoding="utf8") as fp:
+            index = json.load(fp)
+        assert index["version"] == PACKED_CACHE_VERSION, "Packed cache has an old format version"
+        self.file_stems = index["file_stems"]
+        self.fields = index["fields"]
+        self.stem_to_index = { stem: i for i, stem in enumerate(self.file_stems) }
+        with np.load(self.cache_dir / "index.npz") as data:
+            self.offsets = {}
+            self.list_offsets = {}
+            for name, field in self.fields.items():
+                self.offsets[name] = data[name + ".offsets"]
+                if field["kind"] == "tensor_list":
+                    self.list_offsets[name] = data[name + ".list_offsets"]
+        self.maps = None
+
+
+    @staticmethod
+    def exists(cache_dir):
+        return (Path(cache_dir) / "index.json").exists()
+
+
+    def __len__(self):
+        return len(self.file_stems)
+
+
+    def __getstate__(self):
+        # Memory maps are not pickled when the dataset is sent to
+        # worker processes.  Each worker maps the files itself
+        state = self.__dict__.copy()
+        state["maps"] = None
+        return state
+
+
+    def map_files(self):
+        self.maps = {}
+        for name in self.fields:
+            pathname = self.cache_dir / (name + ".bin")
+            if pathname.stat().st_size == 0:
+                self.maps[name] = np.zeros(0, dtype=np.uint8)
+            else:
+                # Copy on write mode gives us writable arrays without
+                # modifying the cache
+                self.maps[name] = np.memmap(pathname, dtype=np.uint8, mode="c")
+
+
+    def view_rows(self, name, row_start, row_end):
+        """
+        Create a tensor which is a view into the memory mapped field file
+        """
+        field = self.fields[name]
+        dtype = TORCH_DTYPES[field["dtype"]]
+        shape = [ int(row_end - row_start) ] + field["trailing_shape"]
+        if row_end == row_start:
+            return torch.zeros(shape, dtype=dtype)
+        row_size = int(np.prod(field["trailing_shape"], dtype=np.int64))*dtype.itemsize
+        raw = self.maps[name][row_start*row_size : row_end*row_size]
+        return torch.from_numpy(raw).view(dtype).view(shape)
+
+
+    def __getitem__(self, idx):
+        """
+        Get the data for the body with the given index in the cache
+        """
+        if self.maps is None:
+            self.map_files()
+        body_data = {}
+        for name, field in self.fields.items():
+            offsets = self.offsets[name]
+            if field["kind"] == "tensor":
+                body_data[name] = self.view_rows(name, offsets[idx], offsets[idx+1])
+            else:
+                list_offsets = self.list_offsets[name]
+                tensors = []
+                for i in range(list_offsets[idx], list_offsets[idx+1]):
+                    tensors.append(self.view_rows(name, offsets[i], offsets[i+1]))
+                body_data[name] = tensors
+        body_data["file_stem"] = self.file_stems[idx]
+        return body_data
+
+
+    def find_body(self, file_stem):
+        return self[self.stem_to_index[file_stem]]
+
+
+def convert_pickle_cache_to_packed(dataset):
+    """
+    Convert the per-body cache files for a BRepNetDataset into
+    the packed cache for the dataset's split.  Bodies which are
+    missing from the per-body cache are loaded from the npz files
+    """
+    writer = PackedCacheWriter(dataset.packed_cache_dir)
+    for idx in tqdm(range(len(dataset))):
+        if dataset.is_cached(idx):
+            body_data = dataset.load_body_from_cache(dataset.get_cache_pathname(idx))
+        else:
+            body_data = dataset.load_body(idx)
+        writer.add_body(body_data)
+    writer.close()
+
+
+if __name__ == '__main__':
+    from models.brepnet import BRepNet
+    from dataloaders.brepnet_dataset import BRepNetDataset
+
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument(
+        "--splits",
+        type=str,
+        nargs="+",
+        default=["training_set", "validation_set", "test_set"],
+        help="The splits of the dataset to convert"
+    )
+    opts = parser.parse_args()
+    for split in opts.splits:
+        print(f"Converting {split}")
+        dataset = BRepNetDataset(opts, split)
+        convert_pickle_cache_to_packed(dataset)
@@ -0,0 +1,144 @@
+"""
+Background read-ahead for the BRepNetDataset.
+
+When the DataLoader runs with num_workers=0 each body is read from the
+cache in the main process, so the model sits idle while the files are
+read and deserialized.  The BodyPrefetcher wraps the dataset and reads
+the bodies which are about to be used with a pool of threads.
+
+The prefetcher needs to know which bodies will be used next.  This
+comes from the PrefetchingSampler, which wraps the batch sampler given
+to the DataLoader.  As the DataLoader asks for the next batch, the
+PrefetchingSampler reads ahead in the wrapped batch sampler and 
+schedules the upcoming bodies, keeping at most queue_depth bodies 
+plus one batch in flight
+
+    prefetcher = BodyPrefetcher(dataset, queue_depth=16, num_threads=2)
+    batch_sampler = PrefetchingSampler(MaxNumFacesSampler(dataset, 5000), prefetcher)
+    loader = DataLoader(prefetcher, batch_sampler=batch_sampler, collate_fn=brepnet_collate_fn)
+
+The PrefetchingSampler must be passed as the batch_sampler.  Given as
+the sampler, with a batch_size, the DataLoader takes a whole batch of
+indices from it before reading any of the bodies, so the queue depth
+is not kept to.  Wrap a sampler in a torch BatchSampler first
+
+A body which was not scheduled is read synchronously, so the prefetcher
+still returns the right data if the sampler is replaced, for example
+with a DistributedSampler.
+
+With num_workers > 0 the bodies are read in the worker processes, which
+already overlaps the reading with the model, and the prefetcher is not
+needed.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, Sampler
+
+
+class BodyPrefetcher(Dataset):
+    """
+    Wraps a dataset and reads the scheduled bodies with a thread pool
+    """
+
+    def __init__(self, dataset, queue_depth, num_threads):
+        assert queue_depth > 0, "The prefetch queue depth must be at least 1"
+        assert num_threads > 0, "The prefetcher needs at least 1 thread"
+        self.dataset = dataset
+        self.queue_depth = queue_depth
+        self.executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="brepnet_prefetch")
+
+        # Futures for the bodies which have been scheduled but not
+        # used yet.  An index can be scheduled more than once if the
+        # sampler repeats it
+        self.pending = {}
+        self.num_pending = 0
+
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+    def __getitem__(self, idx):
+        futures = self.pending.get(idx)
+        if futures is None:
+            return self.dataset[idx]
+        future = futures.popleft()
+        if len(futures) == 0:
+            del self.pending[idx]
+        self.num_pending -= 1
+        return future.result()
+
+
+    def schedule(self, idx):
+        """
+        Start reading the body in the background
+        """
+        future = self.executor.submit(self.dataset.__getitem__, idx)
+        self.pending.setdefault(idx, deque()).append(future)
+        self.num_pending += 1
+
+
+    def is_full(self):
+        return self.num_pending >= self.queue_depth
+
+
+    def clear(self):
+        """
+        Drop the bodies which were scheduled but never used.  This
+        happens when an epoch is stopped early
+        """
+        for futures in self.pending.values():
+            for future in futures:
+                future.cancel()
+        self.pending = {}
+        self.num_pending = 0
+
+
+    def close(self):
+        self.clear()
+        self.executor.shutdown(wait=True)
+
+
+class PrefetchingSampler(Sampler):
+    """
+    Wraps a batch sampler and schedules the bodies it will return 
+    next with the prefetcher.  Pass it to the DataLoader as the 
+    batch_sampler
+    """
+
+    def __init__(self, sampler, prefetcher):
+        self.sampler = sampler
+        self.prefetcher = prefetcher
+
+
+    def __len__(self):
+        return len(self.sampler)
+
+
+    def set_epoch(self, epoch):
+        """
+        Pass the epoch on to samplers which create new batches
+        for each epoch
+        """
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+
+    def __iter__(self):
+        self.prefetcher.clear()
+        upcoming = deque()
+        for batch in self.sampler:
+            # We only read ahead while the queue has room, so at most
+            # one batch more than the queue depth is scheduled
+            upcoming.append(batch)
+            for idx in batch:
+                self.prefetcher.schedule(idx)
+
+            # The DataLoader reads all the bodies in the batch we yield
+            # before it asks for the next batch, so the queue drains
+            # while we are suspended here
+            while self.prefetcher.is_full() and len(upcoming) > 0:
+                yield upcoming.popleft()
+
+        while len(upcoming) > 0:
+            yield upcoming.popleft()
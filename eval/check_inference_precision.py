@@ -0,0 +1,135 @@
+"""
+Check how running the model in reduced precision affects the
+segmentation, and how much faster it is.
+
+The model is run on the bodies of a held out split with the
+BRepNetPredictor in each of the precisions in INFERENCE_PRECISIONS.
+The UV-Net encoders and the MLPs are autocast to the precision, while
+the max pooling and classification layer stay in float32.  For each
+precision we report
+
+    - The number of faces processed per second
+    - The largest difference in the logits compared to float32
+    - The fraction of faces where the predicted segment matches float32
+    - The accuracy and mean IoU against the labels, when the labels
+      are available
+
+    python -m eval.check_inference_precision \\
+        --dataset_file /path/to/dataset.json \\
+        --dataset_dir /path/to/processed \\
+        --model /path/to/model.ckpt
+
+The script exits with an error if the predictions for any precision
+agree with float32 on less than --min_agreement of the faces.
+"""
+import argparse
+import sys
+import time
+import torch
+
+from models.brepnet import BRepNet
+from models.brepnet_predictor import BRepNetPredictor, INFERENCE_PRECISIONS
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
+
+
+def find_iou(predicted, labels, num_classes):
+    """
+    Find the mean IoU over the classes, as in BRepNet.collate_epoch_outputs()
+    """
+    mean_iou = 0.0
+    for i in range(num_classes):
+        selected = predicted == i
+        labelled = labels == i
+        union = (selected | labelled).sum().item()
+        if union > 0:
+            mean_iou += (selected & labelled).sum().item() / union
+        else:
+            mean_iou += 1.0
+    return mean_iou / num_classes
+
+
+def find_logits(predictor, batches):
+    """
+    Find the logits for all the batches and the time taken.  The
+    first batch is run once before the timing starts
+    """
+    if len(batches) > 0:
+        predictor.predict(batches[0])
+    logits = []
+    start = time.perf_counter()
+    for batch in batches:
+        logits.append(predictor.predict(batch)["logits"])
+    elapsed = time.perf_counter() - start
+    return torch.cat(logits), elapsed
+
+
+def check_inference_precision(model, dataset, bodies_per_batch):
+    """
+    Run the model in each precision and compare with float32.
+    Returns a dictionary of results for each precision
+    """
+    batches = []
+    for start in range(0, len(dataset), bodies_per_batch):
+        end = min(start + bodies_per_batch, len(dataset))
+        batches.append(brepnet_collate_fn([ dataset[i] for i in range(start, end) ]))
+    labels = torch.cat([ batch["labels"] for batch in batches ])
+    num_faces = max(labels.size(0), 1)
+    has_labels = dataset.label_dir is not None
+
+    results = {}
+    reference_predicted = None
+    reference_logits = None
+    for precision in INFERENCE_PRECISIONS:
+        logits, elapsed = find_logits(BRepNetPredictor(model, precision), batches)
+        predicted = torch.argmax(torch.softmax(logits, dim=1), dim=1)
+        if reference_logits is None:
+            reference_logits = logits
+            reference_predicted = predicted
+        result = {
+            "faces_per_second": labels.size(0) / max(elapsed, 1e-9),
+            "max_logit_difference": (logits - reference_logits).abs().max().item() if logits.numel() > 0 else 0.0,
+            "agreement": (predicted == reference_predicted).sum().item() / num_faces,
+            "accuracy": None,
+            "mean_iou": None
+        }
+        if has_labels:
+            result["accuracy"] = (predicted == labels).sum().item() / num_faces
+            result["mean_iou"] = find_iou(predicted, labels, logits.size(1))
+        results[precision] = result
+    return results
+
+
+def print_results(results):
+    float32_speed = results["float32"]["faces_per_second"]
+    for precision, result in results.items():
+        speedup = result["faces_per_second"] / max(float32_speed, 1e-9)
+        print(f"{precision}")
+        print(f"    Faces per second        {result['faces_per_second']:.0f}  ({speedup:.2f}x)")
+        print(f"    Max logit difference    {result['max_logit_difference']:.6f}")
+        print(f"    Agreement with float32  {result['agreement']:.4f}")
+        if result["accuracy"] is not None:
+            print(f"    Accuracy                {result['accuracy']:.4f}")
+            print(f"    Mean IoU                {result['mean_iou']:.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument("--model", type=str, help="Model to use for the check")
+    parser.add_argument("--split", type=str, default="test_set", choices=["validation_set", "test_set"], help="The held out split to use")
+    parser.add_argument("--min_agreement", type=float, default=0.99, help="Fail if the predictions agree with float32 on less than this fraction of faces")
+    opts = parser.parse_args()
+
+    if opts.model is not None:
+        model = BRepNet.load_from_checkpoint(opts.model, opts=opts)
+    else:
+        print("Warning! No pretrained model given.  Using random network!")
+        model = BRepNet(opts)
+
+    dataset = BRepNetDataset(opts, opts.split)
+    results = check_inference_precision(model, dataset, opts.batch_size)
+    print_results(results)
+    for precision, result in results.items():
+        if result["agreement"] < opts.min_agreement:
+            print(f"Error! The predictions in {precision} only agree with float32 on {result['agreement']:.4f} of the faces")
+            sys.exit(1)
@@ -0,0 +1,144 @@
+"""
+Check how storing the point grids and features in half precision
+affects the segmentation, and how much space it saves.
+
+The step files in the folder are converted to npz files as in
+eval/evaluate_folder.py.  Then the model is evaluated with the
+data stored as float32, float16 and bfloat16.  For each dtype we
+report
+
+    - The mean number of bytes per body in the cache
+    - The largest difference in the logits compared to float32
+    - The fraction of faces where the predicted segment matches float32
+    - The accuracy against the labels, when the seg files are available
+
+    python -m eval.check_storage_precision \\
+        --dataset_dir ./example_files/step_examples \\
+        --dataset_file ./example_files/feature_standardization/s2.0.0_step_all_features.json \\
+        --model /path/to/model.ckpt
+
+The script exits with an error if the predictions for any dtype agree
+with float32 on less than --min_agreement of the faces.
+"""
+import argparse
+import copy
+import sys
+import torch
+
+from models.brepnet import BRepNet
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
+from dataloaders.body_memory_cache import num_bytes_in_body
+
+STORAGE_DTYPES_TO_CHECK = ["float32", "float16", "bfloat16"]
+
+
+def mean_bytes_per_body(dataset):
+    total_bytes = 0
+    for i in range(len(dataset)):
+        total_bytes += num_bytes_in_body(dataset[i])
+    return total_bytes / max(len(dataset), 1)
+
+
+def find_logits(model, dataset):
+    """
+    Find the logits and labels for each body in the dataset
+    """
+    logits = []
+    labels = []
+    with torch.no_grad():
+        for i in range(len(dataset)):
+            batch = brepnet_collate_fn([ dataset[i] ])
+            face_embeddings = model.create_face_embeddings(
+                batch["face_features"],
+                batch.get("face_point_grids"),
+                batch["edge_features"],
+                batch.get("edge_point_grids"),
+                batch["coedge_features"],
+                batch.get("coedge_point_grids"),
+                batch["face_kernel_tensor"],
+                batch["edge_kernel_tensor"],
+                batch["coedge_kernel_tensor"],
+                batch["coedges_of_edges"],
+                batch["coedges_of_small_faces"],
+                batch["coedges_of_big_faces"],
+                batch["big_face_coedge_offsets"],
+                batch["coedge_to_face"]
+            )
+            logits.append(model.classification_layer(face_embeddings))
+            labels.append(batch["labels"])
+    return torch.cat(logits), torch.cat(labels)
+
+
+def compare_logits(reference_logits, logits, labels, has_labels):
+    predicted = torch.argmax(logits, dim=1)
+    reference_predicted = torch.argmax(reference_logits, dim=1)
+    num_faces = max(labels.size(0), 1)
+    accuracy = None
+    if has_labels:
+        accuracy = (predicted == labels).sum().item() / num_faces
+    return {
+        "max_logit_difference": (logits - reference_logits).abs().max().item() if logits.numel() > 0 else 0.0,
+        "agreement": (predicted == reference_predicted).sum().item() / num_faces,
+        "accuracy": accuracy
+    }
+
+
+def check_storage_precision(model, opts, split, half_precision_features):
+    """
+    Evaluate the model with each storage dtype and compare
+    with float32.  Returns a dictionary of results for each dtype
+    """
+    model.eval()
+    results = {}
+    reference_logits = None
+    for dtype in STORAGE_DTYPES_TO_CHECK:
+        dtype_opts = copy.copy(opts)
+        dtype_opts.grid_dtype = dtype
+        dtype_opts.feature_dtype = dtype if half_precision_features else "float32"
+        dataset = BRepNetDataset(dtype_opts, split)
+        logits, labels = find_logits(model, dataset)
+        if reference_logits is None:
+            reference_logits = logits
+        results[dtype] = compare_logits(reference_logits, logits, labels, dataset.label_dir is not None)
+        results[dtype]["bytes_per_body"] = mean_bytes_per_body(dataset)
+    return results
+
+
+def print_results(results):
+    float32_bytes = results["float32"]["bytes_per_body"]
+    for dtype, result in results.items():
+        saved = float32_bytes - result["bytes_per_body"]
+        print(f"{dtype}")
+        print(f"    Bytes per body          {result['bytes_per_body']:.0f}  ({saved:.0f} saved)")
+        print(f"    Max logit difference    {result['max_logit_difference']:.6f}")
+        print(f"    Agreement with float32  {result['agreement']:.4f}")
+        if result["accuracy"] is not None:
+            print(f"    Accuracy                {result['accuracy']:.4f}")
+
+
+if __name__ == '__main__':
+    # This needs Open Cascade to convert the step files
+    from eval.evaluate_folder import build_dataset_file
+
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument("--model", type=str, help="Model to use for the check")
+    parser.add_argument("--half_precision_features", action="store_true", help="Also store the features in half precision")
+    parser.add_argument("--min_agreement", type=float, default=0.99, help="Fail if the predictions agree with float32 on less than this fraction of faces")
+    opts = parser.parse_args()
+
+    # Convert the step files and build a dataset file with the standardization
+    opts.dataset_file, opts.dataset_dir = build_dataset_file(opts)
+
+    if opts.model is not None:
+        model = BRepNet.load_from_checkpoint(opts.model, opts=opts)
+    else:
+        print("Warning! No pretrained model given.  Using random network!")
+        model = BRepNet(opts)
+
+    results = check_storage_precision(model, opts, "test_set", opts.half_precision_features)
+    print_results(results)
+    for dtype, result in results.items():
+        if result["agreement"] < opts.min_agreement:
+            print(f"Error! The predictions with {dtype} storage only agree with float32 on {result['agreement']:.4f} of the faces")
+            sys.exit(1)
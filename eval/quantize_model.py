@@ -0,0 +1,121 @@
+"""
+Quantize a trained BRepNet checkpoint to int8 and compare the
+quantized model with the float model.
+
+The encoders are calibrated on a random sample of the training set.
+See models/brepnet_quantization.py.  The quantized model is saved to
+--output and can be loaded with load_quantized_model().  Then both
+models are run on a held out split and we report
+
+    - The size of the saved weights
+    - The time to run the split, in faces per second
+    - The fraction of faces where the predicted segment matches the float model
+    - The accuracy and mean IoU against the labels, when the labels
+      are available
+
+    python -m eval.quantize_model \\
+        --dataset_file /path/to/dataset.json \\
+        --dataset_dir /path/to/processed \\
+        --model /path/to/model.ckpt \\
+        --output /path/to/model_int8.pt
+"""
+import argparse
+import io
+import torch
+
+from models.brepnet import BRepNet
+from models.brepnet_predictor import BRepNetPredictor
+from models.brepnet_quantization import quantize_model, save_quantized_model, load_quantized_model
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
+from eval.check_inference_precision import find_iou, find_logits
+
+
+def collate_batches(dataset, indices, bodies_per_batch):
+    return [
+        brepnet_collate_fn([ dataset[i] for i in indices[start:start + bodies_per_batch] ])
+        for start in range(0, len(indices), bodies_per_batch)
+    ]
+
+
+def find_calibration_batches(dataset, num_calibration_bodies, bodies_per_batch, seed=0):
+    """
+    Collate a random sample of the bodies in the dataset
+    """
+    generator = torch.Generator().manual_seed(seed)
+    indices = torch.randperm(len(dataset), generator=generator)[:num_calibration_bodies].tolist()
+    return collate_batches(dataset, indices, bodies_per_batch)
+
+
+def model_size_in_bytes(model):
+    """
+    The size of the saved state dict
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return len(buffer.getvalue())
+
+
+def compare_models(models, batches):
+    """
+    Run each model on the batches and compare the predictions
+    with the first model
+    """
+    labels = torch.cat([ batch["labels"] for batch in batches ])
+    num_faces = max(labels.size(0), 1)
+    results = {}
+    reference_predicted = None
+    for name, model in models.items():
+        logits, elapsed = find_logits(BRepNetPredictor(model), batches)
+        predicted = torch.argmax(torch.softmax(logits, dim=1), dim=1)
+        if reference_predicted is None:
+            reference_predicted = predicted
+        results[name] = {
+            "size_bytes": model_size_in_bytes(model),
+            "faces_per_second": labels.size(0) / max(elapsed, 1e-9),
+            "agreement": (predicted == reference_predicted).sum().item() / num_faces,
+            "accuracy": (predicted == labels).sum().item() / num_faces,
+            "mean_iou": find_iou(predicted, labels, logits.size(1))
+        }
+    return results
+
+
+def print_report(results, has_labels):
+    reference = next(iter(results.values()))
+    for name, result in results.items():
+        print(f"{name}")
+        print(f"    Size                      {result['size_bytes']/1024**2:.2f}Mb  ({reference['size_bytes']/result['size_bytes']:.2f}x smaller)")
+        print(f"    Faces per second          {result['faces_per_second']:.0f}  ({result['faces_per_second']/reference['faces_per_second']:.2f}x)")
+        print(f"    Agreement with float      {result['agreement']:.4f}")
+        if has_labels:
+            print(f"    Accuracy                  {result['accuracy']:.4f}")
+            print(f"    Mean IoU                  {result['mean_iou']:.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser = BRepNet.add_model_specific_args(parser)
+    parser.add_argument("--model", type=str, required=True, help="The float checkpoint to quantize")
+    parser.add_argument("--output", type=str, required=True, help="Where to save the quantized model")
+    parser.add_argument("--num_calibration_bodies", type=int, default=200, help="Number of bodies from the training set used to calibrate the encoders")
+    parser.add_argument("--split", type=str, default="test_set", choices=["validation_set", "test_set"], help="The held out split used for the comparison")
+    opts = parser.parse_args()
+
+    model = BRepNet.load_from_checkpoint(opts.model, opts=opts)
+    model.eval()
+    train_dataset = BRepNetDataset(opts, "training_set")
+    calibration_batches = find_calibration_batches(train_dataset, opts.num_calibration_bodies, opts.batch_size)
+    quantized_model = quantize_model(model, calibration_batches)
+    save_quantized_model(quantized_model, opts.output)
+    print(f"Quantized model saved to {opts.output}")
+
+    # Compare using the model as it is loaded from the file
+    test_dataset = BRepNetDataset(opts, opts.split)
+    test_batches = collate_batches(test_dataset, list(range(len(test_dataset))), opts.batch_size)
+    results = compare_models(
+        {
+            "float32": model,
+            "int8": load_quantized_model(opts.output)
+        },
+        test_batches
+    )
+    print_report(results, test_dataset.label_dir is not None)
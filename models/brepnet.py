@@ -5,11 +5,16 @@ from pytorch_lightning.core.lightning import LightningModule
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 import utils.data_utils as data_utils
-from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
+from dataloaders.brepnet_batch import BRepNetBatch
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, find_coedge_to_face
 from dataloaders.brepnet_dataset_old import BRepNetDatasetOld
 from dataloaders.max_num_faces_sampler import MaxNumFacesSampler
+from dataloaders.cost_balanced_sampler import CostBalancedBatchSampler, find_cost, find_kernel_size
+from dataloaders.prefetcher import BodyPrefetcher, PrefetchingSampler
+from models.segment_max import segment_max
 from models.uvnet_encoders import UVNetCurveEncoder, UVNetSurfaceEncoder
 
 
@@ -63,6 +68,126 @@ def build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc):
     return Psi
 
 
+def find_combined_kernel_tensor(Kf, Ke, Kc, num_faces, num_edges):
+    """
+    Combine the kernel index tensors into one index into the
+    entity buffer
+
+    X = torch.cat([Xf, Xe, Xc])
+
+    which holds the feature vectors of the faces, then the edges and 
+    then the coedges.  The edge and coedge indices are offset by the
+    number of rows before them in the buffer.
+
+    K.size() = [ num_coedges x num_ents_in_kernel ]
+
+    The kernel tensors are the same for every layer, so this
+    only needs to be done once for each batch
+    """
+    return torch.cat([Kf, Ke + num_faces, Kc + (num_faces + num_edges)], dim=1)
+
+
+def build_matrix_Psi_fused(X, K):
+    """
+    Build the matrix Psi from the entity buffer X and the combined
+    kernel tensor K from find_combined_kernel_tensor().
+
+    X.size() = [ (num_faces + num_edges + num_coedges) x num_features ]
+    K.size() = [ num_coedges x num_ents_in_kernel ]
+
+    The rows of the buffer are gathered with a single index_select,
+    which writes Psi directly.  No per entity type intermediate tensors
+    are created, and the backward pass is a single index_add.  The
+    result is identical to build_matrix_Psi() when the faces, edges 
+    and coedges all have the same number of features
+    """
+    Psi = torch.index_select(X, 0, K.view(-1))
+    return Psi.view(K.size(0), K.size(1)*X.size(1))
+
+
+def pool_coedges_into_entity_buffer(Z, Ec, Fc, Hf_init, num_edges):
+    """
+    Max pool the output of a hidden layer directly into the entity
+    buffer read by build_matrix_Psi_fused() in the next layer.
+
+    Z.size() = [ num_coedges x (3*num_filters) ]
+
+    The rows of Z hold Zc, Ze and Zf for each coedge one after the
+    other, so Z is viewed as [ (3*num_coedges) x num_filters ] and
+    pooled with a single segment max.  Each Zc row is the only member
+    of its coedge row of the buffer.  The Ze and Zf rows are pooled
+    onto the rows of their edge and face.  The result is identical to
+    pool_coedges_onto_edges_and_faces() with the segmented pooling,
+    followed by concatenating Hf, He and Zc.
+
+    X.size() = [ (num_faces + num_edges + num_coedges) x num_filters ]
+    """
+    num_faces = Hf_init.size(0)
+    num_coedges = Fc.size(0)
+    coedge_rows = torch.arange(num_coedges, device=Fc.device) + (num_faces + num_edges)
+    segment_ids = torch.stack([coedge_rows, Ec + num_faces, Fc], dim=1).view(-1)
+    X_init = torch.cat([Hf_init, Hf_init.new_full((num_edges + num_coedges,), -float("inf"))])
+    return segment_max(Z.view(3*num_coedges, -1), segment_ids, X_init.size(0), X_init)
+
+
+def can_fuse_entities(Xf, Xe, Xc):
+    """
+    The entities can only share one buffer when they have the same
+    number of features.  This is true for the hidden layers, but not
+    usually for the input layer
+    """
+    return Xf.size(1) == Xe.size(1) and Xe.size(1) == Xc.size(1)
+
+
+def gather_and_sum_linear(linear, Xf, Xe, Xc, Kf, Ke, Kc):
+    """
+    Apply the linear layer to the matrix Psi without building Psi.
+
+    The columns of the weight matrix W of the linear layer can be split
+    into one block for each entity in the kernel.  The block Wi multiplies
+    the feature vectors of the entities in the kernel index column Ki, so
+
+        linear(Psi) = b + sum_i Xi[Ki] Wi^T = b + sum_i (Xi Wi^T)[Ki]
+
+    For each entity in the kernel we project all the feature vectors with 
+    Wi and gather the rows we need from the projected features.  This
+    never creates the tensor Psi of size
+
+        [ num_coedges x (num_ents_in_kernel*num_ent_features) ]
+
+    Only Xf, Xe and Xc need to be kept for the backward pass rather
+    than Psi.  The projection for the faces and edges is also cheaper 
+    than the matrix multiply for Psi, as there are fewer faces and edges
+    than coedges.
+
+    The result is the same as linear(build_matrix_Psi(...)) up to the 
+    rounding in the order of the sums.
+    """
+    num_coedges = Kc.size(0)
+    out_features = linear.weight.size(0)
+    Z = None
+    first_column = 0
+    for X, K in [(Xf, Kf), (Xe, Ke), (Xc, Kc)]:
+        num_ent_features = X.size(1)
+        for i in range(K.size(1)):
+            Wi = linear.weight[:, first_column : first_column + num_ent_features]
+            first_column += num_ent_features
+
+            # Zi.size() = [ num_coedges x out_features ]
+            Zi = torch.index_select(torch.matmul(X, Wi.t()), 0, K[:, i])
+            if Z is None:
+                Z = Zi
+            else:
+                Z = Z.add_(Zi)
+    assert first_column == linear.weight.size(1), "The kernel doesn't match the linear layer"
+
+    if Z is None:
+        Z = torch.zeros((num_coedges, out_features), device=linear.weight.device)
+    if linear.bias is not None:
+        Z = Z.add_(linear.bias)
+    return Z
+
+
 def find_max_feature_vectors_for_each_edge(Ze, Ce):
     """
     Each edge in the B-Rep has two coedges.  In this function
@@ -86,7 +211,7 @@ def find_max_feature_vectors_for_each_edge(Ze, Ce):
 
     return He
 
-def find_max_feature_vectors_for_each_face(Zf, Cf, Csf, device):
+def find_max_feature_vectors_for_each_face(Zf, Cf, Csf, Csf_offsets, device):
     """
     Each face in the B-Rep will have many coedges. In this function
     we perform an element-wise max pooling of the coedge features in
@@ -105,13 +230,12 @@ def find_max_feature_vectors_for_each_face(Zf, Cf, Csf, device):
     zeros will be concatenated to the mlp output tensor to allow 
     this padding to work.
 
-    For faces with more than max_coedges coedges we have
-    an array of tensors of different sizes
-    
-    Csf = [
-        Csf.size() = [ num_coedges_in_face_1 ],
-        ...
-    ]
+    For faces with more than max_coedges coedges the indices of the
+    coedges of all these faces are concatenated into one tensor
+
+    Csf.size() = [ num_coedges_in_big_faces ]
+
+    The coedges of big face i are Csf[Csf_offsets[i]:Csf_offsets[i+1]]
     """
     # There can be many coedges around each face, so rather than having one 
     # index tensor we have things split into two bits.
@@ -128,26 +252,108 @@ def find_max_feature_vectors_for_each_face(Zf, Cf, Csf, device):
     # has size [ num_small_faces x num_filters ]
     (Hfsmall_faces, Hfsmall_faces_argmaxs)  = torch.max(Zft, dim=1)
 
-    # Now for the faces with many halfedges we have to do this face by face
-    Hf_array = [ Hfsmall_faces ]
-    for Csingle_face in Csf:
-        # Create tensor for a single face
-        # Zsingle_face.size() = [ num_coedges_on_ith_face x num_filters ]
-        Zsingle_face = Zf[Csingle_face]
+    if Csf.size(0) == 0:
+        return Hfsmall_faces
+
+    # Now for the faces with many coedges we gather the feature vectors of
+    # all their coedges into one tensor
+    # Zbig_faces.size() = [ num_coedges_in_big_faces x num_filters ]
+    Zbig_faces = Zf[Csf]
 
-        # Now we take the max over the coedges in dim 0 to gave us
-        # Hbig_face.size() = [  num_filters ]
-        # We need to reshape it to  [ 1 x num_filters ]
-        (Hbig_face, Hbig_face_argmaxs)  = torch.max(Zsingle_face, dim=0)
-        Hf_array.append(torch.reshape(Hbig_face, (1, num_filters)))
+    # and take the max over the coedges of each face with one segmented
+    # reduction.  Hbig_faces.size() = [ num_big_faces x num_filters ]
+    Hbig_faces = torch.segment_reduce(Zbig_faces, "max", lengths=torch.diff(Csf_offsets), axis=0)
 
-    # Now we can create the final Hf by concatenating all the Hf tensors
+    # Now we can create the final Hf by concatenating the small and big faces
     # The tensor Hf will now have size [ num_faces x num_filters ]
-    Hf = torch.cat(Hf_array, dim=0)
+    Hf = torch.cat([Hfsmall_faces, Hbig_faces], dim=0)
 
     return Hf
 
 
+def find_edge_of_each_coedge(Ce, num_coedges):
+    """
+    Invert the tensor Ce to find the edge of each coedge.
+    This is the segment index used for the segmented edge pooling
+
+    Ec.size() = [ num_coedges ]
+    """
+    edges = torch.arange(Ce.size(0), device=Ce.device).unsqueeze(1).expand_as(Ce)
+    Ec = torch.zeros(num_coedges, dtype=torch.int64, device=Ce.device)
+    return Ec.scatter_(0, Ce.flatten(), edges.flatten())
+
+
+def find_initial_face_values(Fc, num_faces, max_coedges):
+    """
+    The padded face pooling includes the zero padding row in the
+    max for every face with less than max_coedges coedges.  For the 
+    segmented pooling to give identical results these faces start
+    the max from zero and the other faces from -inf.  This matters
+    for the output layer, where Z is not passed through a ReLU
+
+    Hf_init.size() = [ num_faces ]
+    """
+    coedges_per_face = torch.zeros(num_faces, device=Fc.device).scatter_add_(
+        0, Fc, torch.ones(Fc.size(0), device=Fc.device)
+    )
+    Hf_init = torch.zeros(num_faces, device=Fc.device)
+    return Hf_init.masked_fill_(coedges_per_face >= max_coedges, -float("inf"))
+
+
+def checkpoint_encoder(encoder, G):
+    """
+    Run a UV-Net encoder on the grids G keeping only G for the backward
+    pass.  The activations are recomputed in the backward pass.  The
+    batch norm running statistics are updated by the first forward pass
+    but not again when the activations are recomputed
+    """
+    batch_norms = [ m for m in encoder.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) ]
+    num_runs = [0]
+    def run_encoder(G):
+        recomputing = num_runs[0] > 0
+        num_runs[0] += 1
+        if not recomputing:
+            return encoder(G)
+        # The recomputed activations normalize with the same batch
+        # statistics.  We put back the running statistics afterwards
+        running_stats = [ [ b.clone() for b in m.buffers() ] for m in batch_norms ]
+        try:
+            return encoder(G)
+        finally:
+            with torch.no_grad():
+                for m, buffers in zip(batch_norms, running_stats):
+                    for b, saved in zip(m.buffers(), buffers):
+                        b.copy_(saved)
+    return checkpoint(run_encoder, G, use_reentrant=False)
+
+
+def pool_coedges_onto_edges_and_faces(Ze, Zf, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, face_pooling, device):
+    """
+    Max pool the coedge feature vectors onto the edges and faces.
+
+    With face_pooling "padded" the index tensors Ce, Cf and Csf
+    are used.  With "segmented" each coedge is scattered onto its
+    edge Ec and face Fc.  See models/segment_max.py.  Ze or Zf
+    may be None when only one of the two is needed
+    """
+    He = None
+    Hf = None
+    if face_pooling == "segmented":
+        if Ze is not None:
+            # Every edge has two coedges, so the initial value is never
+            # the max
+            He_init = torch.full((Ce.size(0),), -float("inf"), device=Ze.device)
+            He = segment_max(Ze, Ec, Ce.size(0), He_init)
+        if Zf is not None:
+            Hf = segment_max(Zf, Fc, Hf_init.size(0), Hf_init)
+    else:
+        if Ze is not None:
+            He = find_max_feature_vectors_for_each_edge(Ze, Ce)
+        if Zf is not None:
+            Hf = find_max_feature_vectors_for_each_face(Zf, Cf, Csf, Csf_offsets, device)
+    return He, Hf
+
+
 
 class BRepNetMLP(LightningModule):
     """
@@ -213,13 +419,23 @@ class BRepNetMLP(LightningModule):
         return self.mlp(Psi)
 
 
+    def forward_from_kernel(self, Xf, Xe, Xc, Kf, Ke, Kc):
+        """
+        Forward pass through the MLP for the matrix Psi built from
+        the given features and kernel tensors.  The first linear 
+        layer is applied without building Psi
+        """
+        Z = gather_and_sum_linear(self.mlp[0], Xf, Xe, Xc, Kf, Ke, Kc)
+        return self.mlp[1:](Z)
+
+
 class BRepNetLayer(LightningModule):
     """
     A general layer in BRepNet.  
     This can be either the input layer or one of the hidden layers.
     """
 
-    def __init__(self, num_mlp_layers, input_size, output_size, dropout=None):
+    def __init__(self, num_mlp_layers, input_size, output_size, dropout=None, psi_mode="concat", face_pooling="padded"):
         """
         Initialization of a general BRepNet layer.
 
@@ -233,9 +449,22 @@ class BRepNetLayer(LightningModule):
 
         dropout        - To use dropout, set this to the dropout probablity
                          No dropout is used if this is set to None
+
+        psi_mode       - "concat" builds the matrix Psi.  "gather_sum" applies 
+                         the first linear layer of the MLP without building Psi.
+                         See gather_and_sum_linear().  "fused" builds Psi with 
+                         one gather from a buffer of all the entities.  See
+                         build_matrix_Psi_fused()
+
+        face_pooling   - "padded" pools the coedges onto the edges and faces with
+                         the index tensors Ce, Cf and Csf.  "segmented" scatters
+                         each coedge onto its edge and face.  See 
+                         pool_coedges_onto_edges_and_faces()
         """ 
         super(BRepNetLayer, self).__init__()
         self.output_size = output_size
+        self.psi_mode = psi_mode
+        self.face_pooling = face_pooling
 
         # This is not the final layer
         final_layer = False
@@ -246,7 +475,7 @@ class BRepNetLayer(LightningModule):
         self.mlp = BRepNetMLP(num_mlp_layers, input_size, 3*output_size, 3*output_size, final_layer, dropout)
         
 
-    def forward(self, Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf):
+    def forward(self, Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Ec=None, Fc=None, Hf_init=None, K=None, X=None):
         """
         This layer performs the following steps
 
@@ -263,14 +492,53 @@ class BRepNetLayer(LightningModule):
 
             4) The coedges features in Zf and Ze are max pooled
                onto the edges and faces
-        """
 
-        # We use the kernel index matrices to construct a matrix Psi with
-        # size [ num_coedges x mlp_input_size]
-        Psi = build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc)
+        Ec, Fc and Hf_init are only needed for the segmented pooling.
+        K is the combined kernel tensor used by the fused psi_mode.
+        X is the entity buffer returned by the previous layer, which 
+        holds Xf, Xe and Xc one after the other.  
+
+        With the fused psi_mode and the segmented pooling the outputs 
+        Hf, He and Zc are pooled into a new entity buffer, which is 
+        returned as the last element of the tuple, and Hf, He and Zc
+        are views of it.  The next layer gathers Psi from this buffer
+        without copying the hidden states.  Otherwise the last element
+        is None and the next layer concatenates Hf, He and Zc
+        """
 
-        # Next the mlp is applied to Psi
-        Z = self.mlp(Psi)
+        if self.psi_mode == "gather_sum":
+            # The mlp is applied to Psi without building it
+            Z = self.mlp.forward_from_kernel(Xf, Xe, Xc, Kf, Ke, Kc)
+        elif self.psi_mode == "fused" and can_fuse_entities(Xf, Xe, Xc):
+            # Psi is gathered from one buffer of all the entities
+            if K is None:
+                K = find_combined_kernel_tensor(Kf, Ke, Kc, Xf.size(0), Xe.size(0))
+            if X is None:
+                X = torch.cat([Xf, Xe, Xc])
+            Psi = build_matrix_Psi_fused(X, K)
+            Z = self.mlp(Psi)
+        else:
+            # We use the kernel index matrices to construct a matrix Psi with
+            # size [ num_coedges x mlp_input_size]
+            Psi = build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc)
+
+            # Next the mlp is applied to Psi
+            Z = self.mlp(Psi)
+
+        # Under autocast the mlp output is in reduced precision.  The
+        # pooling and the layers which follow it work in float32
+        Z = Z.float()
+
+        if self.psi_mode == "fused" and self.face_pooling == "segmented":
+            # The hidden states are written straight into the buffer
+            # for the next layer
+            num_faces = Hf_init.size(0)
+            num_edges = Ce.size(0)
+            X = pool_coedges_into_entity_buffer(Z, Ec, Fc, Hf_init, num_edges)
+            Hf = X[:num_faces]
+            He = X[num_faces : num_faces + num_edges]
+            Hc = X[num_faces + num_edges :]
+            return (Hf, He, Hc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, K, X)
 
         # Now we need to split Z into 3 parts
         Zc = Z[:, : self.output_size]
@@ -280,13 +548,13 @@ class BRepNetLayer(LightningModule):
         # The tensor Zc is now the output Hc
 
         # Each edge has two coedges.  We need to find the 
-        # maximum of the two feature vectors for each edge
-        He = find_max_feature_vectors_for_each_edge(Ze, Ce)
-
+        # maximum of the two feature vectors for each edge.
         # Finally we need to do the same thing for faces
-        Hf = find_max_feature_vectors_for_each_face(Zf, Cf, Csf, self.device)
+        He, Hf = pool_coedges_onto_edges_and_faces(
+            Ze, Zf, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, self.face_pooling, self.device
+        )
 
-        return (Hf, He, Zc, Kf, Ke, Kc, Ce, Cf, Csf)
+        return (Hf, He, Zc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, K, None)
 
 
 class BRepNetFaceOutputLayer(LightningModule):
@@ -298,7 +566,7 @@ class BRepNetFaceOutputLayer(LightningModule):
     The hidden state for edges and coedges will not be created.
     """
         
-    def __init__(self, num_mlp_layers, input_size, output_size, dropout=None):
+    def __init__(self, num_mlp_layers, input_size, output_size, dropout=None, psi_mode="concat", face_pooling="padded"):
         """
         Initialization of the BRepNet output layer.
 
@@ -311,8 +579,17 @@ class BRepNetFaceOutputLayer(LightningModule):
 
         dropout        - To use dropout, set this to the dropout probability
                          No dropout is used if this is set to None
+
+        psi_mode       - "concat" builds the matrix Psi.  "gather_sum" applies 
+                         the first linear layer of the MLP without building Psi.
+                         "fused" builds Psi with one gather
+
+        face_pooling   - "padded" or "segmented" pooling of the coedges 
+                         onto the faces
         """ 
         super(BRepNetFaceOutputLayer, self).__init__()
+        self.psi_mode = psi_mode
+        self.face_pooling = face_pooling
 
         # This is the final layer of the network.  We need to pass this
         # flag to the MLP so it knows that the final ReLU and bias are 
@@ -324,7 +601,7 @@ class BRepNetFaceOutputLayer(LightningModule):
         self.mlp = BRepNetMLP(num_mlp_layers, input_size, output_size, output_size, final_layer, dropout)
 
 
-    def forward(self, Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf):
+    def forward(self, Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Ec=None, Fc=None, Hf_init=None, K=None, X=None):
         """
         This layer performs the following steps
 
@@ -338,18 +615,38 @@ class BRepNetFaceOutputLayer(LightningModule):
 
             3) The coedges features in Z are max pooled
                to provide the logits for the faces
+
+        X is the entity buffer returned by the previous layer.  See
+        BRepNetLayer.forward()
         """
         
-        # We use the kernel index matrices to construct a matrix Psi with
-        # size [ num_coedges x mlp_input_size]
-        Psi = build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc)
-
-        # Next the mlp is applied to Psi
-        Z = self.mlp(Psi)
+        if self.psi_mode == "gather_sum":
+            # The mlp is applied to Psi without building it
+            Z = self.mlp.forward_from_kernel(Xf, Xe, Xc, Kf, Ke, Kc)
+        elif self.psi_mode == "fused" and can_fuse_entities(Xf, Xe, Xc):
+            # Psi is gathered from one buffer of all the entities
+            if K is None:
+                K = find_combined_kernel_tensor(Kf, Ke, Kc, Xf.size(0), Xe.size(0))
+            if X is None:
+                X = torch.cat([Xf, Xe, Xc])
+            Psi = build_matrix_Psi_fused(X, K)
+            Z = self.mlp(Psi)
+        else:
+            # We use the kernel index matrices to construct a matrix Psi with
+            # size [ num_coedges x mlp_input_size]
+            Psi = build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc)
+
+            # Next the mlp is applied to Psi
+            Z = self.mlp(Psi)
+
+        # The pooling is done in float32, as for the other layers
+        Z = Z.float()
 
         # Finally use max pooling to combine the coedge
         # activations in Z to build the logits for faces
-        Hf = find_max_feature_vectors_for_each_face(Z, Cf, Csf, self.device)
+        _, Hf = pool_coedges_onto_edges_and_faces(
+            None, Z, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, self.face_pooling, self.device
+        )
         return Hf
 
 
@@ -442,20 +739,34 @@ class BRepNet(LightningModule):
         if dropout == 0.0:
             dropout=None
 
+        # How the first linear layer of each MLP consumes the kernel
+        psi_mode = getattr(opts, "psi_mode", "concat")
+
+        # How the coedges are pooled onto the edges and faces
+        face_pooling = getattr(opts, "face_pooling", "padded")
+
         # The first layer has a size based on in the number of input features
-        self.layers.append(BRepNetLayer(num_mlp_layers, mlp_input_size, num_filters, dropout))
+        self.layers.append(BRepNetLayer(num_mlp_layers, mlp_input_size, num_filters, dropout, psi_mode, face_pooling))
 
         # The hidden layers has a size based on in the number of filters
         for l in range(2, opts.num_layers):
-            self.layers.append(BRepNetLayer(num_mlp_layers, mlp_hidden_size, num_filters, dropout))
+            self.layers.append(BRepNetLayer(num_mlp_layers, mlp_hidden_size, num_filters, dropout, psi_mode, face_pooling))
 
         # The output layer is similar, but it generates only the embeddings for the faces
-        self.output_layer = BRepNetFaceOutputLayer(num_mlp_layers, mlp_hidden_size, num_filters, dropout) 
+        self.output_layer = BRepNetFaceOutputLayer(num_mlp_layers, mlp_hidden_size, num_filters, dropout, psi_mode, face_pooling) 
 
         # This final classification layer takes the embedding for
         # each face and projects it down to the number of classes
         self.classification_layer = nn.Linear(num_filters, num_classes)
 
+        # The in-memory body caches are created with the dataloaders
+        self.train_memory_cache = None
+        self.val_memory_cache = None
+
+        # The background readers for each split, which are closed
+        # when the dataloader is created again or in teardown()
+        self.prefetchers = {}
+
         # Save the hyper-parameters
         self.save_hyperparameters()
 
@@ -472,6 +783,9 @@ class BRepNet(LightningModule):
         parser.add_argument("--num_layers", type=int, default=5, help="2 gives just the input and output layers")
         parser.add_argument("--num_mlp_layers", type=int, default=2, help="Number of layers in the mlp.  Value > 0")
         parser.add_argument("--num_filters", type=int, default=84, help="Number of filters.  Hyper-parameter s in the paper.  Value > 0")
+        parser.add_argument("--psi_mode", type=str, default="concat", choices=["concat", "gather_sum", "fused"], help="concat builds the matrix Psi for each layer.  gather_sum gives the same result without building Psi, which uses less memory with large kernels.  fused builds Psi for the hidden layers with one gather from a single buffer of face, edge and coedge hidden states.  With --face_pooling segmented each layer pools its output directly into this buffer")
+        parser.add_argument("--face_pooling", type=str, default="padded", choices=["padded", "segmented"], help="padded, the default, pools the coedges onto the faces with the padded index tensors.  segmented scatters each coedge onto its face, which is faster and works for any number of coedges per face")
+        parser.add_argument("--reorder_faces", type=int, default=1, help="Move the faces with more than 30 coedges after the other faces in each body.  Needed by --face_pooling padded")
         parser.add_argument("--curve_embedding_size", type=int, default=64, help="Size of curve embedding from edge or coedge grids")
         parser.add_argument("--surf_embedding_size", type=int, default=64, help="Size of surface embedding from face grids")
         parser.add_argument("--use_face_grids", type=int, default=1, help="Use UV-Net style face grids")
@@ -484,12 +798,32 @@ class BRepNet(LightningModule):
         parser.add_argument("--learning_rate", type=float, default=0.001, help="Learning rate")
         parser.add_argument('--batch_size', type=int, default=200, help="Number of breps in one batch")
         parser.add_argument('--max_num_faces_per_batch', type=int, help="If defined this sets a limit on the number of faces per batch")
+        parser.add_argument('--max_cost_per_batch', type=int, help="If defined the training batches are packed so the cost of each batch is below this limit.  The cost of a solid is the number of coedges times the kernel size plus --face_cost times the number of faces")
+        parser.add_argument('--face_cost', type=float, default=1.0, help="The cost of each face used with --max_cost_per_batch")
+        parser.add_argument('--batch_seed', type=int, default=0, help="Seed for the batches created with --max_cost_per_batch")
+        parser.add_argument(
+            "--oversized_solids", 
+            type=str, 
+            default="skip", 
+            choices=["skip", "singleton", "checkpoint"], 
+            help="What to do with solids over the --max_num_faces_per_batch or --max_cost_per_batch limit.  skip, the default, leaves them out of training.  singleton trains on them in batches by themselves.  checkpoint also recomputes the activations of each layer in the backward pass to reduce the memory used"
+        )
+        parser.add_argument("--checkpoint_layers", type=int, default=0, help="Recompute the activations of each BRepNet layer in the backward pass rather than keeping them.  This reduces the peak memory used in training at the cost of about one more forward pass through the layers")
+        parser.add_argument("--checkpoint_encoders", type=int, default=0, help="Recompute the activations of the UV-Net surface and curve encoders in the backward pass rather than keeping them")
         parser.add_argument('--num_workers', type=int, default=0, help="Number of worker threads")
+        parser.add_argument('--prefetch_threads', type=int, default=0, help="When num_workers is 0, read the upcoming bodies in the background with this many threads.  0, the default, disables the prefetching")
+        parser.add_argument('--prefetch_queue_depth', type=int, default=16, help="The number of bodies the prefetcher reads ahead")
         parser.add_argument('--use_old_dataloader', action="store_true", help="Use the old dataloader")
         parser.add_argument('--shuffle_train_set', type=int, default=1, help="Use shuffling on the training set")
         parser.add_argument("--test_with_validation_set", action="store_true", help="Model to use for testing")
         parser.add_argument("--logit_dir", type=str, help="Save logits to this directory")
         parser.add_argument("--embeddings_dir", type=str, help="Save embeddings to this directory")
+        parser.add_argument("--cache_format", type=str, default="pickle", choices=["pickle", "packed"], help="Read bodies from one pickle file per body or from the memory mapped packed cache")
+        parser.add_argument("--require_cache", action="store_true", help="Fail rather than building missing cache entries during training.  Build the cache first with python -m dataloaders.build_cache")
+        parser.add_argument("--grid_dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"], help="The dtype used to store the point grids in the cache.  They are converted to float32 at the model input")
+        parser.add_argument("--feature_dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"], help="The dtype used to store the standardized features in the cache.  They are converted to float32 at the model input")
+        parser.add_argument("--memory_cache_gb", type=float, default=0.0, help="Keep up to this many Gb of bodies in an in-memory cache shared by the dataloader workers.  0 disables the memory cache")
+        parser.add_argument("--validate_standardization", action="store_true", help="Debug option to cross check the feature standardization element by element.  This is very slow")
         return parser
 
 
@@ -514,20 +848,39 @@ class BRepNet(LightningModule):
         return None
             
 
-    def create_face_embeddings(self, Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf):
+    def encode_grids(self, encoder, G, checkpoint_encoders):
+        """
+        Find the UV-Net embedding of the point grids G
+        """
+        if checkpoint_encoders and torch.is_grad_enabled():
+            return checkpoint_encoder(encoder, G.float())
+        return encoder(G.float())
+
+
+    def create_face_embeddings(self, Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Fc=None, checkpoint_layers=False, checkpoint_encoders=False):
         """
         This creates the embedding for each face.
+
+        Fc is the face of each coedge, used by the segmented pooling.
+        If it is not given it is found from Cf and Csf.
+
+        With checkpoint_layers only the inputs to each layer are kept for
+        the backward pass.  The rest of the activations are recomputed,
+        which reduces the memory used for very large solids.
+        checkpoint_encoders does the same for the UV-Net encoders
         """
 
         # Here we are adding UV-Net style face grids, edge grids and coedge grids.
         # In each case we can choose to have either the original BRepNet features,
         # the UV-Net features, both, or an array of zeros which contains no useful
-        # feature information
+        # feature information.
+        # The grids and features may be stored in half precision by the dataloader.
+        # They are converted to float32 here
         face_features = []
         if self.opts.use_face_grids:
-            face_features.append(self.surface_encoder(Gf))
+            face_features.append(self.encode_grids(self.surface_encoder, Gf, checkpoint_encoders))
         if self.opts.use_face_features:
-            face_features.append(Xf)
+            face_features.append(Xf.float())
         if len(face_features) == 0:
             # Use padding of zeros(num_faces x 1)
             num_faces = Xf.size(0)
@@ -536,9 +889,9 @@ class BRepNet(LightningModule):
 
         edge_features = []
         if self.opts.use_edge_grids:
-            edge_features.append(self.curve_encoder(Ge))
+            edge_features.append(self.encode_grids(self.curve_encoder, Ge, checkpoint_encoders))
         if self.opts.use_edge_features:
-            edge_features.append(Xe)
+            edge_features.append(Xe.float())
         if len(edge_features) == 0:
             # Use padding of zeros(num_edges x 1)
             num_edges = Xe.size(0)
@@ -547,27 +900,56 @@ class BRepNet(LightningModule):
 
         coedge_features = []
         if self.opts.use_coedge_grids:
-            coedge_features.append(self.curve_encoder(Gc))
+            coedge_features.append(self.encode_grids(self.curve_encoder, Gc, checkpoint_encoders))
         if self.opts.use_coedge_features:
-            coedge_features.append(Xc)
+            coedge_features.append(Xc.float())
         if len(coedge_features) == 0:
             # Use padding of zeros(num_coedges x 1)
             num_coedges = Xc.size(0)
             coedge_features.append(torch.zeros((num_coedges,1), device=Xc.device))
         Xc = torch.cat(coedge_features, dim=1)
 
-        # Now pass this information through the various layers
+        # The segment indices for the pooling are the same for every
+        # layer, so they are found once here
+        Ec = None
+        Hf_init = None
+        if self.output_layer.face_pooling == "segmented":
+            if Fc is None:
+                Fc = find_coedge_to_face(Cf, Csf, Csf_offsets, Xc.size(0))
+            Ec = find_edge_of_each_coedge(Ce, Xc.size(0))
+            Hf_init = find_initial_face_values(Fc, Xf.size(0), Cf.size(1))
+        else:
+            assert Cf.size(0) + Csf_offsets.size(0) - 1 == Xf.size(0), "The padded face pooling needs the faces to be reordered.  Use --reorder_faces 1"
+        K = None
+        if self.output_layer.psi_mode == "fused":
+            K = find_combined_kernel_tensor(Kf, Ke, Kc, Xf.size(0), Xe.size(0))
+        topology = (Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Ec, Fc, Hf_init, K)
+
+        # Now pass this information through the various layers.  With the
+        # fused psi_mode each layer also passes on the entity buffer X
+        # which holds its outputs
+        checkpoint_layers = checkpoint_layers and torch.is_grad_enabled()
+        X = None
         for i, layer in enumerate(self.layers):
-            Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf = layer(Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf)
+            if checkpoint_layers:
+                outputs = checkpoint(layer, Xf, Xe, Xc, *topology, X, use_reentrant=False)
+            else:
+                outputs = layer(Xf, Xe, Xc, *topology, X)
+            Xf, Xe, Xc, X = outputs[0], outputs[1], outputs[2], outputs[-1]
 
-        return self.output_layer(Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf)
+        if checkpoint_layers:
+            return checkpoint(self.output_layer, Xf, Xe, Xc, *topology, X, use_reentrant=False)
+        return self.output_layer(Xf, Xe, Xc, *topology, X)
 
 
-    def forward(self, Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf):
+    def forward(self, Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Fc=None):
         """
-        A forward pass through the network.
+        A forward pass through the network.  The arguments are as for
+        create_face_embeddings().  Returns the logits for each face.
+        See models/brepnet_predictor.py to run a trained model on
+        a batch or a single body
         """
-        face_embeddings = self.create_face_embeddings(Xf, Xe, Xc, Kf, Ke, Kc, Ce, Cf, Csf)
+        face_embeddings = self.create_face_embeddings(Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Fc)
         return self.classification_layer(face_embeddings)
 
 
@@ -609,22 +991,35 @@ class BRepNet(LightningModule):
         """
         A train or validation step for the BRepNet network on one batch
         """
-        # Unpack the tensor data
+        # Unpack the tensor data.  The grids are only in the batch 
+        # when the model options use them
         Xf = batch["face_features"]
-        Gf = batch["face_point_grids"]
+        Gf = batch.get("face_point_grids")
         Xe = batch["edge_features"]
-        Ge = batch["edge_point_grids"]
+        Ge = batch.get("edge_point_grids")
         Xc = batch["coedge_features"]
-        Gc = batch["coedge_point_grids"]
+        Gc = batch.get("coedge_point_grids")
         Kf = batch["face_kernel_tensor"]
         Ke = batch["edge_kernel_tensor"]
         Kc = batch["coedge_kernel_tensor"]
         Ce = batch["coedges_of_edges"]
         Cf = batch["coedges_of_small_faces"]
         Csf = batch["coedges_of_big_faces"]
+        Csf_offsets = batch["big_face_coedge_offsets"]
+        Fc = batch.get("coedge_to_face")
+
+        # With --checkpoint_layers every batch uses the memory bounded
+        # mode.  Otherwise only oversized solids, which are trained in
+        # batches by themselves, may need it
+        checkpoint_layers = bool(getattr(self.opts, "checkpoint_layers", 0)) or \
+                            (getattr(self.opts, "oversized_solids", "skip") == "checkpoint" and self.is_oversized_batch(batch))
 
         # Make the forward pass through the network
-        face_embeddings = self.create_face_embeddings(Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf)
+        face_embeddings = self.create_face_embeddings(
+            Xf, Gf, Xe, Ge, Xc, Gc, Kf, Ke, Kc, Ce, Cf, Csf, Csf_offsets, Fc,
+            checkpoint_layers=checkpoint_layers,
+            checkpoint_encoders=bool(getattr(self.opts, "checkpoint_encoders", 0))
+        )
 
         # The tensor logits is now size [ num_faces_in_batch x num_classes ]
         segmentation_scores = self.classification_layer(face_embeddings)
@@ -923,14 +1318,36 @@ class BRepNet(LightningModule):
 
         # Dataloader to read from open source based pipeline
         dataset = BRepNetDataset(self.opts, "training_set")
+        self.prefill_memory_cache(dataset)
+        self.train_memory_cache = dataset.memory_cache
 
         batch_sampler = None
         shuffle = self.opts.shuffle_train_set
         batch_size = self.opts.batch_size
+        max_cost_per_batch = getattr(self.opts, "max_cost_per_batch", None)
+        assert max_cost_per_batch is None or self.opts.max_num_faces_per_batch is None, \
+            "Use either max_num_faces_per_batch or max_cost_per_batch"
         if self.opts.max_num_faces_per_batch is not None:
             print("Warning! - max_num_faces_per_batch option may not work with multi-gpu or multi-node training")
-            batch_sampler = MaxNumFacesSampler(dataset, self.opts.max_num_faces_per_batch)
+            batch_sampler = MaxNumFacesSampler(
+                dataset, 
+                self.opts.max_num_faces_per_batch, 
+                include_oversized=self.include_oversized_solids()
+            )
+        if max_cost_per_batch is not None:
+            # The batches are split between the processes by the
+            # sampler, so Lightning must not replace it with a
+            # DistributedSampler.  Train with --replace_sampler_ddp False
+            batch_sampler = CostBalancedBatchSampler(
+                dataset.find_body_sizes(),
+                max_cost_per_batch,
+                coedge_cost=find_kernel_size(dataset.kernel),
+                face_cost=self.opts.face_cost,
+                seed=self.opts.batch_seed,
+                include_oversized=self.include_oversized_solids()
+            )
 
+        if batch_sampler is not None:
             if shuffle:
                 print("Warning! - Overriding shuffle option")
             shuffle = False
@@ -939,14 +1356,30 @@ class BRepNet(LightningModule):
                 print("Warning! - Overriding batch_size option")
             batch_size = 1
 
-        return torch.utils.data.DataLoader(
-            dataset,
-            collate_fn=brepnet_collate_fn,
-            batch_sampler=batch_sampler,
-            batch_size=batch_size,
-            num_workers=self.opts.num_workers,
-            shuffle=shuffle
-        )
+        return self.create_dataloader(dataset, "training_set", batch_size, shuffle, batch_sampler)
+
+
+    def include_oversized_solids(self):
+        return getattr(self.opts, "oversized_solids", "skip") != "skip"
+
+
+    def is_oversized_batch(self, batch):
+        """
+        The samplers put solids which are over the limit for a batch
+        in batches by themselves.  We find these batches from their size
+        """
+        num_faces = batch["face_features"].size(0)
+        max_num_faces_per_batch = getattr(self.opts, "max_num_faces_per_batch", None)
+        if max_num_faces_per_batch is not None and num_faces > max_num_faces_per_batch:
+            return True
+        max_cost_per_batch = getattr(self.opts, "max_cost_per_batch", None)
+        if max_cost_per_batch is not None:
+            num_coedges = batch["coedge_features"].size(0)
+            kernel_size = batch["face_kernel_tensor"].size(1) + \
+                          batch["edge_kernel_tensor"].size(1) + \
+                          batch["coedge_kernel_tensor"].size(1)
+            return find_cost(num_coedges, num_faces, kernel_size, self.opts.face_cost) > max_cost_per_batch
+        return False
 
 
     def val_dataloader(self):
@@ -961,12 +1394,9 @@ class BRepNet(LightningModule):
 
         # Dataloader to read from open source based pipeline
         dataset = BRepNetDataset(self.opts, "validation_set")
-        return torch.utils.data.DataLoader(
-            dataset,
-            collate_fn=brepnet_collate_fn,
-            batch_size=self.opts.batch_size,
-            num_workers=self.opts.num_workers
-        )
+        self.prefill_memory_cache(dataset)
+        self.val_memory_cache = dataset.memory_cache
+        return self.create_dataloader(dataset, "validation_set", self.opts.batch_size)
 
 
     def test_dataloader(self):
@@ -988,14 +1418,104 @@ class BRepNet(LightningModule):
             )
 
         dataset = BRepNetDataset(self.opts, val_or_test)
+        return self.create_dataloader(dataset, "test_set", self.opts.batch_size)
+
+
+    def create_dataloader(self, dataset, split, batch_size, shuffle=False, batch_sampler=None):
+        """
+        Create the dataloader for the dataset.  When the bodies are read
+        in the main process, the upcoming bodies are read in the background
+        by the prefetcher.  The split names the dataloader, so the
+        prefetcher of an earlier dataloader for it can be closed
+        """
+        self.close_prefetcher(split)
+        # Batches are copied to the GPU asynchronously from pinned memory
+        pin_memory = self.device.type == "cuda"
+        prefetch_threads = getattr(self.opts, "prefetch_threads", 0)
+        if self.opts.num_workers > 0 or prefetch_threads == 0:
+            return torch.utils.data.DataLoader(
+                dataset,
+                collate_fn=brepnet_collate_fn,
+                batch_sampler=batch_sampler,
+                batch_size=batch_size,
+                num_workers=self.opts.num_workers,
+                shuffle=shuffle,
+                pin_memory=pin_memory
+            )
+
+        # The prefetcher counts the bodies it reads ahead by batch, so
+        # the sampler is wrapped in a batch sampler
+        prefetcher = BodyPrefetcher(dataset, self.opts.prefetch_queue_depth, prefetch_threads)
+        self.prefetchers[split] = prefetcher
+        if batch_sampler is None:
+            if shuffle:
+                sampler = torch.utils.data.RandomSampler(dataset)
+            else:
+                sampler = torch.utils.data.SequentialSampler(dataset)
+            batch_sampler = torch.utils.data.BatchSampler(sampler, batch_size, drop_last=False)
         return torch.utils.data.DataLoader(
-            dataset,
+            prefetcher,
             collate_fn=brepnet_collate_fn,
-            batch_size=self.opts.batch_size,
-            num_workers=self.opts.num_workers
+            batch_sampler=PrefetchingSampler(batch_sampler, prefetcher),
+            pin_memory=pin_memory
         )
 
 
+    def close_prefetcher(self, split):
+        """
+        Stop the threads of the prefetcher for the split
+        """
+        prefetcher = self.prefetchers.pop(split, None)
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+    def teardown(self, stage=None):
+        for split in list(self.prefetchers.keys()):
+            self.close_prefetcher(split)
+
+
+    def prefill_memory_cache(self, dataset):
+        """
+        The worker processes can only read from the memory cache,
+        so when we use workers it must be filled before they start
+        """
+        if self.opts.num_workers > 0:
+            dataset.prefill_memory_cache()
+
+
+    def log_memory_cache_stats(self, memory_cache, prefix):
+        """
+        Log the hit, miss and eviction counts for the memory cache
+        over the last epoch
+        """
+        if memory_cache is None:
+            return
+        stats = memory_cache.stats()
+        for name in ["hits", "misses", "evictions", "hit_rate"]:
+            self.log(f"{prefix}/memory_cache_{name}", float(stats[name]), on_step=False, on_epoch=True)
+        memory_cache.reset_counters()
+
+
+    def on_train_epoch_end(self):
+        self.log_memory_cache_stats(self.train_memory_cache, "train")
+
+
+    def on_validation_epoch_end(self):
+        self.log_memory_cache_stats(self.val_memory_cache, "validation")
+
+
+    def transfer_batch_to_device(self, batch, device, dataloader_idx):
+        """
+        Move a BRepNetBatch to the device in one go.  The copies are
+        non-blocking so they overlap with the work already queued on
+        the GPU.  Batches from the old dataloader are plain dicts
+        """
+        if isinstance(batch, BRepNetBatch):
+            return batch.to(device, non_blocking=device.type == "cuda")
+        return super().transfer_batch_to_device(batch, device, dataloader_idx)
+
+
     def configure_optimizers(self):
         return torch.optim.Adam(self.parameters(), lr = self.opts.learning_rate)
 
@@ -1008,4 +1528,4 @@ class BRepNet(LightningModule):
         labels = batch["labels"]
         num_faces = labels.size(0)
         assert num_faces == Xf.size(0), "Xf tensor must have size equal to num_faces"
-        return num_faces
\ No newline at end of file
+        return num_faces
@@ -0,0 +1,263 @@
+"""
+Run a trained BRepNet on collated batches or single bodies without a
+PyTorch Lightning Trainer, and export it with TorchScript or ONNX.
+
+    model = BRepNet.load_from_checkpoint(checkpoint, opts=opts)
+    predictor = BRepNetPredictor(model)
+    output = predictor.predict(batch)
+    # output["logits"].size()     = [ num_faces x num_classes ]
+    # output["embeddings"].size() = [ num_faces x num_filters ]
+
+The forward() of the predictor takes a flat tuple of tensors, in the
+order of predictor.input_names, and returns the logits and embeddings.
+Use input_tensors() to get this tuple from a batch.  The same tuple is
+the input to the exported models
+
+    traced = predictor.trace(example_batch)
+    logits, embeddings = traced(*predictor.input_tensors(batch))
+
+    predictor.export_onnx(example_batch, "brepnet.onnx")
+
+The coedges are pooled onto the faces with the segmented pooling, which
+uses the face of each coedge rather than the padded index tensors.  This
+gives the same results as the padded pooling and has no data dependent
+shapes, so the numbers of faces, edges and coedges are dynamic axes of
+the exported models.  The model is run in eval mode with the segmented
+pooling, and its own settings are put back after each forward pass, so
+the model passed to the predictor is not changed.
+
+With precision "bfloat16" or "float16" the UV-Net encoders and the MLPs
+of each layer run under autocast in the reduced precision
+
+    predictor = BRepNetPredictor(model, precision="bfloat16")
+
+The max pooling, the final classification layer and so any softmax of
+the logits stay in float32.  The logits and embeddings are always
+float32.  Use eval/check_inference_precision.py to check the accuracy
+and speed of each precision on your data.
+"""
+from contextlib import contextmanager
+import torch
+import torch.nn as nn
+from torch.onnx import symbolic_helper
+
+from dataloaders.brepnet_dataset import brepnet_collate_fn, MAX_COEDGES_PER_FACE
+
+# The tensors the model may read from a batch, in the order they are
+# passed to forward().  The point grids are only passed when the
+# model uses them
+INPUT_NAMES = [
+    "face_features",
+    "face_point_grids",
+    "edge_features",
+    "edge_point_grids",
+    "coedge_features",
+    "coedge_point_grids",
+    "face_kernel_tensor",
+    "edge_kernel_tensor",
+    "coedge_kernel_tensor",
+    "coedges_of_edges",
+    "coedge_to_face"
+]
+
+OUTPUT_NAMES = ["logits", "embeddings"]
+
+# The dtype the encoders and MLPs are autocast to for each precision
+INFERENCE_PRECISIONS = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16
+}
+
+# The dimension of each input and output which
+# changes with the size of the bodies
+DYNAMIC_AXES = {
+    "face_features": { 0: "num_faces" },
+    "face_point_grids": { 0: "num_faces" },
+    "edge_features": { 0: "num_edges" },
+    "edge_point_grids": { 0: "num_edges" },
+    "coedge_features": { 0: "num_coedges" },
+    "coedge_point_grids": { 0: "num_coedges" },
+    "face_kernel_tensor": { 0: "num_coedges" },
+    "edge_kernel_tensor": { 0: "num_coedges" },
+    "coedge_kernel_tensor": { 0: "num_coedges" },
+    "coedges_of_edges": { 0: "num_edges" },
+    "coedge_to_face": { 0: "num_coedges" },
+    "logits": { 0: "num_faces" },
+    "embeddings": { 0: "num_faces" }
+}
+
+# The ONNX ScatterElements reduction for each scatter_reduce()
+# reduction used by the model
+SCATTER_REDUCTIONS = {
+    "sum": "add",
+    "prod": "mul",
+    "amax": "max",
+    "amin": "min"
+}
+
+# The first opset with the reduction attribute of ScatterElements
+# for max and min
+SCATTER_REDUCE_OPSET = 18
+
+
+@symbolic_helper.parse_args("v", "i", "v", "v", "s", "b")
+def scatter_reduce_symbolic(g, self, dim, index, src, reduce, include_self):
+    """
+    Export scatter_reduce() as a single ScatterElements.  The built in 
+    symbolic puts the scatter inside an If, for inputs with no 
+    dimensions, which hides the rank of the result from the ONNX 
+    shape inference.  The segment max only scatters into matrices
+    """
+    assert include_self, "ONNX ScatterElements always includes the input in the reduction"
+    assert reduce in SCATTER_REDUCTIONS, f"No ONNX reduction for {reduce}"
+    return g.op("ScatterElements", self, index, src, axis_i=dim, reduction_s=SCATTER_REDUCTIONS[reduce])
+
+
+class BRepNetPredictor(nn.Module):
+    """
+    Wraps a trained BRepNet for inference
+    """
+
+    def __init__(self, model, precision="float32"):
+        """
+        The precision is one of the keys of INFERENCE_PRECISIONS
+        """
+        super(BRepNetPredictor, self).__init__()
+        assert precision in INFERENCE_PRECISIONS, f"Unknown precision {precision}"
+        self.precision = precision
+        self.model = model
+
+        grid_options = {
+            "face_point_grids": model.opts.use_face_grids,
+            "edge_point_grids": model.opts.use_edge_grids,
+            "coedge_point_grids": model.opts.use_coedge_grids
+        }
+        self.input_names = [ name for name in INPUT_NAMES if grid_options.get(name, True) ]
+
+
+    def input_tensors(self, batch):
+        """
+        Get the tuple of tensors forward() needs from a collated batch
+        """
+        for name in self.input_names:
+            assert name in batch, f"The batch has no {name}"
+        return tuple(batch[name] for name in self.input_names)
+
+
+    @contextmanager
+    def inference_settings(self):
+        """
+        Put the model in eval mode with the segmented pooling, and
+        put back the settings it had before afterwards
+        """
+        layers = list(self.model.layers) + [self.model.output_layer]
+        training = [ (module, module.training) for module in self.model.modules() ]
+        face_pooling = [ layer.face_pooling for layer in layers ]
+        self.model.eval()
+        for layer in layers:
+            layer.face_pooling = "segmented"
+        try:
+            yield
+        finally:
+            for module, was_training in training:
+                module.training = was_training
+            for layer, pooling in zip(layers, face_pooling):
+                layer.face_pooling = pooling
+
+
+    def forward(self, *inputs):
+        """
+        Find the logits and embeddings for each face from the
+        tensors in the order of self.input_names
+        """
+        tensors = dict(zip(self.input_names, inputs))
+        Fc = tensors["coedge_to_face"]
+
+        # The padded index tensors are not used by the segmented pooling.
+        # Only the width of Cf is needed, to find which faces were padded
+        Cf = Fc.new_zeros((0, MAX_COEDGES_PER_FACE))
+        Csf = Fc.new_zeros((0,))
+        Csf_offsets = Fc.new_zeros((1,))
+        with self.inference_settings():
+            with torch.autocast(
+                    Fc.device.type, 
+                    dtype=INFERENCE_PRECISIONS[self.precision], 
+                    enabled=self.precision != "float32"
+                ):
+                embeddings = self.model.create_face_embeddings(
+                    tensors["face_features"],
+                    tensors.get("face_point_grids"),
+                    tensors["edge_features"],
+                    tensors.get("edge_point_grids"),
+                    tensors["coedge_features"],
+                    tensors.get("coedge_point_grids"),
+                    tensors["face_kernel_tensor"],
+                    tensors["edge_kernel_tensor"],
+                    tensors["coedge_kernel_tensor"],
+                    tensors["coedges_of_edges"],
+                    Cf,
+                    Csf,
+                    Csf_offsets,
+                    Fc
+                )
+            # The classification layer stays in float32
+            logits = self.model.classification_layer(embeddings)
+        return logits, embeddings
+
+
+    def predict(self, batch):
+        """
+        Find the logits and embeddings for the faces in a collated
+        batch.  The faces are in the order of the batch
+        """
+        with torch.no_grad():
+            logits, embeddings = self(*self.input_tensors(batch))
+        return { "logits": logits, "embeddings": embeddings }
+
+
+    def predict_body(self, body_data):
+        """
+        Find the logits and embeddings for one body from the
+        BRepNetDataset.  The faces are in their original order
+        """
+        output = self.predict(brepnet_collate_fn([ body_data ]))
+        old_to_new_face_indices = body_data["old_to_new_face_indices"]
+        return { key: value[old_to_new_face_indices] for key, value in output.items() }
+
+
+    def trace(self, example_batch):
+        """
+        Trace the predictor with TorchScript.  The traced module takes
+        the tensors from input_tensors() and can be saved with
+        torch.jit.save() and loaded without this code
+        """
+        with torch.no_grad():
+            return torch.jit.trace(self, self.input_tensors(example_batch))
+
+
+    def export_onnx(self, example_batch, pathname, opset_version=18):
+        """
+        Export the predictor to an ONNX file with dynamic numbers of
+        faces, edges and coedges.  This needs the onnx package.
+        The model is exported with the TorchScript based exporter,
+        which takes the dynamic axes by name.  Inputs the model does
+        not read, like the features of a model which only uses the 
+        point grids, are left out of the ONNX model
+        """
+        assert opset_version >= SCATTER_REDUCE_OPSET, f"The segment max needs opset {SCATTER_REDUCE_OPSET} or later"
+        torch.onnx.register_custom_op_symbolic("aten::scatter_reduce", scatter_reduce_symbolic, SCATTER_REDUCE_OPSET)
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    self,
+                    self.input_tensors(example_batch),
+                    str(pathname),
+                    input_names=self.input_names,
+                    output_names=OUTPUT_NAMES,
+                    dynamic_axes={ name: DYNAMIC_AXES[name] for name in self.input_names + OUTPUT_NAMES },
+                    opset_version=opset_version,
+                    dynamo=False
+                )
+        finally:
+            torch.onnx.unregister_custom_op_symbolic("aten::scatter_reduce", SCATTER_REDUCE_OPSET)
@@ -0,0 +1,148 @@
+"""
+Post-training int8 quantization of a trained BRepNet for CPU inference.
+
+Two kinds of quantization are used
+
+    - The UV-Net surface and curve encoders are quantized statically.
+      Each convolution and linear layer is fused with the batch norm
+      which follows it, and the ranges of the activations are found
+      by running the model over some calibration batches.  The
+      encoders then run entirely in int8.
+
+    - The linear layers in the MLP of each BRepNet layer and the
+      classification layer are quantized dynamically.  The weights are
+      stored in int8 and the activations are quantized on the fly, so
+      no calibration is needed.
+
+The max pooling and everything else between the layers stays in float32.
+
+    quantized_model = quantize_model(model, calibration_batches)
+    save_quantized_model(quantized_model, "brepnet_int8.pt")
+    quantized_model = load_quantized_model("brepnet_int8.pt")
+
+The quantized model is a BRepNet and can be used with the
+BRepNetPredictor.  See eval/quantize_model.py for a script which
+quantizes a checkpoint and compares it with the float model.
+"""
+import argparse
+import copy
+import warnings
+import torch
+import torch.nn as nn
+from torch.ao.quantization import (
+    QuantWrapper,
+    convert,
+    fuse_modules,
+    get_default_qconfig,
+    prepare,
+    quantize_dynamic
+)
+
+from models.brepnet import BRepNet
+from models.brepnet_predictor import BRepNetPredictor
+
+# Each encoder has conv1, conv2, conv3 and fc, which are all
+# Sequential(conv or linear, batch norm, LeakyReLU)
+ENCODER_BLOCKS = ["conv1", "conv2", "conv3", "fc"]
+
+ENCODER_NAMES = ["surface_encoder", "curve_encoder"]
+
+
+def find_encoder_names(model):
+    return [ name for name in ENCODER_NAMES if hasattr(model, name) ]
+
+
+def prepare_static_quantization(model):
+    """
+    Fuse the layers of the encoders and wrap them with quantize and
+    dequantize stubs.  Observers are added to record the ranges
+    of the activations when the model is run
+    """
+    qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    for name in find_encoder_names(model):
+        encoder = getattr(model, name)
+        fuse_modules(encoder, [ [f"{block}.0", f"{block}.1"] for block in ENCODER_BLOCKS ], inplace=True)
+        wrapped_encoder = QuantWrapper(encoder)
+        wrapped_encoder.qconfig = qconfig
+        prepare(wrapped_encoder, inplace=True)
+        setattr(model, name, wrapped_encoder)
+
+
+def convert_static_quantization(model):
+    """
+    Replace the observed encoders with the int8 modules
+    """
+    for name in find_encoder_names(model):
+        convert(getattr(model, name), inplace=True)
+
+
+def quantize_linear_layers(model):
+    """
+    Quantize the linear layers of the BRepNet layers and the
+    classification layer dynamically
+    """
+    for layer in list(model.layers) + [model.output_layer]:
+        # gather_sum reads the weights of the first linear layer
+        # directly.  The concat mode gives the same result
+        if layer.psi_mode == "gather_sum":
+            layer.psi_mode = "concat"
+        quantize_dynamic(layer, { nn.Linear }, dtype=torch.qint8, inplace=True)
+    model.classification_layer = quantize_dynamic(
+        nn.Sequential(model.classification_layer),
+        { nn.Linear },
+        dtype=torch.qint8
+    )[0]
+
+
+def quantize_model(model, calibration_batches):
+    """
+    Make an int8 copy of the model.  The calibration batches are
+    collated batches from the training set used to find the ranges
+    of the activations in the encoders
+    """
+    quantized_model = copy.deepcopy(model)
+    quantized_model.eval()
+    prepare_static_quantization(quantized_model)
+
+    # Run the model to record the activation ranges
+    predictor = BRepNetPredictor(quantized_model)
+    for batch in calibration_batches:
+        predictor.predict(batch)
+
+    convert_static_quantization(quantized_model)
+    quantize_linear_layers(quantized_model)
+    return quantized_model
+
+
+def save_quantized_model(quantized_model, pathname):
+    """
+    Save the options and quantized weights.  The model is rebuilt
+    from the options when it is loaded
+    """
+    torch.save(
+        {
+            "opts": vars(quantized_model.opts),
+            "state_dict": quantized_model.state_dict()
+        },
+        pathname
+    )
+
+
+def load_quantized_model(pathname):
+    """
+    Load a model saved with save_quantized_model()
+    """
+    checkpoint = torch.load(pathname, weights_only=False)
+    model = BRepNet(argparse.Namespace(**checkpoint["opts"]))
+    model.eval()
+
+    # Build the same quantized modules.  The scales and zero points
+    # come from the state dict rather than calibration, so the
+    # warnings about the observers not being run can be ignored
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="must run observer")
+        prepare_static_quantization(model)
+        convert_static_quantization(model)
+    quantize_linear_layers(model)
+    model.load_state_dict(checkpoint["state_dict"])
+    return model
@@ -0,0 +1,75 @@
+"""
+Element-wise max pooling of the rows of a tensor into segments.
+
+BRepNet pools the coedge feature vectors onto their parent edges and
+faces.  Given the index of the segment each row belongs to, the
+segment_max() function finds the element-wise max of the rows of each
+segment with a single scatter, so no padded index tensor is needed
+and the number of rows in each segment can be anything.
+
+    # Hf.size() = [ num_faces x num_filters ]
+    Hf = segment_max(Zf, coedge_to_face, num_faces)
+
+Where several rows share the maximum value the gradient is split
+evenly between them, as torch.segment_reduce() does.
+
+When no gradient is needed the scatter is called directly rather than
+through the autograd function, so the op can be traced with
+torch.jit.trace() and exported to ONNX.
+"""
+import torch
+
+
+def find_segment_max(Z, segment_ids, num_segments, initial):
+    """
+    The forward pass of segment_max() without autograd
+    """
+    index = segment_ids.unsqueeze(1).expand_as(Z)
+    if initial is None:
+        H = torch.zeros((num_segments, Z.size(1)), dtype=Z.dtype, device=Z.device)
+        return H.scatter_reduce_(0, index, Z, "amax", include_self=False)
+    H = initial.to(Z.dtype).unsqueeze(1).expand(num_segments, Z.size(1)).clone()
+    return H.scatter_reduce_(0, index, Z, "amax", include_self=True)
+
+
+class SegmentMax(torch.autograd.Function):
+    """
+    The max of the rows in each segment.  The backward pass only
+    needs the input and output, so no argmax tensor is kept
+    """
+
+    @staticmethod
+    def forward(ctx, Z, segment_ids, num_segments, initial):
+        H = find_segment_max(Z, segment_ids, num_segments, initial)
+        ctx.save_for_backward(Z, segment_ids, H, initial)
+        return H
+
+
+    @staticmethod
+    def backward(ctx, grad_H):
+        Z, segment_ids, H, initial = ctx.saved_tensors
+        is_max = Z == H.index_select(0, segment_ids)
+
+        # Count the rows which share the max in each segment.  The
+        # initial value takes part in the max but gets no gradient
+        num_max = torch.zeros_like(H).index_add_(0, segment_ids, is_max.to(H.dtype))
+        if initial is not None:
+            num_max += H == initial.to(H.dtype).unsqueeze(1)
+        grad_Z = is_max * (grad_H / num_max).index_select(0, segment_ids)
+        return grad_Z, None, None, None
+
+
+def segment_max(Z, segment_ids, num_segments, initial=None):
+    """
+    Find the element-wise max of the rows of Z in each segment.
+
+    Z.size()           = [ num_rows x num_filters ]
+    segment_ids.size() = [ num_rows ]
+
+    The result has size [ num_segments x num_filters ].  If initial,
+    with size [ num_segments ], is given then it is included in the
+    max for each segment.  Otherwise segments with no rows are zero
+    """
+    if not (torch.is_grad_enabled() and Z.requires_grad):
+        return find_segment_max(Z, segment_ids, num_segments, initial)
+    return SegmentMax.apply(Z, segment_ids, num_segments, initial)
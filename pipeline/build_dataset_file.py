@@ -7,6 +7,14 @@ split out training data only.
 
 The train_test.json file is passed in to ensure the official test set
 is also held out.
+
+If the folder containing the seg files is given then the labels for 
+all the bodies are also packed into a single label store file next to
+the dataset file.  See dataloaders/label_store.py
+
+The number of faces, edges and coedges in each body is written to a
+size index next to the dataset file, so the batch samplers don't need
+to load every body.  See dataloaders/body_size_index.py
 """
 
 import argparse
@@ -19,6 +27,8 @@ import tqdm
 
 import utils.data_utils as data_utils
 from pipeline.running_stats import RunningStats
+from dataloaders.label_store import build_label_store_for_dataset
+from dataloaders.body_size_index import build_body_size_index_for_dataset
 
 def stats_to_json(stats):
     data = []
@@ -130,7 +140,8 @@ def build_dataset_file(
         dataset_file, 
         validation_split, 
         train_test_file=None,
-        test_split=None
+        test_split=None,
+        label_dir=None
     ):
     if train_test_file is not None:
         train_val_files, test_files = get_train_test_lists_from_file(train_test_file)
@@ -151,6 +162,13 @@ def build_dataset_file(
         "feature_standardization": standardization_data
     }
     data_utils.save_json_data(dataset_file, data)
+
+    if label_dir is not None:
+        label_store_file = build_label_store_for_dataset(dataset_file, label_dir)
+        print(f"Labels written to {label_store_file}")
+
+    size_index_file = build_body_size_index_for_dataset(dataset_file, npz_folder)
+    print(f"Body sizes written to {size_index_file}")
     print("Completed pipeline/build_dataset_file.py")
 
 
@@ -166,6 +184,7 @@ if __name__ == '__main__':
         help="The fraction of examples from the available training file for the validation set"
     )
     parser.add_argument("--dataset_file", type=str, required=True, help="Pathname to save the generated dataset file")
+    parser.add_argument("--label_dir", type=str, help="Path to the folder containing the seg files.  If given the labels are packed into a single file next to the dataset file")
     args = parser.parse_args()
 
     npz_folder = Path(args.npz_folder)
@@ -186,4 +205,11 @@ if __name__ == '__main__':
     dataset_file = Path(args.dataset_file)
     
 
-    build_dataset_file(npz_folder, dataset_file,  args.validation_split, train_test_file, test_split)
\ No newline at end of file
+    label_dir = None
+    if args.label_dir is not None:
+        label_dir = Path(args.label_dir)
+        if not label_dir.exists():
+            print("The label dir does not exist")
+            sys.exit(1)
+
+    build_dataset_file(npz_folder, dataset_file,  args.validation_split, train_test_file, test_split, label_dir)
\ No newline at end of file
@@ -45,12 +45,16 @@ import utils.scale_utils as scale_utils
 from utils.create_occwl_from_occ import create_occwl
 
 class BRepNetExtractor:
-    def __init__(self, step_file, output_dir, feature_schema, scale_body=True):
+    def __init__(self, step_file, output_dir, feature_schema, scale_body=True, grid_dtype="float64"):
         self.step_file = step_file
         self.output_dir = output_dir
         self.feature_schema = feature_schema
         self.scale_body = scale_body
 
+        # The dtype used to save the face and coedge point grids.
+        # These make up most of the size of the npz files
+        self.grid_dtype = grid_dtype
+
 
     def process(self):
         """
@@ -107,9 +111,9 @@ class BRepNetExtractor:
         np.savez(
             output_pathname, 
             face_features=face_features,
-            face_point_grids=face_point_grids,
+            face_point_grids=face_point_grids.astype(self.grid_dtype),
             edge_features=edge_features,
-            coedge_point_grids=coedge_point_grids,
+            coedge_point_grids=coedge_point_grids.astype(self.grid_dtype),
             coedge_features=coedge_features,
             coedge_lcs=coedge_lcs,
             coedge_scale_factors=coedge_scale_factors,
@@ -885,12 +889,12 @@ def crosscheck_faces_and_seg_file(file, seg_dir):
     # any extra checking
     return True
 
-def extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir):
+def extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir, grid_dtype="float64"):
     if not check_face_indices(file, mesh_dir):
         return
     if not crosscheck_faces_and_seg_file(file, seg_dir):
         return
-    extractor = BRepNetExtractor(file, output_path, feature_schema)
+    extractor = BRepNetExtractor(file, output_path, feature_schema, grid_dtype=grid_dtype)
     extractor.process()
 
 def run_worker(worker_args):
@@ -899,7 +903,8 @@ def run_worker(worker_args):
     feature_schema = worker_args[2]
     mesh_dir = worker_args[3]
     seg_dir = worker_args[4]
-    extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir)
+    grid_dtype = worker_args[5]
+    extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir, grid_dtype)
 
 def filter_out_files_which_are_already_converted(files, output_path):
     files_to_convert = []
@@ -917,7 +922,8 @@ def extract_brepnet_data_from_step(
         seg_dir=None,
         feature_list_path=None,
         force_regeneration=True,
-        num_workers=1
+        num_workers=1,
+        grid_dtype="float64"
     ):
     parent_folder = Path(__file__).parent.parent
     if feature_list_path is None:
@@ -932,12 +938,12 @@ def extract_brepnet_data_from_step(
 
     use_many_threads = num_workers > 1
     if use_many_threads:
-        worker_args = [(f, output_path, feature_schema, mesh_dir, seg_dir) for f in files]
+        worker_args = [(f, output_path, feature_schema, mesh_dir, seg_dir, grid_dtype) for f in files]
         with ProcessPoolExecutor(max_workers=num_workers) as executor:
             list(tqdm(executor.map(run_worker, worker_args), total=len(worker_args)))
     else:
         for file in tqdm(files):
-            extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir)
+            extract_brepnet_features(file, output_path, feature_schema, mesh_dir, seg_dir, grid_dtype)
 
     gc.collect()
     print("Completed pipeline/extract_feature_data_from_step.py")
@@ -959,6 +965,13 @@ if __name__ == '__main__':
         type=str,  
         help="Optionally provide a directory containing segmentation labels seg files."
     )
+    parser.add_argument(
+        "--grid_dtype", 
+        type=str,  
+        default="float64",
+        choices=["float64", "float32", "float16"],
+        help="The dtype used to save the face and coedge point grids.  float16 makes the npz files much smaller"
+    )
     args = parser.parse_args()
 
     step_path = Path(args.step_path)
@@ -978,4 +991,12 @@ if __name__ == '__main__':
     if args.feature_list is not None:
         feature_list_path = Path(args.feature_list)
 
-    extract_brepnet_data_from_step(step_path, output_path, mesh_dir, seg_dir, feature_list_path, args.num_workers)
\ No newline at end of file
+    extract_brepnet_data_from_step(
+        step_path, 
+        output_path, 
+        mesh_dir, 
+        seg_dir, 
+        feature_list_path, 
+        num_workers=args.num_workers,
+        grid_dtype=args.grid_dtype
+    )
\ No newline at end of file
@@ -87,11 +87,13 @@ if __name__ == '__main__':
     # This script created train/validation split.   The held out
     # test set is defined by the train_test_file.
     # It also computes the feature standardization for the dataset
+    # and packs the labels into a single file
     build_dataset_file(
         processed_dir, 
         dataset_file,  
         args.validation_split, 
-        train_test_file
+        train_test_file,
+        label_dir=seg_dir
     )
 
     if not dataset_file.exists():
@@ -1,9 +1,16 @@
 # System
+import argparse
+import numpy as np
 from pathlib import Path
 import shutil
 import tempfile
 import unittest
 
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from models.brepnet import BRepNet
+from pipeline.extract_brepnet_data_from_json import BRepNetJsonExtractor
 import utils.data_utils as data_utils
 
 class TestBase(unittest.TestCase):
@@ -19,6 +26,9 @@ class TestBase(unittest.TestCase):
     def data_dir(self):
         return Path(__file__).parent / "test_data"
 
+    def equivalent_dataloaders_dir(self):
+        return self.data_dir() / "equivalent_dataloaders"
+
     def create_dummy_options(self, dataset_file, dataset_dir, input_features):
         class DummyOptions: pass
         opts = DummyOptions()
@@ -27,6 +37,12 @@ class TestBase(unittest.TestCase):
         opts.dataset_file =  dataset_file
         opts.dataset_dir =  dataset_dir
         opts.label_dir = self.label_dir()
+        opts.validate_standardization = False
+        opts.cache_format = "pickle"
+        opts.require_cache = False
+        opts.memory_cache_gb = 0.0
+        opts.grid_dtype = "float32"
+        opts.feature_dtype = "float32"
         return opts
 
 
@@ -50,4 +66,105 @@ class TestBase(unittest.TestCase):
         self.remove_folder(cache_dir)
 
     def remove_folder(self, dir):
-        shutil.rmtree(dir, ignore_errors=True)
\ No newline at end of file
+        shutil.rmtree(dir, ignore_errors=True)
+
+    def generate_npz_files_from_json(self, dataset_pathname, data_dir):
+        # Load the dataset file
+        dataset = data_utils.load_json_data(dataset_pathname)
+        train_filestems = dataset["training_set"]
+
+        working_dir = self.working_dir()
+        feature_schema = data_utils.load_json_data(data_dir / "original_feature_list.json")
+        for file_stem in train_filestems:
+            npz_pathname = working_dir / (file_stem + ".npz")
+            if not npz_pathname.exists():
+                self.extract_brepnet_data(file_stem, data_dir, working_dir, feature_schema)
+
+                # We should now have generated the npz file
+                self.assertTrue(npz_pathname.exists())
+
+            seg_file = working_dir / (file_stem + ".seg")
+            if not seg_file.exists():
+                label_file = data_dir / (file_stem + "_labels.json")
+                self.make_labels_from_json(label_file, seg_file)
+
+    def extract_brepnet_data(self, file_stem, data_dir, output_path, feature_schema):
+        topology_file = data_dir / (file_stem + "_topology.json")
+        topology = data_utils.load_json_data(topology_file)["topology"]
+        features_pathname = data_dir / (file_stem + "_features.json")
+        features = data_utils.load_json_data(features_pathname)["feature_data"]
+        extractor = BRepNetJsonExtractor(topology, features, feature_schema)
+        data = extractor.process()
+        output_pathname = output_path / f"{file_stem}.npz"
+        data_utils.save_npz_data_without_uvnet_features(output_pathname, data)
+
+
+    def make_labels_from_json(self, label_file, output_file):
+        labels = data_utils.load_json_data(label_file)
+        num_faces = len(labels["face_labels"])
+        self.assertGreater(num_faces, 0)
+        labels_arr = np.zeros((num_faces), dtype=np.int64)
+
+        for face_index, face_labels in enumerate(labels["face_labels"]):
+            for label_index, label_obj in enumerate(face_labels["labels"]):
+                label_value = label_obj["label_value"]
+                if label_value > 0.5:
+                    labels_arr[face_index] = label_index
+        np.savetxt(output_file, labels_arr, fmt='%i', delimiter="\n")
+
+
+    def create_json_dataset(self, dataset_file_name="dummy_new_dataset_with_standardization.json"):
+        """
+        Create a BRepNetDataset from the json data in the equivalent_dataloaders
+        folder.  This doesn't need Open Cascade
+        """
+        self.remove_folder(self.working_dir())
+        data_dir = self.equivalent_dataloaders_dir()
+        dataset_file = data_dir / dataset_file_name
+        self.generate_npz_files_from_json(dataset_file, data_dir)
+        opts = self.create_dummy_options(
+            dataset_file, 
+            self.working_dir(), 
+            data_dir / "original_feature_list.json"
+        )
+        return BRepNetDataset(opts, "training_set")
+
+
+    def create_model(self, dataset, extra_args=[]):
+        """
+        Create a BRepNet with random weights for the dataset from
+        create_json_dataset().  The point grids in the json data don't
+        match the encoders, so only the features are used
+        """
+        parser = argparse.ArgumentParser()
+        parser = BRepNet.add_model_specific_args(parser)
+        opts = parser.parse_args([
+            "--dataset_file", str(dataset.opts.dataset_file),
+            "--dataset_dir", str(dataset.opts.dataset_dir),
+            "--label_dir", str(dataset.opts.label_dir),
+            "--input_features", str(dataset.opts.input_features),
+            "--kernel", str(dataset.opts.kernel),
+            "--use_face_grids", "0",
+            "--use_coedge_grids", "0",
+            "--use_face_features", "1",
+            "--use_edge_features", "1",
+            "--use_coedge_features", "1"
+        ] + extra_args)
+        torch.manual_seed(0)
+        return BRepNet(opts)
+
+
+    def create_synthetic_model(self, extra_args=[]):
+        """
+        Create a BRepNet with random weights for the batches from
+        make_synthetic_batch() in benchmarks/collate_benchmark.py
+        """
+        parser = argparse.ArgumentParser()
+        parser = BRepNet.add_model_specific_args(parser)
+        opts = parser.parse_args([
+            "--dataset_file", "",
+            "--dataset_dir", ".",
+            "--use_edge_grids", "1"
+        ] + extra_args)
+        torch.manual_seed(0)
+        return BRepNet(opts)
@@ -0,0 +1,94 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
+from dataloaders.body_memory_cache import BodyMemoryCache, num_bytes_in_body
+
+from tests.test_base import TestBase
+
+class TestBodyMemoryCache(TestBase):
+
+    def make_body(self, num_bytes):
+        return {
+            "face_features": torch.zeros(num_bytes, dtype=torch.uint8),
+            "coedges_of_big_faces": [],
+            "file_stem": "body"
+        }
+
+
+    def test_lru_eviction(self):
+        cache = BodyMemoryCache(max_bytes=300)
+        self.assertTrue(cache.put(0, self.make_body(100)))
+        self.assertTrue(cache.put(1, self.make_body(100)))
+        self.assertTrue(cache.put(2, self.make_body(100)))
+        self.assertEqual(cache.num_bytes, 300)
+
+        # Body 0 becomes the most recently used, so body 1
+        # is evicted when body 3 is added
+        self.assertIsNotNone(cache.get(0))
+        self.assertTrue(cache.put(3, self.make_body(100)))
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(0))
+        self.assertIsNotNone(cache.get(3))
+
+        # Bodies bigger than the whole budget are never cached
+        self.assertFalse(cache.put(4, self.make_body(301)))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["num_bodies"], 3)
+        self.assertLessEqual(stats["num_bytes"], stats["max_bytes"])
+        self.assertTrue(cache.entries[0][0]["face_features"].is_shared())
+
+
+    def test_dataset_with_memory_cache(self):
+        dataset = self.create_json_dataset()
+        opts = dataset.opts
+        opts.memory_cache_gb = 1.0
+        dataset = BRepNetDataset(opts, "training_set")
+
+        for i in range(len(dataset)):
+            dataset[i]
+        stats = dataset.memory_cache.stats()
+        self.assertEqual(stats["misses"], len(dataset))
+        self.assertEqual(stats["num_bodies"], len(dataset))
+
+        for i in range(len(dataset)):
+            body = dataset[i]
+            self.assertTrue(torch.equal(body["face_features"], dataset.load_body(i)["face_features"]))
+        self.assertEqual(dataset.memory_cache.stats()["hits"], len(dataset))
+
+
+    def test_shared_with_workers(self):
+        dataset = self.create_json_dataset()
+        opts = dataset.opts
+        body_bytes = num_bytes_in_body(dataset[0])
+        opts.memory_cache_gb = 10*body_bytes/(1024**3)
+        dataset = BRepNetDataset(opts, "training_set")
+        dataset.prefill_memory_cache()
+        num_cached = len(dataset.memory_cache.entries)
+        self.assertGreater(num_cached, 0)
+        self.assertLess(num_cached, len(dataset))
+
+        # The counters are updated in the worker processes and read
+        # here in the main process
+        dataloader = torch.utils.data.DataLoader(
+            dataset,
+            collate_fn=brepnet_collate_fn,
+            batch_size=4,
+            num_workers=2
+        )
+        for batch in dataloader:
+            pass
+        stats = dataset.memory_cache.stats()
+        self.assertEqual(stats["hits"], num_cached)
+        self.assertEqual(stats["misses"], len(dataset)-num_cached)
+        self.assertEqual(len(dataset.memory_cache.entries), num_cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
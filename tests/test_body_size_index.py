@@ -0,0 +1,77 @@
+# System
+import unittest
+
+import numpy as np
+import shutil
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.body_size_index import BODY_SIZE_KEYS, build_body_size_index_for_dataset
+from dataloaders.max_num_faces_sampler import MaxNumFacesSampler
+
+from tests.test_base import TestBase
+
+class TestBodySizeIndex(TestBase):
+
+    def create_dataset_with_size_index(self):
+        dataset = self.create_json_dataset()
+
+        # Write the size index next to a copy of the dataset file
+        # in the working dir
+        dataset_file = self.working_dir() / "dataset.json"
+        shutil.copyfile(dataset.opts.dataset_file, dataset_file)
+        dataset.opts.dataset_file = dataset_file
+        build_body_size_index_for_dataset(dataset_file, dataset.opts.dataset_dir)
+        return BRepNetDataset(dataset.opts, "training_set")
+
+
+    def test_sizes_match_bodies(self):
+        dataset = self.create_dataset_with_size_index()
+        self.assertIsNotNone(dataset.body_size_index)
+        sizes = dataset.find_body_sizes()
+        for idx in range(len(dataset)):
+            body = dataset.load_body(idx)
+            self.assertEqual(sizes["num_faces"][idx], body["face_features"].size(0))
+            self.assertEqual(sizes["num_edges"][idx], body["edge_features"].size(0))
+            self.assertEqual(sizes["num_coedges"][idx], body["coedge_features"].size(0))
+            expected_grid_bytes = 4*(body["face_point_grids"].numel() + body["coedge_point_grids"].numel())
+            self.assertEqual(sizes["grid_bytes"][idx], expected_grid_bytes)
+
+            # A face has more than 30 coedges only if it is a big face
+            num_big_faces = body["big_face_coedge_offsets"].size(0) - 1
+            self.assertEqual(sizes["max_coedges_per_face"][idx] > 30, num_big_faces > 0)
+
+
+    def test_sampler_does_not_load_bodies(self):
+        dataset = self.create_dataset_with_size_index()
+        sampler = MaxNumFacesSampler(dataset, 10000)
+        self.assertEqual(sampler.num_faces_per_brep, dataset.find_body_sizes()["num_faces"].tolist())
+        for file_stem in dataset.bodies:
+            self.assertFalse(dataset.cache_manifest.contains(file_stem))
+
+
+    def test_fall_back_to_npz_files(self):
+        dataset = self.create_dataset_with_size_index()
+        expected_sizes = dataset.find_body_sizes()
+
+        # Bodies missing from the index are read from the npz files
+        del dataset.body_size_index.stem_to_index[dataset.bodies[0]]
+        sizes = dataset.find_body_sizes()
+        for key in BODY_SIZE_KEYS:
+            self.assertTrue(np.array_equal(sizes[key], expected_sizes[key]))
+
+        # An index built from a different npz folder is not used
+        opts = dataset.opts
+        other_npz_dir = self.working_dir() / "other_npz"
+        other_npz_dir.mkdir()
+        for npz_file in self.working_dir().glob("*.npz"):
+            shutil.copy(npz_file, other_npz_dir)
+        opts.dataset_dir = other_npz_dir
+        dataset = BRepNetDataset(opts, "training_set")
+        self.assertIsNone(dataset.body_size_index)
+        sizes = dataset.find_body_sizes()
+        for key in BODY_SIZE_KEYS:
+            self.assertTrue(np.array_equal(sizes[key], expected_sizes[key]))
+
+
+if __name__ == '__main__':
+    unittest.main()
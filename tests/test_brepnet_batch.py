@@ -0,0 +1,77 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.collate_benchmark import legacy_brepnet_collate_fn, legacy_batch_in_csr_form, make_legacy_body
+from dataloaders.brepnet_batch import BRepNetBatch
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, OPTIONAL_FIELDS
+
+from tests.test_base import TestBase
+
+class TestBRepNetBatch(TestBase):
+
+    def create_batch(self):
+        dataset = self.create_json_dataset()
+        dataset = BRepNetDataset(dataset.opts, "training_set", fields=OPTIONAL_FIELDS)
+        data_list = [ dataset[i] for i in range(len(dataset)) ]
+        legacy_batch = legacy_brepnet_collate_fn([ make_legacy_body(data) for data in data_list ])
+        return brepnet_collate_fn(data_list), legacy_batch_in_csr_form(legacy_batch)
+
+
+    def check_same_as_legacy(self, batch, legacy_batch):
+        self.assertEqual(set(batch.keys()), set(legacy_batch.keys()))
+        for key in [
+                "face_features",
+                "face_point_grids",
+                "face_kernel_tensor",
+                "coedges_of_small_faces",
+                "coedges_of_big_faces",
+                "big_face_coedge_offsets",
+                "labels"
+            ]:
+            self.assertTrue(torch.equal(batch[key].cpu(), legacy_batch[key]))
+        for split_solid, legacy_split_solid in zip(batch["split_batch"], legacy_batch["split_batch"]):
+            for key in ["face_indices", "edge_indices", "coedge_indices"]:
+                self.assertTrue(torch.equal(split_solid[key].cpu(), legacy_split_solid[key]))
+        self.assertEqual(batch["file_stems"], legacy_batch["file_stems"])
+
+
+    def test_dict_interface(self):
+        batch, legacy_batch = self.create_batch()
+        self.assertIsInstance(batch, BRepNetBatch)
+        self.assertIn("face_point_grids", batch)
+        self.assertNotIn("not_a_key", batch)
+        self.assertIsNone(batch.get("not_a_key"))
+        with self.assertRaises(KeyError):
+            batch["not_a_key"]
+        self.check_same_as_legacy(batch, legacy_batch)
+
+
+    def test_to_device(self):
+        batch, legacy_batch = self.create_batch()
+        moved = batch.to(torch.device("cpu"), non_blocking=False)
+        self.assertIsInstance(moved, BRepNetBatch)
+        self.check_same_as_legacy(moved, legacy_batch)
+
+        # Converting dtypes goes through the same path
+        doubled = batch.apply(lambda t: t.double() if t.is_floating_point() else t)
+        self.assertEqual(doubled["face_features"].dtype, torch.float64)
+        self.assertEqual(doubled["face_kernel_tensor"].dtype, torch.int64)
+
+
+    @unittest.skipUnless(torch.cuda.is_available(), "Pinned memory needs CUDA")
+    def test_pinned_transfer(self):
+        batch, legacy_batch = self.create_batch()
+        pinned = batch.pin_memory()
+        for key in pinned.tensors:
+            self.assertTrue(pinned[key].is_pinned())
+        self.assertTrue(pinned.face_indices.is_pinned())
+        on_gpu = pinned.to(torch.device("cuda"))
+        torch.cuda.synchronize()
+        self.assertEqual(on_gpu.device.type, "cuda")
+        self.check_same_as_legacy(on_gpu, legacy_batch)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# System
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.build_cache import build_cache
+import utils.data_utils as data_utils
+
+from tests.test_base import TestBase
+
+class TestBuildCache(TestBase):
+
+    def test_build_cache(self):
+        dataset = self.create_json_dataset()
+        opts = dataset.opts
+        opts.require_cache = True
+        dataset = BRepNetDataset(opts, "training_set")
+
+        # Nothing is cached yet, so the dataset must refuse to
+        # build the body lazily
+        with self.assertRaises(AssertionError):
+            dataset[0]
+
+        num_workers = 2
+        stats = build_cache(opts, ["training_set", "validation_set"], num_workers)
+        self.assertNotIn("validation_set", stats)
+        self.assertEqual(stats["training_set"]["num_built"], len(dataset))
+        self.assertEqual(len(stats["training_set"]["failures"]), 0)
+
+        # Every body should now be in the cache with no temporary files left behind
+        for i in range(len(dataset)):
+            self.assertTrue(dataset.get_cache_pathname(i).exists())
+        self.assertEqual(len(list(dataset.cache_manifest.config_dir.glob("*.tmp"))), 0)
+
+        body_from_cache = dataset[0]
+        body = dataset.load_body(0)
+        for key, value in body.items():
+            if isinstance(value, torch.Tensor):
+                self.assertTrue(torch.equal(value, body_from_cache[key]))
+
+        # A second build has nothing left to do
+        stats = build_cache(opts, ["training_set"], num_workers)
+        self.assertEqual(stats["training_set"]["num_built"], 0)
+
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pathname = Path(tmpdir) / "data.txt"
+            with data_utils.atomic_write(pathname, "w") as fp:
+                fp.write("first")
+
+            # The file gets the same permissions as one made with open()
+            other_pathname = Path(tmpdir) / "other.txt"
+            other_pathname.write_text("other")
+            self.assertEqual(pathname.stat().st_mode, other_pathname.stat().st_mode)
+
+            # A failed write leaves the old file and no temporary file
+            with self.assertRaises(KeyboardInterrupt):
+                with data_utils.atomic_write(pathname, "w") as fp:
+                    fp.write("second")
+                    raise KeyboardInterrupt()
+            self.assertEqual(pathname.read_text(), "first")
+            self.assertEqual(list(Path(tmpdir).glob("*.tmp")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
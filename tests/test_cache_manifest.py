@@ -0,0 +1,64 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.cache_manifest import find_stale_caches, remove_stale_caches, MANIFEST_FILENAME
+import utils.data_utils as data_utils
+
+from tests.test_base import TestBase
+
+class TestCacheManifest(TestBase):
+
+    def test_cached_stem_index(self):
+        dataset = self.create_json_dataset()
+        self.assertEqual(len(dataset.cache_manifest.cached_stems), 0)
+        self.assertTrue((dataset.cache_manifest.config_dir / MANIFEST_FILENAME).exists())
+        for i in range(3):
+            dataset[i]
+            self.assertTrue(dataset.is_cached(i))
+
+        # A new dataset finds the cached bodies by listing the cache folder once
+        dataset = BRepNetDataset(dataset.opts, "training_set")
+        self.assertEqual(dataset.cache_manifest.cached_stems, set(dataset.bodies[:3]))
+
+
+    def test_standardization_changes_cache(self):
+        dataset = self.create_json_dataset()
+        body = dataset[0]
+
+        # Change the standardization in the dataset file
+        dataset_info = data_utils.load_json_data(dataset.opts.dataset_file)
+        for feature in dataset_info["feature_standardization"]["face_features"]:
+            feature["mean"] += 1.0
+        new_dataset_file = self.working_dir() / "changed_standardization.json"
+        data_utils.save_json_data(new_dataset_file, dataset_info)
+        dataset.opts.dataset_file = new_dataset_file
+        new_dataset = BRepNetDataset(dataset.opts, "training_set")
+
+        self.assertNotEqual(new_dataset.hash_data_for_config(), dataset.hash_data_for_config())
+        self.assertFalse(new_dataset.is_cached(0))
+        new_body = new_dataset[0]
+        self.assertFalse(torch.equal(body["face_features"], new_body["face_features"]))
+
+        # The old cache is stale now and can be removed in one go
+        stale = find_stale_caches(new_dataset.cache_dir, new_dataset.hash_data_for_config())
+        self.assertEqual(stale, [dataset.cache_manifest.config_dir])
+        remove_stale_caches(new_dataset.cache_dir, new_dataset.hash_data_for_config())
+        self.assertFalse(dataset.cache_manifest.config_dir.exists())
+        self.assertTrue(new_dataset.is_cached(0))
+
+
+    def test_mismatched_manifest_invalidates_cache(self):
+        dataset = self.create_json_dataset()
+        dataset[0]
+        manifest_pathname = dataset.cache_manifest.config_dir / MANIFEST_FILENAME
+        manifest_pathname.write_text("{}")
+        dataset = BRepNetDataset(dataset.opts, "training_set")
+        self.assertFalse(dataset.is_cached(0))
+        self.assertEqual(data_utils.load_json_data(manifest_pathname), dataset.cache_config())
+
+
+if __name__ == '__main__':
+    unittest.main()
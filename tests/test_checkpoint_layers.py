@@ -0,0 +1,60 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+
+from tests.test_base import TestBase
+
+class TestCheckpointLayers(TestBase):
+
+    def create_batch(self):
+        kernel_file = str(self.parent_dir() / "kernels/winged_edge.json")
+        return brepnet_collate_fn(make_synthetic_batch(3, kernel_file, max_faces=40))
+
+
+    def find_loss_and_grads(self, model, batch):
+        model.train()
+        model.zero_grad()
+        torch.manual_seed(1)
+        loss = model.brepnet_step(batch, 0, False)["loss"]
+        loss.backward()
+        grads = [ p.grad.clone() for p in model.parameters() if p.grad is not None ]
+        return loss.detach(), grads
+
+
+    def test_gradients_match(self):
+        batch = self.create_batch()
+        model = self.create_synthetic_model(["--oversized_solids", "skip"])
+        expected_loss, expected_grads = self.find_loss_and_grads(model, batch)
+        expected_buffers = [ b.clone() for b in model.buffers() ]
+        for checkpoint_layers, checkpoint_encoders in [(1, 0), (1, 1), (0, 1)]:
+            model = self.create_synthetic_model([
+                "--oversized_solids", "skip",
+                "--checkpoint_layers", str(checkpoint_layers),
+                "--checkpoint_encoders", str(checkpoint_encoders)
+            ])
+            loss, grads = self.find_loss_and_grads(model, batch)
+            self.assertTrue(torch.allclose(loss, expected_loss))
+            self.assertEqual(len(grads), len(expected_grads))
+            for grad, expected_grad in zip(grads, expected_grads):
+                self.assertTrue(torch.allclose(grad, expected_grad, atol=1e-6))
+
+            # The batch norm running statistics are only updated once
+            for buffer, expected_buffer in zip(model.buffers(), expected_buffers):
+                self.assertTrue(torch.allclose(buffer, expected_buffer))
+
+
+    def test_no_grad(self):
+        batch = self.create_batch()
+        model = self.create_synthetic_model(["--checkpoint_layers", "1", "--checkpoint_encoders", "1"])
+        model.eval()
+        with torch.no_grad():
+            loss = model.brepnet_step(batch, 0, False)["loss"]
+        self.assertFalse(loss.requires_grad)
+
+
+if __name__ == '__main__':
+    unittest.main()
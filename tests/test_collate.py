@@ -0,0 +1,80 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.collate_benchmark import (
+    legacy_brepnet_collate_fn,
+    legacy_batch_in_csr_form,
+    make_legacy_body,
+    make_synthetic_batch
+)
+from dataloaders.brepnet_batch import BRepNetBatch
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, OPTIONAL_FIELDS
+
+from tests.test_base import TestBase
+
+class TestCollate(TestBase):
+    """
+    Check the single pass collate function gives bit identical
+    batches to the original two pass implementation
+    """
+
+    def check_batches_identical(self, batch, legacy_batch):
+        if isinstance(batch, BRepNetBatch):
+            batch = batch.to_dict()
+        if isinstance(batch, torch.Tensor):
+            self.assertEqual(batch.dtype, legacy_batch.dtype)
+            self.assertEqual(batch.shape, legacy_batch.shape)
+            self.assertTrue(torch.equal(batch, legacy_batch))
+        elif isinstance(batch, dict):
+            self.assertEqual(set(batch.keys()), set(legacy_batch.keys()))
+            for key in batch:
+                self.check_batches_identical(batch[key], legacy_batch[key])
+        elif isinstance(batch, list):
+            self.assertEqual(len(batch), len(legacy_batch))
+            for item, legacy_item in zip(batch, legacy_batch):
+                self.check_batches_identical(item, legacy_item)
+        else:
+            self.assertEqual(batch, legacy_batch)
+
+
+    def legacy_collate(self, data_list):
+        legacy_batch = legacy_brepnet_collate_fn([ make_legacy_body(data) for data in data_list ])
+        return legacy_batch_in_csr_form(legacy_batch)
+
+
+    def test_dataset_batches(self):
+        dataset = self.create_json_dataset()
+        all_fields_dataset = BRepNetDataset(dataset.opts, "training_set", fields=OPTIONAL_FIELDS)
+        for batch_dataset in [dataset, all_fields_dataset]:
+            bodies = [ batch_dataset[i] for i in range(len(batch_dataset)) ]
+            for batch_size in [1, 3, len(bodies)]:
+                for start in range(0, len(bodies), batch_size):
+                    data_list = bodies[start:start+batch_size]
+                    self.check_batches_identical(
+                        brepnet_collate_fn(data_list),
+                        self.legacy_collate(data_list)
+                    )
+
+
+    def test_synthetic_batches(self):
+        kernel_file = self.parent_dir() / "kernels/winged_edge.json"
+        for big_face_fraction in [0.0, 0.05, 0.5]:
+            for with_grids in [True, False]:
+                data_list = make_synthetic_batch(
+                    20,
+                    kernel_file,
+                    min_faces=1,
+                    max_faces=60,
+                    big_face_fraction=big_face_fraction,
+                    with_grids=with_grids
+                )
+                self.check_batches_identical(
+                    brepnet_collate_fn(data_list),
+                    self.legacy_collate(data_list)
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# System
+import unittest
+
+import numpy as np
+
+from dataloaders.cost_balanced_sampler import CostBalancedBatchSampler, find_kernel_size
+
+import utils.data_utils as data_utils
+from tests.test_base import TestBase
+
+class TestCostBalancedSampler(TestBase):
+
+    def make_body_sizes(self, num_bodies, seed=0):
+        rng = np.random.default_rng(seed)
+        num_faces = rng.integers(5, 100, size=num_bodies)
+        return {
+            "num_faces": num_faces,
+            "num_coedges": num_faces*rng.integers(4, 8, size=num_bodies)
+        }
+
+
+    def body_cost(self, body_sizes, index, coedge_cost):
+        return body_sizes["num_coedges"][index]*coedge_cost + body_sizes["num_faces"][index]
+
+
+    def test_batches_within_budget(self):
+        body_sizes = self.make_body_sizes(200)
+        sampler = CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5)
+        used = []
+        for batch in sampler:
+            cost = sum(self.body_cost(body_sizes, i, 5) for i in batch)
+            self.assertLessEqual(cost, 10000)
+            used.extend(batch)
+        self.assertEqual(len(sampler), len(list(sampler)))
+
+        # Every solid is used in each epoch.  Any solids used twice
+        # are in batches repeated to pad the epoch
+        self.assertEqual(set(used), set(range(200)))
+        unique_batches = set(tuple(batch) for batch in sampler)
+        self.assertEqual(sum(len(batch) for batch in unique_batches), 200)
+
+
+    def test_new_batches_each_epoch(self):
+        body_sizes = self.make_body_sizes(200)
+        sampler = CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5, seed=3)
+        epoch_0 = list(sampler)
+        sampler.set_epoch(1)
+        epoch_1 = list(sampler)
+        self.assertNotEqual(epoch_0, epoch_1)
+        self.assertEqual(sorted(sum(epoch_1, [])), list(range(200)))
+
+        # The batches only depend on the seed and epoch
+        other_sampler = CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5, seed=3)
+        other_sampler.set_epoch(1)
+        self.assertEqual(list(other_sampler), epoch_1)
+        other_sampler.set_epoch(0)
+        self.assertEqual(list(other_sampler), epoch_0)
+
+
+    def test_same_number_of_batches_each_epoch(self):
+        body_sizes = self.make_body_sizes(500)
+        for num_replicas in [1, 3]:
+            sampler = CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5, num_replicas=num_replicas, rank=0)
+            num_batches = len(sampler)
+            for epoch in range(20):
+                sampler.set_epoch(epoch)
+                self.assertEqual(len(sampler), num_batches)
+                self.assertEqual(len(list(sampler)), num_batches)
+                if num_replicas == 1:
+                    self.assertEqual(set(sum(list(sampler), [])), set(range(500)))
+
+
+    def test_split_between_replicas(self):
+        body_sizes = self.make_body_sizes(301)
+        num_replicas = 4
+        samplers = [
+            CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5, num_replicas=num_replicas, rank=rank)
+            for rank in range(num_replicas)
+        ]
+        all_batches = [ list(sampler) for sampler in samplers ]
+
+        # Every rank runs the same number of steps
+        num_steps = len(all_batches[0])
+        for batches in all_batches:
+            self.assertEqual(len(batches), num_steps)
+
+        # Between them the ranks use every solid
+        used = set()
+        for batches in all_batches:
+            for batch in batches:
+                used.update(batch)
+        self.assertEqual(used, set(range(301)))
+
+        # The batches used together in each step have similar costs, so
+        # the ranks spend less time waiting for each other than they
+        # would with the batches in a random order
+        def batch_cost(batch):
+            return sum(self.body_cost(body_sizes, i, 5) for i in batch)
+        def waiting_time(step_costs):
+            return (step_costs.max(axis=1, keepdims=True) - step_costs).sum()
+        step_costs = np.array([ [ batch_cost(batches[step]) for batches in all_batches ] for step in range(num_steps) ])
+        single_process_batches = list(CostBalancedBatchSampler(body_sizes, 10000, coedge_cost=5))
+        num_random_steps = len(single_process_batches) // num_replicas
+        random_step_costs = np.array([ batch_cost(batch) for batch in single_process_batches[:num_random_steps*num_replicas] ])
+        random_step_costs = random_step_costs.reshape(-1, num_replicas)
+        self.assertLess(waiting_time(step_costs), waiting_time(random_step_costs))
+
+
+    def test_skip_oversized_solids(self):
+        body_sizes = {
+            "num_faces": np.array([10, 1000, 20]),
+            "num_coedges": np.array([40, 4000, 80])
+        }
+        sampler = CostBalancedBatchSampler(body_sizes, 1000, coedge_cost=5, include_oversized=False)
+        self.assertEqual(sorted(sum(list(sampler), [])), [0, 2])
+        self.assertEqual(sampler.num_solids_per_path, { "packed": 2, "singleton": 0, "skipped": 1 })
+
+
+    def test_oversized_solids_in_singleton_batches(self):
+        body_sizes = {
+            "num_faces": np.array([10, 1000, 20, 2000]),
+            "num_coedges": np.array([40, 4000, 80, 8000])
+        }
+        sampler = CostBalancedBatchSampler(body_sizes, 1000, coedge_cost=5)
+        self.assertEqual(sampler.num_solids_per_path, { "packed": 2, "singleton": 2, "skipped": 0 })
+        self.assertEqual(sorted(sorted(batch) for batch in sampler), [[0, 2], [1], [3]])
+
+        # With two ranks the two oversized solids are used in the same step
+        batches = [ list(CostBalancedBatchSampler(body_sizes, 1000, coedge_cost=5, num_replicas=2, rank=rank)) for rank in range(2) ]
+        steps = [ sorted(batches[0][step] + batches[1][step]) for step in range(len(batches[0])) ]
+        self.assertIn([1, 3], steps)
+
+
+    def test_with_dataset(self):
+        dataset = self.create_json_dataset()
+        body_sizes = dataset.find_body_sizes()
+        kernel_size = find_kernel_size(data_utils.load_json_data(self.kernel_file()))
+        self.assertEqual(kernel_size, 5)
+        sampler = CostBalancedBatchSampler(body_sizes, 1000000, coedge_cost=kernel_size)
+        self.assertEqual(sorted(sum(list(sampler), [])), list(range(len(dataset))))
+
+
+if __name__ == '__main__':
+    unittest.main()
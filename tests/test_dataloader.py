@@ -106,6 +106,15 @@ class TestBRepNetDataset(TestBase):
         self.cross_check_coedges_of_faces_tensors(data, npz_data)
         self.cross_check_labels(data, npz_data, labels)
 
+    def split_coedges_of_big_faces(self, data):
+        """
+        The coedges of the big faces are in CSR form.  Split them
+        into a tensor for each face
+        """
+        Csf = data["coedges_of_big_faces"]
+        Csf_offsets = data["big_face_coedge_offsets"]
+        return list(Csf.split(torch.diff(Csf_offsets).tolist()))
+
     def cross_check_face_features(self, data, npz_data):
         face_features_from_dl = data["face_features"]
         face_features_from_npz = npz_data["face_features"]
@@ -113,7 +122,7 @@ class TestBRepNetDataset(TestBase):
         self.assertEqual(face_features_from_dl.size(1), face_features_from_npz.shape[1])
 
         coedges_of_small_faces = data["coedges_of_small_faces"]
-        coedges_of_big_faces = data["coedges_of_big_faces"]
+        coedges_of_big_faces = self.split_coedges_of_big_faces(data)
         total_num_faces = coedges_of_small_faces.size(0) + len(coedges_of_big_faces)
         self.assertEqual(face_features_from_dl.size(0), total_num_faces)
 
@@ -379,8 +388,8 @@ class TestBRepNetDataset(TestBase):
         self.assertEqual(Cf.size(1), max_coedges_per_face)
 
         # For faces which have more than max_coedges_per_face, the coedge indices are
-        # in individual tensors
-        Csf = data["coedges_of_big_faces"]
+        # in one tensor in CSR form.  We split them into a tensor for each face
+        Csf = self.split_coedges_of_big_faces(data)
         for coedges in Csf:
             self.assertGreaterEqual(coedges.size(0), max_coedges_per_face)
 
@@ -506,7 +515,7 @@ class TestBRepNetDataset(TestBase):
         }
         
         max_coedges_per_face = 3
-        Cf, Csf, new_to_old_face_index = dataset.build_coedges_of_faces_tensor(
+        Cf, Csf, Csf_offsets, new_to_old_face_index = dataset.build_coedges_of_faces_tensor(
             body_data, 
             max_coedges_per_face         
         )
@@ -521,18 +530,12 @@ class TestBRepNetDataset(TestBase):
         )
         self.assertTrue(torch.all(Cf == expected_Cf))
 
-        # Then the array of tensors 
-        # Csf = [
-        #    Csf.size() = [ num_coedges_in_face_1 ],
-        #    ...
-        #]
-        expected_Csf = [
-            torch.tensor([0, 1, 2, 3]),
-            torch.tensor([6, 7, 8, 9, 10, 11])
-        ]
-        self.assertEqual(len(expected_Csf), len(Csf))
-        for t1, t2 in zip(Csf, expected_Csf):
-            self.assertTrue(torch.all(t1 == t2))
+        # Then the coedges of the big faces in CSR form.  The coedges 
+        # of big face i are Csf[Csf_offsets[i]:Csf_offsets[i+1]]
+        expected_Csf = torch.tensor([0, 1, 2, 3, 6, 7, 8, 9, 10, 11])
+        expected_Csf_offsets = torch.tensor([0, 4, 10])
+        self.assertTrue(torch.equal(Csf, expected_Csf))
+        self.assertTrue(torch.equal(Csf_offsets, expected_Csf_offsets))
 
 
     def test_find_face_permutation(self):
@@ -629,7 +632,7 @@ class TestBRepNetDataset(TestBase):
 
         # Now loop over the big faces (faces with a large number of coedges)
         for solid_index, solid_data in enumerate(data):
-            num_big_faces = len(solid_data["coedges_of_small_faces"])
+            num_big_faces = len(self.split_coedges_of_big_faces(solid_data))
             for face_index in range(num_big_faces):
                 mapping[solid_index].append(face_index + face_offset) 
             face_offset += num_big_faces
@@ -674,7 +677,7 @@ class TestBRepNetDataset(TestBase):
         batch_coedge_kernel_tensor = batch["coedge_kernel_tensor"]
         batch_coedges_of_edges = batch["coedges_of_edges"]
         batch_coedges_of_small_faces = batch["coedges_of_small_faces"]
-        batch_coedges_of_big_faces = batch["coedges_of_big_faces"]
+        batch_coedges_of_big_faces = self.split_coedges_of_big_faces(batch)
         batch_labels = batch["labels"]
         file_stems = batch["file_stems"]
         split_batch = batch["split_batch"]
@@ -697,7 +700,7 @@ class TestBRepNetDataset(TestBase):
             coedge_kernel_tensor = solid_data["coedge_kernel_tensor"]
             coedges_of_edges = solid_data["coedges_of_edges"]
             coedges_of_small_faces = solid_data["coedges_of_small_faces"]
-            coedges_of_big_faces = solid_data["coedges_of_big_faces"]
+            coedges_of_big_faces = self.split_coedges_of_big_faces(solid_data)
             labels = solid_data["labels"]
             old_to_new_face_indices = solid_data["old_to_new_face_indices"]
 
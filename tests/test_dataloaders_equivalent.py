@@ -8,7 +8,6 @@ import torch
 
 from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn
 from dataloaders.brepnet_dataset_old import BRepNetDatasetOld
-from pipeline.extract_brepnet_data_from_json import BRepNetJsonExtractor
 import utils.data_utils as data_utils
 
 from tests.test_base import TestBase
@@ -16,9 +15,6 @@ import unittest
 
 class TestDataloadersEquivalent(TestBase):
 
-    def equivalent_dataloaders_dir(self):
-        return self.data_dir() / "equivalent_dataloaders"
-        
     def input_feature_list(self):
         return self.equivalent_dataloaders_dir() / "original_feature_list.json"
 
@@ -156,9 +152,18 @@ class TestDataloadersEquivalent(TestBase):
             mult[value.item()] += 1
         return mult
 
+    def split_coedges_of_big_faces(self, batch):
+        """
+        The coedges of the big faces are in CSR form.  Split them
+        into a tensor for each face
+        """
+        Csf = batch["coedges_of_big_faces"]
+        Csf_offsets = batch["big_face_coedge_offsets"]
+        return list(Csf.split(torch.diff(Csf_offsets).tolist()))
+
     def check_coedges_of_big_faces(self, old_batch, new_batch):
-        old_coedges_of_big_faces = old_batch["coedges_of_big_faces"]
-        new_coedges_of_big_faces = new_batch["coedges_of_big_faces"]
+        old_coedges_of_big_faces = self.split_coedges_of_big_faces(old_batch)
+        new_coedges_of_big_faces = self.split_coedges_of_big_faces(new_batch)
         self.assertEqual(len(old_coedges_of_big_faces), len(new_coedges_of_big_faces))
         num_big_faces = len(old_coedges_of_big_faces)
 
@@ -220,51 +225,6 @@ class TestDataloadersEquivalent(TestBase):
         return face_index_to_original_face_index, face_index_to_solid_index
 
     
-    def generate_npz_files_from_json(self, dataset_pathname, data_dir):
-        # Load the dataset file
-        dataset = data_utils.load_json_data(dataset_pathname)
-        train_filestems = dataset["training_set"]
-
-        working_dir = self.working_dir()
-        feature_schema = data_utils.load_json_data(data_dir / "original_feature_list.json")
-        for file_stem in train_filestems:
-            npz_pathname = working_dir / (file_stem + ".npz")
-            if not npz_pathname.exists():
-                self.extract_brepnet_data(file_stem, data_dir, working_dir, feature_schema)
-
-                # We should now have generated the npz file
-                self.assertTrue(npz_pathname.exists())
-
-            seg_file = working_dir / (file_stem + ".seg")
-            if not seg_file.exists():
-                label_file = data_dir / (file_stem + "_labels.json")
-                self.make_labels_from_json(label_file, seg_file)
-
-    def extract_brepnet_data(self, file_stem, data_dir, output_path, feature_schema):
-        topology_file = data_dir / (file_stem + "_topology.json")
-        topology = data_utils.load_json_data(topology_file)["topology"]
-        features_pathname = data_dir / (file_stem + "_features.json")
-        features = data_utils.load_json_data(features_pathname)["feature_data"]
-        extractor = BRepNetJsonExtractor(topology, features, feature_schema)
-        data = extractor.process()
-        output_pathname = output_path / f"{file_stem}.npz"
-        data_utils.save_npz_data_without_uvnet_features(output_pathname, data)
-
-
-    def make_labels_from_json(self, label_file, output_file):
-        labels = data_utils.load_json_data(label_file)
-        num_faces = len(labels["face_labels"])
-        self.assertGreater(num_faces, 0)
-        labels_arr = np.zeros((num_faces), dtype=np.int64)
-
-        for face_index, face_labels in enumerate(labels["face_labels"]):
-            for label_index, label_obj in enumerate(face_labels["labels"]):
-                label_value = label_obj["label_value"]
-                if label_value > 0.5:
-                    labels_arr[face_index] = label_index
-        np.savetxt(output_file, labels_arr, fmt='%i', delimiter="\n")
-
-
     def test_dataloaders_equivalent(self):
         self.remove_folder(self.working_dir())
         data_dir = self.equivalent_dataloaders_dir()
@@ -0,0 +1,184 @@
+# System
+import copy
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, csr_from_tensor_list, find_coedge_to_face
+from models.brepnet import (
+    find_edge_of_each_coedge,
+    find_initial_face_values,
+    find_max_feature_vectors_for_each_edge,
+    find_max_feature_vectors_for_each_face
+)
+from models.segment_max import segment_max
+
+from tests.test_base import TestBase
+
+class TestFacePooling(TestBase):
+
+    def pool_face_by_face(self, Zf, Cf, Csf_list):
+        """
+        The original pooling with a loop over the big faces
+        """
+        Zfpad = torch.cat([Zf, torch.zeros(1, Zf.size(1), dtype=Zf.dtype)], dim=0)
+        Hf_array = [ torch.max(Zfpad[Cf], dim=1)[0] ]
+        for Csingle_face in Csf_list:
+            Hf_array.append(torch.max(Zf[Csingle_face], dim=0)[0].unsqueeze(0))
+        return torch.cat(Hf_array, dim=0)
+
+
+    def make_faces(self, num_coedges, num_small_faces, num_big_faces, generator):
+        Cf = torch.randint(0, num_coedges + 1, (num_small_faces, 30), generator=generator)
+        Csf_list = [
+            torch.randint(0, num_coedges, (31 + i,), generator=generator) for i in range(num_big_faces)
+        ]
+        return Cf, Csf_list
+
+
+    def make_partition(self, num_coedges, num_small_faces, num_big_faces, generator):
+        """
+        Split the coedges between the faces, as in a real B-Rep.  Some
+        small faces have exactly 30 coedges, so no padding
+        """
+        coedges_per_face = [30, 30, 1, 1, 4] + [ 3 + i % 20 for i in range(num_small_faces - 5) ]
+        coedges_per_face += [ 31 + i for i in range(num_big_faces) ]
+        order = torch.randperm(sum(coedges_per_face), generator=generator)
+        face_coedges = list(order.split(coedges_per_face))
+        num_coedges = order.size(0)
+        Cf = torch.full((num_small_faces, 30), num_coedges)
+        for i, coedges in enumerate(face_coedges[:num_small_faces]):
+            Cf[i, :coedges.size(0)] = coedges
+        Csf, Csf_offsets = csr_from_tensor_list(face_coedges[num_small_faces:])
+        return Cf, Csf, Csf_offsets, num_coedges
+
+
+    def test_pooling_matches_loop(self):
+        generator = torch.Generator().manual_seed(0)
+        num_coedges = 500
+        for num_big_faces in [0, 1, 7]:
+            Cf, Csf_list = self.make_faces(num_coedges, 20, num_big_faces, generator)
+            Csf, Csf_offsets = csr_from_tensor_list(Csf_list)
+
+            Zf = torch.randn(num_coedges, 16, dtype=torch.float64, generator=generator, requires_grad=True)
+            Hf = find_max_feature_vectors_for_each_face(Zf.float(), Cf, Csf, Csf_offsets, Zf.device)
+            expected_Hf = self.pool_face_by_face(Zf.float(), Cf, Csf_list)
+            self.assertEqual(Hf.shape, (20 + num_big_faces, 16))
+            self.assertTrue(torch.equal(Hf, expected_Hf))
+
+            # With random values there are no ties, so the gradients
+            # also match
+            weights = torch.randn(Hf.shape, dtype=torch.float64, generator=generator)
+            Hf = find_max_feature_vectors_for_each_face(Zf, Cf, Csf, Csf_offsets, Zf.device)
+            grad, = torch.autograd.grad((Hf*weights).sum(), Zf)
+            expected_grad, = torch.autograd.grad((self.pool_face_by_face(Zf, Cf, Csf_list)*weights).sum(), Zf)
+            self.assertTrue(torch.allclose(grad, expected_grad))
+
+
+    def test_segment_max_matches_padded(self):
+        generator = torch.Generator().manual_seed(0)
+        for num_big_faces in [0, 3]:
+            Cf, Csf, Csf_offsets, num_coedges = self.make_partition(500, 40, num_big_faces, generator)
+            num_faces = 40 + num_big_faces
+            Fc = find_coedge_to_face(Cf, Csf, Csf_offsets, num_coedges)
+            Hf_init = find_initial_face_values(Fc, num_faces, Cf.size(1))
+
+            # Values after a ReLU and the raw output layer values, where
+            # the zero padding changes the max of the small faces
+            Z = torch.randn(num_coedges, 16, dtype=torch.float64, generator=generator, requires_grad=True)
+            for activation in [torch.relu, lambda Z: Z]:
+                Hf = segment_max(activation(Z), Fc, num_faces, Hf_init)
+                expected_Hf = find_max_feature_vectors_for_each_face(activation(Z), Cf, Csf, Csf_offsets, Z.device)
+                self.assertTrue(torch.equal(Hf, expected_Hf))
+                weights = torch.randn(Hf.shape, dtype=torch.float64, generator=generator)
+                grad, = torch.autograd.grad((Hf*weights).sum(), Z)
+                expected_grad, = torch.autograd.grad((expected_Hf*weights).sum(), Z)
+                self.assertTrue(torch.allclose(grad, expected_grad))
+
+
+    def test_segment_max_ties(self):
+        # The gradient is split evenly between the rows with the max
+        Z = torch.tensor([[1.0, 2.0], [1.0, 0.0], [3.0, 3.0]], requires_grad=True)
+        H = segment_max(Z, torch.tensor([0, 0, 2]), 3)
+        self.assertTrue(torch.equal(H, torch.tensor([[1.0, 2.0], [0.0, 0.0], [3.0, 3.0]])))
+        grad, = torch.autograd.grad(H.sum(), Z)
+        self.assertTrue(torch.equal(grad, torch.tensor([[0.5, 1.0], [0.5, 0.0], [1.0, 1.0]])))
+        self.assertTrue(torch.autograd.gradcheck(
+            lambda Z: segment_max(Z, torch.tensor([0, 1, 1]), 2, torch.zeros(2, dtype=torch.float64)),
+            (torch.randn(3, 4, dtype=torch.float64, requires_grad=True),)
+        ))
+
+
+    def test_edge_pooling(self):
+        generator = torch.Generator().manual_seed(0)
+        Ce = torch.randperm(200, generator=generator).view(100, 2)
+        Ze = torch.randn(200, 16, dtype=torch.float64, generator=generator, requires_grad=True)
+        Ec = find_edge_of_each_coedge(Ce, 200)
+        He = segment_max(Ze, Ec, Ce.size(0))
+        expected_He = find_max_feature_vectors_for_each_edge(Ze, Ce)
+        self.assertTrue(torch.equal(He, expected_He))
+        grad, = torch.autograd.grad(He.sum(), Ze)
+        expected_grad, = torch.autograd.grad(expected_He.sum(), Ze)
+        self.assertTrue(torch.equal(grad, expected_grad))
+
+
+    def test_coedge_to_face_in_batch(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        Fc = find_coedge_to_face(
+            batch["coedges_of_small_faces"],
+            batch["coedges_of_big_faces"],
+            batch["big_face_coedge_offsets"],
+            batch["coedge_features"].size(0)
+        )
+        self.assertTrue(torch.equal(batch["coedge_to_face"], Fc))
+
+
+    def find_face_embeddings(self, model, batch):
+        with torch.no_grad():
+            return model.create_face_embeddings(
+                batch["face_features"], None,
+                batch["edge_features"], None,
+                batch["coedge_features"], None,
+                batch["face_kernel_tensor"],
+                batch["edge_kernel_tensor"],
+                batch["coedge_kernel_tensor"],
+                batch["coedges_of_edges"],
+                batch["coedges_of_small_faces"],
+                batch["coedges_of_big_faces"],
+                batch["big_face_coedge_offsets"],
+                batch["coedge_to_face"]
+            )
+
+
+    def test_model_matches(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        padded_model = self.create_model(dataset, ["--dropout", "0.0", "--face_pooling", "padded"])
+        segmented_model = self.create_model(dataset, ["--dropout", "0.0", "--face_pooling", "segmented"])
+        padded_model.eval()
+        segmented_model.eval()
+        embeddings = self.find_face_embeddings(padded_model, batch)
+        segmented_embeddings = self.find_face_embeddings(segmented_model, batch)
+        self.assertTrue(torch.allclose(embeddings, segmented_embeddings, atol=1e-6))
+
+        # Without the reordering the faces of each body stay in
+        # their original order
+        opts = copy.copy(dataset.opts)
+        opts.reorder_faces = 0
+        unordered_dataset = BRepNetDataset(opts, "training_set")
+        unordered_batch = brepnet_collate_fn([ unordered_dataset[i] for i in range(len(unordered_dataset)) ])
+        self.assertEqual(unordered_batch["coedges_of_small_faces"].size(0), 0)
+        unordered_embeddings = self.find_face_embeddings(segmented_model, unordered_batch)
+        for split_solid, unordered_split_solid in zip(batch["split_batch"], unordered_batch["split_batch"]):
+            self.assertTrue(torch.allclose(
+                embeddings[split_solid["face_indices"]],
+                unordered_embeddings[unordered_split_solid["face_indices"]],
+                atol=1e-6
+            ))
+        with self.assertRaises(AssertionError):
+            self.find_face_embeddings(padded_model, unordered_batch)
+
+
+if __name__ == '__main__':
+    unittest.main()
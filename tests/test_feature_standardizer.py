@@ -0,0 +1,78 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.feature_standardizer import FeatureStandardizer
+
+from tests.test_base import TestBase
+
+class TestFeatureStandardizer(TestBase):
+
+    def create_stats(self, num_features):
+        stats = []
+        for i in range(num_features):
+            stats.append(
+                {
+                    "mean": float(i) - 2.5,
+                    "standard_deviation": 0.5 + i
+                }
+            )
+        return stats
+
+    def create_feature_standardization(self):
+        return {
+            "face_features": self.create_stats(7),
+            "edge_features": self.create_stats(10),
+            "coedge_features": self.create_stats(1)
+        }
+
+    def test_standardize_body(self):
+        feature_standardization = self.create_feature_standardization()
+        standardizer = FeatureStandardizer(feature_standardization)
+        Xf = torch.rand(13, 7, dtype=torch.float64)
+        Xe = torch.rand(32, 10, dtype=torch.float64)
+        Xc = torch.rand(64, 1, dtype=torch.float64)
+        std_Xf, std_Xe, std_Xc = standardizer.standardize_body(Xf, Xe, Xc)
+
+        for X, std_X, stats in zip(
+                [Xf, Xe, Xc],
+                [std_Xf, std_Xe, std_Xc],
+                feature_standardization.values()
+            ):
+            self.assertEqual(std_X.dtype, torch.float32)
+            test_tensor = torch.zeros(X.size(), dtype=torch.float64)
+            for i in range(X.size(0)):
+                for j in range(X.size(1)):
+                    value = (X[i,j] - stats[j]["mean"])/stats[j]["standard_deviation"]
+                    test_tensor[i,j] = value
+            self.assertTrue(torch.allclose(std_X, test_tensor.float()))
+
+
+    def test_validation_mode_gives_same_result(self):
+        """
+        The validation mode cross checks every element.  It must give
+        exactly the same result as the fast path
+        """
+        feature_standardization = self.create_feature_standardization()
+        fast_standardizer = FeatureStandardizer(feature_standardization)
+        validating_standardizer = FeatureStandardizer(feature_standardization, validate=True)
+        for dtype in [torch.float32, torch.float64]:
+            Xf = torch.rand(20, 7, dtype=dtype)
+            Xe = torch.rand(50, 10, dtype=dtype)
+            Xc = torch.rand(100, 1, dtype=dtype)
+            fast = fast_standardizer.standardize_body(Xf, Xe, Xc)
+            validated = validating_standardizer.standardize_body(Xf, Xe, Xc)
+            for t1, t2 in zip(fast, validated):
+                self.assertTrue(torch.equal(t1, t2))
+
+
+    def test_zero_standard_deviation(self):
+        feature_standardization = self.create_feature_standardization()
+        feature_standardization["edge_features"][3]["standard_deviation"] = 0.0
+        with self.assertRaises(AssertionError):
+            FeatureStandardizer(feature_standardization)
+
+
+if __name__ == '__main__':
+    unittest.main()
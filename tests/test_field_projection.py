@@ -0,0 +1,67 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset, brepnet_collate_fn, find_required_fields, OPTIONAL_FIELDS
+
+from tests.test_base import TestBase
+
+class TestFieldProjection(TestBase):
+
+    def set_model_options(self, opts, use_grids, use_features):
+        for entity in ["face", "edge", "coedge"]:
+            setattr(opts, f"use_{entity}_grids", use_grids)
+            setattr(opts, f"use_{entity}_features", use_features)
+
+
+    def test_required_fields(self):
+        dataset = self.create_json_dataset()
+        opts = dataset.opts
+        self.assertNotIn("coedge_lcs", find_required_fields(opts))
+        self.set_model_options(opts, use_grids=0, use_features=1)
+        self.assertEqual(
+            find_required_fields(opts),
+            set(["face_features", "edge_features", "coedge_features"])
+        )
+        opts.use_edge_grids = 1
+        self.assertIn("edge_point_grids", find_required_fields(opts))
+
+
+    def test_features_only(self):
+        dataset = self.create_json_dataset()
+        all_fields_dataset = BRepNetDataset(dataset.opts, "training_set", fields=OPTIONAL_FIELDS)
+
+        opts = dataset.opts
+        self.set_model_options(opts, use_grids=0, use_features=1)
+        opts.use_coedge_features = 0
+        features_dataset = BRepNetDataset(opts, "training_set")
+        self.assertNotEqual(
+            features_dataset.hash_data_for_config(),
+            all_fields_dataset.hash_data_for_config()
+        )
+
+        bodies = []
+        for i in range(len(features_dataset)):
+            body = features_dataset[i]
+            full_body = all_fields_dataset[i]
+            for key in ["face_point_grids", "edge_point_grids", "coedge_point_grids", "coedge_lcs"]:
+                self.assertNotIn(key, body)
+                self.assertIn(key, full_body)
+            self.assertTrue(torch.equal(body["face_features"], full_body["face_features"]))
+            self.assertTrue(torch.equal(body["edge_features"], full_body["edge_features"]))
+
+            # The unused features keep the number of coedges
+            self.assertEqual(body["coedge_features"].shape, (full_body["coedge_features"].size(0), 0))
+            bodies.append(body)
+
+        batch = brepnet_collate_fn(bodies)
+        full_batch = brepnet_collate_fn([ all_fields_dataset[i] for i in range(len(all_fields_dataset)) ])
+        self.assertNotIn("face_point_grids", batch)
+        for key in ["face_features", "face_kernel_tensor", "coedges_of_small_faces", "labels"]:
+            self.assertTrue(torch.equal(batch[key], full_batch[key]))
+        self.assertEqual(batch["coedge_features"].size(0), full_batch["coedge_features"].size(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
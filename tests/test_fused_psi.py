@@ -0,0 +1,126 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.psi_benchmark import layer_args, make_hidden_states
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import (
+    BRepNetLayer,
+    BRepNetFaceOutputLayer,
+    build_matrix_Psi,
+    build_matrix_Psi_fused,
+    find_combined_kernel_tensor,
+    find_coedge_to_face,
+    find_edge_of_each_coedge,
+    find_initial_face_values
+)
+
+from tests.test_base import TestBase
+
+class TestFusedPsi(TestBase):
+    """
+    Check Psi gathered from the single entity buffer is
+    identical to the concatenated Psi
+    """
+
+    def create_batch(self):
+        kernel_file = self.parent_dir() / "kernels/winged_edge_plus_plus.json"
+        return brepnet_collate_fn(make_synthetic_batch(3, kernel_file, with_grids=False))
+
+
+    def test_psi_identical(self):
+        batch = self.create_batch()
+        Xf, Xe, Xc = make_hidden_states(batch, 16)
+        Kf, Ke, Kc = layer_args(batch)[:3]
+        K = find_combined_kernel_tensor(Kf, Ke, Kc, Xf.size(0), Xe.size(0))
+        self.assertEqual(K.shape, (Kc.size(0), Kf.size(1) + Ke.size(1) + Kc.size(1)))
+
+        Psi = build_matrix_Psi(Xf, Xe, Xc, Kf, Ke, Kc)
+        fused_Psi = build_matrix_Psi_fused(torch.cat([Xf, Xe, Xc]), K)
+        self.assertTrue(torch.equal(Psi, fused_Psi))
+
+        weights = torch.randn(Psi.shape)
+        grads = torch.autograd.grad((Psi*weights).sum(), [Xf, Xe, Xc])
+        fused_grads = torch.autograd.grad((fused_Psi*weights).sum(), [Xf, Xe, Xc])
+        for grad, fused_grad in zip(grads, fused_grads):
+            self.assertTrue(torch.allclose(grad, fused_grad, atol=1e-5))
+
+
+    def test_layers_match(self):
+        batch = self.create_batch()
+        Xf, Xe, Xc = make_hidden_states(batch, 16)
+        args = layer_args(batch)
+        kernel_size = sum(K.size(1) for K in args[:3])
+        for layer_class in [BRepNetLayer, BRepNetFaceOutputLayer]:
+            torch.manual_seed(0)
+            layer = layer_class(2, kernel_size*16, 16)
+            fused_layer = layer_class(2, kernel_size*16, 16, psi_mode="fused")
+            fused_layer.load_state_dict(layer.state_dict())
+            output = layer(Xf, Xe, Xc, *args)
+            fused_output = fused_layer(Xf, Xe, Xc, *args)
+            if isinstance(output, tuple):
+                output = torch.cat(output[:3])
+                fused_output = torch.cat(fused_output[:3])
+            self.assertTrue(torch.equal(output, fused_output))
+
+
+    def test_entity_buffer(self):
+        # With the segmented pooling the fused layer pools its output
+        # into the buffer which the next layer gathers from
+        batch = self.create_batch()
+        Xf, Xe, Xc = make_hidden_states(batch, 16)
+        args = layer_args(batch)
+        Ce, Cf, Csf, Csf_offsets = args[3:]
+        Fc = find_coedge_to_face(Cf, Csf, Csf_offsets, Xc.size(0))
+        segments = [
+            find_edge_of_each_coedge(Ce, Xc.size(0)),
+            Fc,
+            find_initial_face_values(Fc, Xf.size(0), Cf.size(1))
+        ]
+        kernel_size = sum(K.size(1) for K in args[:3])
+        layers = {}
+        for psi_mode in ["concat", "fused"]:
+            torch.manual_seed(0)
+            layers[psi_mode] = (
+                BRepNetLayer(2, kernel_size*16, 16, psi_mode=psi_mode, face_pooling="segmented"),
+                BRepNetFaceOutputLayer(2, kernel_size*16, 16, psi_mode=psi_mode, face_pooling="segmented")
+            )
+
+        layer, output_layer = layers["concat"]
+        outputs = layer(Xf, Xe, Xc, *args, *segments)
+        self.assertIsNone(outputs[-1])
+        Hf = output_layer(*outputs[:3], *args, *segments)
+
+        fused_layer, fused_output_layer = layers["fused"]
+        fused_outputs = fused_layer(Xf, Xe, Xc, *args, *segments)
+        X = fused_outputs[-1]
+        for H in fused_outputs[:3]:
+            self.assertIs(H._base, X)
+        self.assertTrue(torch.equal(X, torch.cat(outputs[:3])))
+        fused_Hf = fused_output_layer(*fused_outputs[:3], *args, *segments, X=X)
+        self.assertTrue(torch.equal(Hf, fused_Hf))
+
+        weights = torch.randn(Hf.shape)
+        grads = torch.autograd.grad((Hf*weights).sum(), [Xf, Xe, Xc])
+        fused_grads = torch.autograd.grad((fused_Hf*weights).sum(), [Xf, Xe, Xc])
+        for grad, fused_grad in zip(grads, fused_grads):
+            self.assertTrue(torch.allclose(grad, fused_grad, atol=1e-5))
+
+
+    def test_model_matches(self):
+        # The input layer has different numbers of face, edge and
+        # coedge features, so it builds Psi by concatenation
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        for face_pooling in ["padded", "segmented"]:
+            losses = []
+            for psi_mode in ["concat", "fused"]:
+                model = self.create_model(dataset, ["--dropout", "0.0", "--psi_mode", psi_mode, "--face_pooling", face_pooling])
+                losses.append(model.brepnet_step(batch, 0, False)["loss"])
+            self.assertEqual(losses[0].item(), losses[1].item())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from benchmarks.psi_benchmark import layer_args, make_hidden_states
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet import BRepNetLayer, BRepNetFaceOutputLayer
+
+from tests.test_base import TestBase
+
+class TestGatherSum(TestBase):
+    """
+    Check the layers give the same output and gradients
+    when Psi is not built
+    """
+
+    def check_tensors_close(self, tensors, other_tensors):
+        self.assertEqual(len(tensors), len(other_tensors))
+        for t, other_t in zip(tensors, other_tensors):
+            self.assertTrue(torch.allclose(t, other_t, rtol=1e-4, atol=1e-5))
+
+
+    def run_layer(self, layer, Xf, Xe, Xc, args):
+        output = layer(Xf, Xe, Xc, *args)
+        if isinstance(output, tuple):
+            output = torch.cat(output[:3])
+        inputs = [Xf, Xe, Xc] + list(layer.parameters())
+        grads = torch.autograd.grad(output.square().sum(), inputs)
+        return output, grads
+
+
+    def test_layers_match(self):
+        kernel_file = self.parent_dir() / "kernels/winged_edge_plus_plus.json"
+        batch = brepnet_collate_fn(make_synthetic_batch(3, kernel_file, with_grids=False))
+        Xf, Xe, Xc = make_hidden_states(batch, 16)
+        args = layer_args(batch)
+        kernel_size = sum(K.size(1) for K in args[:3])
+        for layer_class in [BRepNetLayer, BRepNetFaceOutputLayer]:
+            torch.manual_seed(0)
+            layer = layer_class(2, kernel_size*16, 16)
+            gather_sum_layer = layer_class(2, kernel_size*16, 16, psi_mode="gather_sum")
+            gather_sum_layer.load_state_dict(layer.state_dict())
+            output, grads = self.run_layer(layer, Xf, Xe, Xc, args)
+            gather_sum_output, gather_sum_grads = self.run_layer(gather_sum_layer, Xf, Xe, Xc, args)
+            self.check_tensors_close([output], [gather_sum_output])
+            self.check_tensors_close(grads, gather_sum_grads)
+
+
+    def test_model_matches(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        losses = []
+        for psi_mode in ["concat", "gather_sum"]:
+            model = self.create_model(dataset, ["--dropout", "0.0", "--psi_mode", psi_mode])
+            losses.append(model.brepnet_step(batch, 0, False)["loss"])
+        self.assertAlmostEqual(losses[0].item(), losses[1].item(), places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from eval.check_inference_precision import check_inference_precision
+from models.brepnet_predictor import BRepNetPredictor
+
+from tests.test_base import TestBase
+
+class TestInferencePrecision(TestBase):
+
+    def test_pooling_in_float32(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        model = self.create_model(dataset)
+        hidden_state_dtypes = []
+        model.layers[-1].register_forward_hook(
+            lambda layer, inputs, outputs: hidden_state_dtypes.extend(t.dtype for t in outputs[:3])
+        )
+        output = BRepNetPredictor(model, "bfloat16").predict(batch)
+        self.assertEqual(hidden_state_dtypes, [torch.float32]*3)
+        self.assertEqual(output["logits"].dtype, torch.float32)
+        self.assertEqual(output["embeddings"].dtype, torch.float32)
+
+
+    def test_model_predictions(self):
+        dataset = self.create_json_dataset()
+        model = self.create_model(dataset)
+        results = check_inference_precision(model, dataset, bodies_per_batch=2)
+        self.assertEqual(set(results.keys()), {"float32", "bfloat16", "float16"})
+        self.assertEqual(results["float32"]["agreement"], 1.0)
+        self.assertEqual(results["float32"]["max_logit_difference"], 0.0)
+        for precision in ["bfloat16", "float16"]:
+            self.assertGreater(results[precision]["agreement"], 0.95)
+            self.assertGreater(results[precision]["max_logit_difference"], 0.0)
+            self.assertIsNotNone(results[precision]["mean_iou"])
+            self.assertGreater(results[precision]["faces_per_second"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# System
+import unittest
+
+import torch
+
+from benchmarks.topology_benchmark import make_synthetic_topology, legacy_build_kernel_tensors
+from dataloaders.kernel_compiler import CompiledKernel
+import utils.data_utils as data_utils
+
+from tests.test_base import TestBase
+
+class TestKernelCompiler(TestBase):
+
+    def test_compiled_kernels_match_walks(self):
+        dataset = self.create_json_dataset()
+        kernel_files = sorted((self.parent_dir() / "kernels").glob("*.json"))
+        self.assertGreater(len(kernel_files), 0)
+        for kernel_file in kernel_files:
+            kernel = data_utils.load_json_data(kernel_file)
+            compiled_kernel = CompiledKernel(kernel)
+
+            # The shared prefixes mean we never need more gathers
+            # than there are instructions in the walks
+            num_instructions = sum(len(walk) for walks in kernel.values() for walk in walks)
+            self.assertLessEqual(compiled_kernel.num_gathers(), num_instructions)
+
+            for seed, num_faces in enumerate([1, 20, 500]):
+                body_data = make_synthetic_topology(num_faces, seed=seed)
+                n = body_data["coedge_to_next"]
+                p = dataset.find_inverse_permutation(n)
+                m = body_data["coedge_to_mate"]
+                e = body_data["coedge_to_edge"]
+                f = body_data["coedge_to_face"]
+                compiled_tensors = compiled_kernel.build_kernel_tensors(n, p, m, e, f)
+                legacy_tensors = legacy_build_kernel_tensors(dataset, n, p, m, e, f, kernel)
+                for compiled, legacy in zip(compiled_tensors, legacy_tensors):
+                    self.assertEqual(compiled.dtype, torch.int64)
+                    self.assertTrue(torch.equal(compiled, legacy))
+
+
+    def test_invalid_kernels_rejected(self):
+        valid_kernel = {
+            "faces": ["f", "mf"],
+            "edges": ["e"],
+            "coedges": ["", "m"]
+        }
+        CompiledKernel(valid_kernel)
+
+        invalid_kernels = [
+            { "faces": ["f", "mx"], "edges": ["e"], "coedges": [""] },
+            { "faces": ["fm"], "edges": ["e"], "coedges": [""] },
+            { "faces": ["f"], "edges": ["ef"], "coedges": [""] },
+            { "faces": ["f"], "edges": ["e"], "coedges": ["me"] },
+            { "faces": ["f"], "edges": ["e"] },
+            { "faces": ["f"], "edges": ["e"], "coedges": [""], "loops": [""] }
+        ]
+        for kernel in invalid_kernels:
+            with self.assertRaises(AssertionError):
+                CompiledKernel(kernel)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# System
+import unittest
+
+import numpy as np
+import shutil
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.label_store import LabelStore, build_label_store, build_label_store_for_dataset, label_store_pathname
+
+import utils.data_utils as data_utils
+from tests.test_base import TestBase
+
+class TestLabelStore(TestBase):
+
+    def create_dataset_with_label_store(self):
+        dataset = self.create_json_dataset()
+
+        # Write the label store next to a copy of the dataset file
+        # in the working dir
+        dataset_file = self.working_dir() / "dataset.json"
+        shutil.copyfile(dataset.opts.dataset_file, dataset_file)
+        dataset.opts.dataset_file = dataset_file
+        build_label_store_for_dataset(dataset_file, dataset.opts.label_dir)
+        return BRepNetDataset(dataset.opts, "training_set")
+
+
+    def test_label_store(self):
+        dataset = self.create_dataset_with_label_store()
+        self.assertIsNotNone(dataset.label_store)
+        label_store = LabelStore(label_store_pathname(dataset.opts.dataset_file))
+        for file_stem in dataset.bodies:
+            seg_labels = np.loadtxt(dataset.label_dir / (file_stem + ".seg"), dtype=np.int64)
+            seg_labels = torch.from_numpy(np.atleast_1d(seg_labels))
+            self.assertTrue(torch.equal(label_store.get(file_stem), seg_labels))
+            self.assertTrue(torch.equal(dataset.load_labels(file_stem), seg_labels))
+
+
+    def test_load_labels_from_store(self):
+        dataset = self.create_dataset_with_label_store()
+        file_stem = dataset.bodies[0]
+        label_pathname = dataset.label_dir / (file_stem + ".seg")
+        seg_labels = data_utils.load_labels(label_pathname)
+
+        # The labels are read from the store when it holds the body
+        dataset.label_store.labels = dataset.label_store.labels + 100
+        store_labels = data_utils.load_labels(label_pathname, dataset.label_store)
+        self.assertTrue(np.array_equal(store_labels, seg_labels + 100))
+
+        # A seg file in another folder is read from the file
+        other_label_dir = self.working_dir() / "other_labels"
+        other_label_dir.mkdir()
+        shutil.copy(label_pathname, other_label_dir)
+        other_labels = data_utils.load_labels(other_label_dir / label_pathname.name, dataset.label_store)
+        self.assertTrue(np.array_equal(other_labels, seg_labels))
+
+
+    def test_fall_back_to_seg_files(self):
+        dataset = self.create_dataset_with_label_store()
+
+        # Bodies missing from the store are read from the seg files
+        file_stem = dataset.bodies[0]
+        del dataset.label_store.stem_to_index[file_stem]
+        self.assertEqual(dataset.load_labels(file_stem).size(0), dataset.load_body(0)["labels"].size(0))
+
+        # A store built from a different label dir is not used
+        opts = dataset.opts
+        other_label_dir = self.working_dir() / "other_labels"
+        other_label_dir.mkdir()
+        for seg_file in dataset.label_dir.glob("*.seg"):
+            shutil.copy(seg_file, other_label_dir)
+        opts.label_dir = other_label_dir
+        dataset = BRepNetDataset(opts, "training_set")
+        self.assertIsNone(dataset.label_store)
+
+
+    def test_missing_seg_files(self):
+        dataset = self.create_json_dataset()
+        label_dir = self.working_dir() / "some_labels"
+        label_dir.mkdir()
+        missing_file_stem = dataset.bodies[0]
+        for file_stem in dataset.bodies[1:]:
+            shutil.copy(dataset.label_dir / (file_stem + ".seg"), label_dir)
+
+        # The body without a seg file is left out of the store
+        output_pathname = self.working_dir() / "some_labels.npz"
+        missing_file_stems = build_label_store(label_dir, dataset.bodies, output_pathname)
+        self.assertEqual(missing_file_stems, [ missing_file_stem ])
+        label_store = LabelStore(output_pathname)
+        self.assertNotIn(missing_file_stem, label_store)
+        for file_stem in dataset.bodies[1:]:
+            self.assertTrue(torch.equal(label_store.get(file_stem), dataset.load_labels(file_stem)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from dataloaders.max_num_faces_sampler import MaxNumFacesSampler
+
+from tests.test_base import TestBase
+
+class TestOversizedSolids(TestBase):
+
+    def test_max_num_faces_sampler(self):
+        dataset = self.create_json_dataset()
+        num_faces = dataset.find_body_sizes()["num_faces"]
+        max_num_faces = int(num_faces.max()) - 1
+        num_oversized = int((num_faces > max_num_faces).sum())
+
+        sampler = MaxNumFacesSampler(dataset, max_num_faces)
+        self.assertEqual(sampler.num_solids_per_path["skipped"], num_oversized)
+        self.assertEqual(len(sum(sampler.batches, [])), len(dataset) - num_oversized)
+
+        sampler = MaxNumFacesSampler(dataset, max_num_faces, include_oversized=True)
+        self.assertEqual(sampler.num_solids_per_path["singleton"], num_oversized)
+        self.assertEqual(sampler.num_solids_per_path["packed"], len(dataset) - num_oversized)
+        self.assertEqual(sorted(sum(sampler.batches, [])), list(range(len(dataset))))
+        for batch in sampler.batches:
+            if len(batch) > 1:
+                self.assertLessEqual(sum(num_faces[i] for i in batch), max_num_faces)
+
+
+    def test_checkpointed_layers_match(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        num_faces = batch["face_features"].size(0)
+        model = self.create_model(dataset, ["--max_num_faces_per_batch", str(num_faces)])
+        self.assertFalse(model.is_oversized_batch(batch))
+
+        # By default the oversized solids are left out, as before
+        self.assertFalse(model.include_oversized_solids())
+        model.opts.max_num_faces_per_batch = num_faces - 1
+        self.assertTrue(model.is_oversized_batch(batch))
+
+        # The loss and gradients are the same when the activations
+        # are recomputed.  The dropout masks are recomputed too
+        grads = []
+        for oversized_solids in ["singleton", "checkpoint"]:
+            model.opts.oversized_solids = oversized_solids
+            model.zero_grad()
+            torch.manual_seed(1)
+            loss = model.brepnet_step(batch, 0, False)["loss"]
+            loss.backward()
+            grads.append([ p.grad.clone() for p in model.parameters() if p.grad is not None ])
+        self.assertEqual(len(grads[0]), len(grads[1]))
+        for grad, checkpointed_grad in zip(grads[0], grads[1]):
+            self.assertTrue(torch.allclose(grad, checkpointed_grad, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from dataloaders.packed_cache import PackedCache, PackedCacheWriter, convert_pickle_cache_to_packed
+
+from tests.test_base import TestBase
+
+class TestPackedCache(TestBase):
+
+    def check_bodies_same(self, body1, body2):
+        self.assertEqual(set(body1.keys()), set(body2.keys()))
+        for key, value in body1.items():
+            if isinstance(value, str):
+                self.assertEqual(value, body2[key])
+            elif isinstance(value, list):
+                self.assertEqual(len(value), len(body2[key]))
+                for t1, t2 in zip(value, body2[key]):
+                    self.assertTrue(torch.equal(t1, t2))
+            else:
+                self.assertEqual(value.dtype, body2[key].dtype)
+                self.assertTrue(torch.equal(value, body2[key]))
+
+
+    def test_write_and_read(self):
+        bodies = []
+        for i in range(5):
+            num_faces = i
+            bodies.append(
+                {
+                    "face_features": torch.rand(num_faces, 7),
+                    "face_point_grids": torch.rand(num_faces, 7, 10, 10, dtype=torch.float64),
+                    "labels": torch.arange(num_faces),
+                    "coedges_of_big_faces": [ torch.arange(j+31) for j in range(i % 3) ],
+                    "file_stem": f"body_{i}"
+                }
+            )
+        cache_dir = self.working_dir() / "packed_cache_test"
+        writer = PackedCacheWriter(cache_dir)
+        for body in bodies:
+            writer.add_body(body)
+        writer.close()
+
+        self.assertTrue(PackedCache.exists(cache_dir))
+        cache = PackedCache(cache_dir)
+        self.assertEqual(len(cache), len(bodies))
+        for i, body in enumerate(bodies):
+            self.check_bodies_same(body, cache[i])
+            self.check_bodies_same(body, cache.find_body(f"body_{i}"))
+        self.remove_folder(cache_dir)
+
+
+    def test_dataset_with_packed_cache(self):
+        dataset = self.create_json_dataset()
+        convert_pickle_cache_to_packed(dataset)
+
+        dataset.opts.cache_format = "packed"
+        packed_dataset = BRepNetDataset(dataset.opts, "training_set")
+        self.assertIsNotNone(packed_dataset.packed_cache)
+        for i in range(len(dataset)):
+            self.check_bodies_same(dataset.load_body(i), packed_dataset[i])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# System
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from models.brepnet_predictor import BRepNetPredictor
+
+from tests.test_base import TestBase
+
+class TestPredictor(TestBase):
+
+    def test_forward(self):
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        model = self.create_model(dataset, ["--face_pooling", "padded"])
+        model.eval()
+        with torch.no_grad():
+            logits = model(
+                batch["face_features"], None,
+                batch["edge_features"], None,
+                batch["coedge_features"], None,
+                batch["face_kernel_tensor"],
+                batch["edge_kernel_tensor"],
+                batch["coedge_kernel_tensor"],
+                batch["coedges_of_edges"],
+                batch["coedges_of_small_faces"],
+                batch["coedges_of_big_faces"],
+                batch["big_face_coedge_offsets"]
+            )
+        self.assertEqual(logits.shape, (batch["face_features"].size(0), 8))
+
+        # The predictor uses the segmented pooling, which gives
+        # the same result
+        predictor = BRepNetPredictor(model)
+        output = predictor.predict(batch)
+        self.assertTrue(torch.allclose(output["logits"], logits, atol=1e-5))
+        self.assertEqual(output["embeddings"].shape, (logits.size(0), 84))
+
+        # A single body gives the faces in their original order
+        body_output = predictor.predict_body(dataset[0])
+        face_indices = batch["split_batch"][0]["face_indices"]
+        for key in ["logits", "embeddings"]:
+            self.assertTrue(torch.allclose(
+                body_output[key][dataset[0]["old_to_new_face_indices"]], 
+                output[key][face_indices], 
+                atol=1e-5
+            ))
+
+
+    def test_model_not_changed(self):
+        # The predictor runs the model in eval mode with the segmented
+        # pooling, but leaves the settings of the model as they were
+        dataset = self.create_json_dataset()
+        batch = brepnet_collate_fn([ dataset[i] for i in range(len(dataset)) ])
+        model = self.create_model(dataset, ["--face_pooling", "padded"])
+        model.train()
+        predictor = BRepNetPredictor(model)
+        output = predictor.predict(batch)
+        self.assertTrue(torch.equal(predictor.predict(batch)["logits"], output["logits"]))
+        self.assertTrue(all(module.training for module in model.modules()))
+        for layer in list(model.layers) + [model.output_layer]:
+            self.assertEqual(layer.face_pooling, "padded")
+
+
+    def test_trace(self):
+        # The traced module works for bodies of any size
+        kernel_file = str(self.parent_dir() / "kernels/winged_edge.json")
+        example_batch = brepnet_collate_fn(make_synthetic_batch(2, kernel_file, seed=10))
+        batch = brepnet_collate_fn(make_synthetic_batch(4, kernel_file))
+        for psi_mode in ["concat", "gather_sum", "fused"]:
+            predictor = BRepNetPredictor(self.create_synthetic_model(["--kernel", kernel_file, "--psi_mode", psi_mode]))
+            self.assertEqual(len(predictor.input_names), 11)
+            output = predictor.predict(batch)
+            traced = predictor.trace(example_batch)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                pathname = Path(temp_dir) / "brepnet.pt"
+                torch.jit.save(traced, str(pathname))
+                loaded = torch.jit.load(str(pathname))
+            with torch.no_grad():
+                logits, embeddings = loaded(*predictor.input_tensors(batch))
+            self.assertTrue(torch.allclose(logits, output["logits"], atol=1e-5))
+            self.assertTrue(torch.allclose(embeddings, output["embeddings"], atol=1e-5))
+
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("onnx") is not None and importlib.util.find_spec("onnxruntime") is not None,
+        "Needs onnx and onnxruntime"
+    )
+    def test_onnx(self):
+        import onnxruntime
+        kernel_file = str(self.parent_dir() / "kernels/winged_edge.json")
+        example_batch = brepnet_collate_fn(make_synthetic_batch(2, kernel_file, seed=10))
+        batch = brepnet_collate_fn(make_synthetic_batch(4, kernel_file))
+        for psi_mode in ["concat", "gather_sum", "fused"]:
+            predictor = BRepNetPredictor(self.create_synthetic_model(["--kernel", kernel_file, "--psi_mode", psi_mode]))
+            output = predictor.predict(batch)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                pathname = Path(temp_dir) / "brepnet.onnx"
+                predictor.export_onnx(example_batch, pathname)
+                session = onnxruntime.InferenceSession(str(pathname), providers=["CPUExecutionProvider"])
+
+            # The features are not used by the synthetic model, so 
+            # they are not inputs of the ONNX model
+            tensors = dict(zip(predictor.input_names, predictor.input_tensors(batch)))
+            feeds = { input.name: tensors[input.name].numpy() for input in session.get_inputs() }
+            logits, embeddings = session.run(None, feeds)
+            self.assertTrue(torch.allclose(torch.from_numpy(logits), output["logits"], atol=1e-4))
+            self.assertTrue(torch.allclose(torch.from_numpy(embeddings), output["embeddings"], atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
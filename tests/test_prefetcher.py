@@ -0,0 +1,141 @@
+# System
+import unittest
+
+import torch
+from torch.utils.data import BatchSampler, DataLoader, SequentialSampler
+
+from dataloaders.brepnet_batch import BRepNetBatch
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from dataloaders.max_num_faces_sampler import MaxNumFacesSampler
+from dataloaders.prefetcher import BodyPrefetcher, PrefetchingSampler
+
+from tests.test_base import TestBase
+
+class TestPrefetcher(TestBase):
+
+    def check_batches_equal(self, batch, other_batch):
+        if isinstance(batch, BRepNetBatch):
+            batch = batch.to_dict()
+        if isinstance(other_batch, BRepNetBatch):
+            other_batch = other_batch.to_dict()
+        if isinstance(batch, torch.Tensor):
+            self.assertTrue(torch.equal(batch, other_batch))
+        elif isinstance(batch, dict):
+            self.assertEqual(batch.keys(), other_batch.keys())
+            for key in batch:
+                self.check_batches_equal(batch[key], other_batch[key])
+        elif isinstance(batch, list):
+            self.assertEqual(len(batch), len(other_batch))
+            for item, other_item in zip(batch, other_batch):
+                self.check_batches_equal(item, other_item)
+        else:
+            self.assertEqual(batch, other_batch)
+
+
+    def test_sampler_order(self):
+        dataset = self.create_json_dataset()
+        loader = DataLoader(dataset, collate_fn=brepnet_collate_fn, batch_size=2)
+
+        prefetcher = BodyPrefetcher(dataset, queue_depth=3, num_threads=2)
+        batch_sampler = BatchSampler(SequentialSampler(dataset), 2, drop_last=False)
+        prefetch_loader = DataLoader(
+            prefetcher,
+            collate_fn=brepnet_collate_fn,
+            batch_sampler=PrefetchingSampler(batch_sampler, prefetcher)
+        )
+
+        # Run twice to check the sampler can be restarted
+        for epoch in range(2):
+            batches = list(loader)
+            prefetch_batches = list(prefetch_loader)
+            self.assertEqual(len(batches), len(prefetch_batches))
+            for batch, prefetch_batch in zip(batches, prefetch_batches):
+                self.check_batches_equal(batch, prefetch_batch)
+            self.assertEqual(prefetcher.num_pending, 0)
+        prefetcher.close()
+
+
+    def test_batch_sampler(self):
+        dataset = self.create_json_dataset()
+        batch_sampler = MaxNumFacesSampler(dataset, 100)
+        prefetcher = BodyPrefetcher(dataset, queue_depth=2, num_threads=2)
+        prefetch_sampler = PrefetchingSampler(batch_sampler, prefetcher)
+        self.assertEqual(len(prefetch_sampler), len(batch_sampler))
+
+        max_num_pending = 0
+        for batch_indices, prefetch_indices in zip(batch_sampler, prefetch_sampler):
+            self.assertEqual(batch_indices, prefetch_indices)
+            max_num_pending = max(max_num_pending, prefetcher.num_pending)
+            prefetch_batch = brepnet_collate_fn([ prefetcher[i] for i in prefetch_indices ])
+            batch = brepnet_collate_fn([ dataset[i] for i in batch_indices ])
+            self.check_batches_equal(batch, prefetch_batch)
+
+        # The queue is allowed to overshoot by one batch
+        max_batch_size = max(len(b) for b in batch_sampler)
+        self.assertLessEqual(max_num_pending, prefetcher.queue_depth + max_batch_size)
+        prefetcher.close()
+
+
+    def test_queue_depth_in_dataloader(self):
+        # The DataLoader reads a whole batch before asking for the
+        # next one, so the bodies read ahead stay within the queue 
+        # depth plus one batch
+        dataset = self.create_json_dataset()
+        batch_size = 4
+        prefetcher = BodyPrefetcher(dataset, queue_depth=10, num_threads=2)
+        num_pending = []
+        def collate(data_list):
+            num_pending.append(prefetcher.num_pending)
+            return brepnet_collate_fn(data_list)
+        loader = DataLoader(
+            prefetcher,
+            collate_fn=collate,
+            batch_sampler=PrefetchingSampler(BatchSampler(SequentialSampler(dataset), batch_size, drop_last=False), prefetcher)
+        )
+        self.assertEqual(len(list(loader)), len(loader))
+        self.assertGreater(max(num_pending), 0)
+        self.assertLessEqual(max(num_pending), prefetcher.queue_depth + batch_size)
+        prefetcher.close()
+
+
+    def test_unscheduled_bodies(self):
+        dataset = self.create_json_dataset()
+        prefetcher = BodyPrefetcher(dataset, queue_depth=4, num_threads=1)
+
+        # Bodies which were not scheduled are read directly
+        self.assertTrue(torch.equal(prefetcher[1]["face_features"], dataset[1]["face_features"]))
+
+        # A body scheduled twice is returned twice
+        prefetcher.schedule(0)
+        prefetcher.schedule(0)
+        self.assertEqual(prefetcher.num_pending, 2)
+        self.assertEqual(prefetcher[0]["file_stem"], dataset.bodies[0])
+        self.assertEqual(prefetcher[0]["file_stem"], dataset.bodies[0])
+        self.assertEqual(prefetcher.num_pending, 0)
+
+        # Bodies left over when an epoch stops early are dropped
+        prefetcher.schedule(1)
+        prefetcher.clear()
+        self.assertEqual(prefetcher.num_pending, 0)
+        prefetcher.close()
+
+
+    def test_model_closes_prefetchers(self):
+        dataset = self.create_json_dataset()
+        model = self.create_model(dataset, ["--prefetch_threads", "2"])
+        model.train_dataloader()
+        prefetcher = model.prefetchers["training_set"]
+
+        # Creating the dataloader again closes the old prefetcher
+        loader = model.train_dataloader()
+        self.assertIsInstance(loader.batch_sampler, PrefetchingSampler)
+        self.assertTrue(prefetcher.executor._shutdown)
+        self.assertIs(loader.dataset, model.prefetchers["training_set"])
+
+        model.teardown("fit")
+        self.assertEqual(model.prefetchers, {})
+        self.assertTrue(loader.dataset.executor._shutdown)
+
+
+if __name__ == '__main__':
+    unittest.main()
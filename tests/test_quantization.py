@@ -0,0 +1,73 @@
+# System
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+import torch.ao.nn.quantized as nnq
+import torch.ao.nn.quantized.dynamic as nnqd
+
+from benchmarks.collate_benchmark import make_synthetic_batch
+from dataloaders.brepnet_dataset import brepnet_collate_fn
+from eval.quantize_model import compare_models, model_size_in_bytes
+from models.brepnet_predictor import BRepNetPredictor
+from models.brepnet_quantization import quantize_model, save_quantized_model, load_quantized_model
+
+from tests.test_base import TestBase
+
+class TestQuantization(TestBase):
+
+    def create_batches(self, seed):
+        kernel_file = str(self.parent_dir() / "kernels/winged_edge.json")
+        return [
+            brepnet_collate_fn(make_synthetic_batch(2, kernel_file, seed=seed + i))
+            for i in range(2)
+        ]
+
+
+    def test_quantized_modules(self):
+        model = self.create_synthetic_model()
+        quantized_model = quantize_model(model, self.create_batches(seed=10))
+
+        # The float model is not changed
+        self.assertIsInstance(model.surface_encoder.conv1[0], torch.nn.Conv2d)
+
+        encoder = quantized_model.surface_encoder.module
+        self.assertIsInstance(encoder.conv1[0], nnq.Conv2d)
+        self.assertIsInstance(encoder.fc[0], nnq.Linear)
+        self.assertIsInstance(quantized_model.curve_encoder.module.conv1[0], nnq.Conv1d)
+        self.assertIsInstance(quantized_model.layers[0].mlp.mlp.linear_0, nnqd.Linear)
+        self.assertIsInstance(quantized_model.classification_layer, nnqd.Linear)
+        self.assertLess(model_size_in_bytes(quantized_model), model_size_in_bytes(model) / 2)
+
+
+    def test_predictions_agree(self):
+        model = self.create_synthetic_model(["--psi_mode", "gather_sum"])
+        quantized_model = quantize_model(model, self.create_batches(seed=10))
+        results = compare_models(
+            {
+                "float32": model,
+                "int8": quantized_model
+            },
+            self.create_batches(seed=0)
+        )
+        self.assertEqual(results["float32"]["agreement"], 1.0)
+        self.assertGreater(results["int8"]["agreement"], 0.95)
+        self.assertGreater(results["int8"]["faces_per_second"], 0.0)
+
+
+    def test_save_and_load(self):
+        model = self.create_synthetic_model()
+        quantized_model = quantize_model(model, self.create_batches(seed=10))
+        batch = self.create_batches(seed=0)[0]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pathname = Path(tmpdir) / "brepnet_int8.pt"
+            save_quantized_model(quantized_model, pathname)
+            loaded_model = load_quantized_model(pathname)
+        expected = BRepNetPredictor(quantized_model).predict(batch)
+        output = BRepNetPredictor(loaded_model).predict(batch)
+        self.assertTrue(torch.equal(output["logits"], expected["logits"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# System
+import unittest
+
+import torch
+
+from dataloaders.brepnet_dataset import BRepNetDataset
+from eval.check_storage_precision import check_storage_precision
+
+from tests.test_base import TestBase
+
+class TestStoragePrecision(TestBase):
+
+    def test_half_precision_storage(self):
+        dataset = self.create_json_dataset()
+        opts = dataset.opts
+        for dtype, torch_dtype in [("float16", torch.float16), ("bfloat16", torch.bfloat16)]:
+            opts.grid_dtype = dtype
+            opts.feature_dtype = dtype
+            half_dataset = BRepNetDataset(opts, "training_set")
+            self.assertNotEqual(half_dataset.hash_data_for_config(), dataset.hash_data_for_config())
+            for i in range(len(dataset)):
+                body = dataset[i]
+                half_body = half_dataset[i]
+                for key in ["face_features", "face_point_grids", "coedge_point_grids", "edge_point_grids"]:
+                    self.assertEqual(half_body[key].dtype, torch_dtype)
+                    self.assertEqual(half_body[key].element_size()*2, body[key].element_size())
+                    self.assertTrue(torch.allclose(half_body[key].float(), body[key], rtol=1e-2, atol=1e-2))
+                self.assertTrue(torch.equal(half_body["face_kernel_tensor"], body["face_kernel_tensor"]))
+
+
+    def test_model_predictions(self):
+        dataset = self.create_json_dataset()
+        model = self.create_model(dataset)
+        results = check_storage_precision(model, model.opts, "training_set", half_precision_features=True)
+        self.assertEqual(results["float32"]["agreement"], 1.0)
+        self.assertGreater(results["float16"]["agreement"], 0.95)
+        self.assertLess(results["float16"]["bytes_per_body"], results["float32"]["bytes_per_body"])
+
+
+if __name__ == '__main__':
+    unittest.main()
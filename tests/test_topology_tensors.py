@@ -0,0 +1,105 @@
+# System
+import unittest
+
+import numpy as np
+import torch
+
+from benchmarks.topology_benchmark import (
+    make_synthetic_topology,
+    legacy_build_coedges_of_faces_tensor,
+    legacy_build_coedges_of_edges_tensor,
+    legacy_build_edge_grids_from_left_coedges
+)
+import utils.data_utils as data_utils
+
+from tests.test_base import TestBase
+
+class TestTopologyTensors(TestBase):
+    """
+    Check the array based construction of the topology index
+    tensors gives the same output as the original loops
+    """
+
+    def check_tensor_lists_equal(self, list1, list2):
+        self.assertEqual(len(list1), len(list2))
+        for t1, t2 in zip(list1, list2):
+            self.assertEqual(t1.dtype, t2.dtype)
+            self.assertTrue(torch.equal(t1, t2))
+
+
+    def test_coedges_of_faces_tensor(self):
+        dataset = self.create_json_dataset()
+        max_coedges_per_face = 30
+        for seed, num_faces in enumerate([1, 10, 200, 2000]):
+            body_data = make_synthetic_topology(num_faces, seed=seed, big_face_fraction=0.1)
+            Cf, Csf, Csf_offsets, face_permutation = dataset.build_coedges_of_faces_tensor(body_data, max_coedges_per_face)
+            legacy_Cf, legacy_Csf, legacy_face_permutation = legacy_build_coedges_of_faces_tensor(
+                body_data,
+                max_coedges_per_face
+            )
+            self.check_tensor_lists_equal(
+                [Cf, face_permutation],
+                [legacy_Cf, legacy_face_permutation]
+            )
+            self.check_tensor_lists_equal(
+                list(Csf.split(torch.diff(Csf_offsets).tolist())),
+                legacy_Csf
+            )
+
+        # The real bodies in the test dataset
+        for file_stem in dataset.bodies:
+            body_data = data_utils.load_npz_data(dataset.dataset_dir / (file_stem + ".npz"))
+            Cf, Csf, Csf_offsets, face_permutation = dataset.build_coedges_of_faces_tensor(body_data, max_coedges_per_face)
+            legacy_Cf, legacy_Csf, legacy_face_permutation = legacy_build_coedges_of_faces_tensor(
+                body_data,
+                max_coedges_per_face
+            )
+            self.check_tensor_lists_equal(
+                [Cf, face_permutation],
+                [legacy_Cf, legacy_face_permutation]
+            )
+            self.check_tensor_lists_equal(
+                list(Csf.split(torch.diff(Csf_offsets).tolist())),
+                legacy_Csf
+            )
+
+
+    def check_edge_tensors(self, dataset, body_data, Gc):
+        Ce = dataset.build_coedges_of_edges_tensor(body_data)
+        legacy_Ce = legacy_build_coedges_of_edges_tensor(body_data)
+        self.check_tensor_lists_equal([Ce], [legacy_Ce])
+
+        Ge = dataset.build_edge_grids_from_left_coedges(Gc, Ce, body_data)
+        legacy_Ge = legacy_build_edge_grids_from_left_coedges(Gc, Ce, body_data)
+        self.check_tensor_lists_equal([Ge], [legacy_Ge])
+
+
+    def test_coedges_of_edges_and_edge_grids(self):
+        dataset = self.create_json_dataset()
+        for seed, num_faces in enumerate([1, 10, 200, 2000]):
+            body_data = make_synthetic_topology(num_faces, seed=seed)
+
+            # The synthetic bodies always include some self-mated coedges
+            coedges_per_edge = np.bincount(body_data["coedge_to_edge"])
+            self.assertTrue(np.any(coedges_per_edge == 1))
+            Gc = torch.from_numpy(body_data["coedge_point_grids"])
+            self.check_edge_tensors(dataset, body_data, Gc)
+
+        for file_stem in dataset.bodies:
+            body_data = data_utils.load_npz_data(dataset.dataset_dir / (file_stem + ".npz"))
+            Gc = torch.from_numpy(body_data["coedge_point_grids"]).float()
+            self.check_edge_tensors(dataset, body_data, Gc)
+
+
+    def test_all_faces_big(self):
+        dataset = self.create_json_dataset()
+        body_data = make_synthetic_topology(3, big_face_fraction=1.0)
+        Cf, Csf, Csf_offsets, face_permutation = dataset.build_coedges_of_faces_tensor(body_data, 30)
+        self.assertEqual(Cf.shape, (0, 30))
+        self.assertEqual(Csf_offsets.size(0), 4)
+        self.assertEqual(Csf_offsets[-1].item(), Csf.size(0))
+        self.assertTrue(torch.equal(face_permutation, torch.arange(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
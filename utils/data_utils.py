@@ -1,5 +1,9 @@
+from contextlib import contextmanager
 import json
 import numpy as np
+import os
+from pathlib import Path
+import tempfile
 
 def load_json_data(pathname):
     """Load data from a json file"""
@@ -7,6 +11,42 @@ def load_json_data(pathname):
         return json.load(data_file)
         
 
+def current_umask():
+    """
+    The umask can only be read by setting it, so we set it
+    back straight away
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_write(pathname, mode="wb", encoding=None):
+    """
+    Open a temporary file in the same folder as pathname for writing.
+    When the block ends the file is renamed to pathname, so other
+    processes never see a partially written file.  If the block raises
+    the temporary file is removed.
+
+    The temporary file is only readable by its owner, so it is given
+    the permissions of a file created with open() before the rename.
+    This lets a cache folder be shared between users
+    """
+    pathname = Path(pathname)
+    fd, temp_pathname = tempfile.mkstemp(dir=pathname.parent, suffix=".tmp")
+    written = False
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as fp:
+            yield fp
+        os.chmod(temp_pathname, 0o666 & ~current_umask())
+        os.replace(temp_pathname, pathname)
+        written = True
+    finally:
+        if not written:
+            os.remove(temp_pathname)
+
+
 def save_json_data(pathname, data):
     """Export a data to a json file"""
     with open(pathname, 'w', encoding='utf8') as fp:
@@ -38,27 +78,48 @@ def save_npz_data_without_uvnet_features(output_pathname, data):
         savez_compressed = True
     ) 
 
-def load_npz_data(npz_file):
+# The names of the arrays in the npz files, keyed by the
+# names used in the body data
+NPZ_KEYS = {
+    "face_features": "face_features",
+    "face_point_grids": "face_point_grids",
+    "edge_features": "edge_features",
+    "coedge_features": "coedge_features",
+    "coedge_point_grids": "coedge_point_grids",
+    "coedge_lcs": "coedge_lcs",
+    "coedge_scale_factors": "coedge_scale_factors",
+    "coedge_reverse_flags": "coedge_reverse_flags",
+    "coedge_to_next": "next",
+    "coedge_to_mate": "mate",
+    "coedge_to_face": "face",
+    "coedge_to_edge": "edge"
+}
+
+def load_npz_data(npz_file, keys=None):
+    """
+    Load the arrays from an npz file.  If a list of keys is given then
+    only those arrays are read from the file
+    """
+    if keys is None:
+        keys = NPZ_KEYS.keys()
     with np.load(npz_file) as data:
-        npz_data = {
-            "face_features": data["face_features"],
-            "face_point_grids": data["face_point_grids"],
-            "edge_features": data["edge_features"],
-            "coedge_features": data["coedge_features"], 
-            "coedge_point_grids": data["coedge_point_grids"],
-            "coedge_lcs": data["coedge_lcs"],
-            "coedge_scale_factors": data["coedge_scale_factors"],
-            "coedge_reverse_flags": data["coedge_reverse_flags"],
-            "coedge_to_next": data["next"], 
-            "coedge_to_mate": data["mate"], 
-            "coedge_to_face": data["face"], 
-            "coedge_to_edge": data["edge"]
-        }
+        npz_data = { key: data[NPZ_KEYS[key]] for key in keys }
     return npz_data
 
 
-def load_labels(label_pathname):
+def load_labels(label_pathname, label_store=None):
+    """
+    Load the segmentation labels for one body.  If a label store built
+    from the folder of the seg file is given and it holds the body, the 
+    labels are read from the store.  Otherwise the seg file is read.
+    See dataloaders/label_store.py
+    """
+    label_pathname = Path(label_pathname)
+    if label_store is not None and \
+            label_store.label_dir == label_pathname.parent.resolve() and \
+            label_pathname.stem in label_store:
+        return label_store.get(label_pathname.stem).numpy()
     labels = np.loadtxt(label_pathname, dtype=np.int64)
     if labels.ndim == 0:
         labels = np.expand_dims(labels, 0)
-    return labels
\ No newline at end of file
+    return labels
\ No newline at end of file